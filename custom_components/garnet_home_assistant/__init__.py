@@ -7,14 +7,23 @@ from dataclasses import dataclass
 
 import logging
 
+import voluptuous as vol
+
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
-from homeassistant.core import HomeAssistant 
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse
 from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.device_registry import DeviceEntry
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
-
-from .const import DOMAIN
+from homeassistant.util import dt as dt_util
+
+from .api import GarnetAPI, cache_store
+from .const import (
+    DOMAIN, CONF_ACCOUNT, CONF_SIA_WORKERS, CONF_SIA_TCP, CONF_SIA_JOURNAL, CONF_SIA_RCVBUF, CONF_SIA_SIDECAR, CONF_SIA_PORT,
+    CONF_SIA_BIND_ADDRESS, CONF_SIA_ALLOWED_NETWORKS,
+    SERVICE_REPLAY_JOURNAL, ATTR_SPEED, ATTR_SINCE, ATTR_RETIME
+)
 from .coordinator import GarnetPanelIntegrationCoordinator
 
 
@@ -23,12 +32,24 @@ _LOGGER = logging.getLogger(__name__)
 # Platforms required for the integration
 PLATFORMS: list[Platform] = [Platform.SENSOR, Platform.ALARM_CONTROL_PANEL, Platform.SWITCH, Platform.BUTTON]
 
+# Opciones del receptor SIA compartido. Se aplican reiniciando el receptor, no hace falta recargar la integracion
+RECEIVER_OPTIONS = {CONF_SIA_WORKERS, CONF_SIA_TCP, CONF_SIA_JOURNAL, CONF_SIA_RCVBUF, CONF_SIA_SIDECAR, CONF_SIA_PORT,
+                    CONF_SIA_BIND_ADDRESS, CONF_SIA_ALLOWED_NETWORKS}
+
+REPLAY_JOURNAL_SCHEMA = vol.Schema({
+    vol.Optional(CONF_ACCOUNT): cv.string,
+    vol.Optional(ATTR_SPEED, default=1.0): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional(ATTR_SINCE): cv.datetime,
+    vol.Optional(ATTR_RETIME, default=True): cv.boolean,
+})
+
 
 @dataclass
 class RuntimeData:
     """Class to hold Integration data."""
     coordinator: DataUpdateCoordinator
     cancel_update_listener: Callable
+    options: dict                   # Opciones con las que se levanto, para saber que cambio
 
 
 async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> bool:
@@ -45,17 +66,42 @@ async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> b
                                                                                         # See config_flow for defining an options setting that 
                                                                                         # shows up as configure on the integration.
     
-    hass.data[DOMAIN][config_entry.entry_id] = RuntimeData(coordinator, cancel_update_listener) # Add the coordinator and update listener to hass data to make
+    hass.data[DOMAIN][config_entry.entry_id] = RuntimeData(coordinator, cancel_update_listener, dict(config_entry.options)) # Add the coordinator and update listener to hass data to make
                                                                                                 # accessible throughout your integration
                                                                                                 # Note: this will change on HA2024.6 to save on the config entry.
     await hass.config_entries.async_forward_entry_setups(config_entry, PLATFORMS)
+    if(not hass.services.has_service(DOMAIN, SERVICE_REPLAY_JOURNAL)):           # El servicio es uno solo para todas las entradas
+        hass.services.async_register(DOMAIN, SERVICE_REPLAY_JOURNAL, _async_replay_journal, schema=REPLAY_JOURNAL_SCHEMA,
+                                     supports_response=SupportsResponse.OPTIONAL)
     return True
 
 
+async def _async_replay_journal(call: ServiceCall) -> ServiceResponse:
+    """Reproduce el journal SIA en las entidades de una cuenta, o de todas si no se indica"""
+    since = call.data.get(ATTR_SINCE)
+    replayed = {}
+    for runtime in list(call.hass.data.get(DOMAIN, {}).values()):
+        api = runtime.coordinator.api
+        if(call.data.get(CONF_ACCOUNT) not in (None, api.account)):
+            continue
+        replayed[api.account] = await api.async_replay_journal(speed=call.data[ATTR_SPEED], retime=call.data[ATTR_RETIME],
+                                                               since=dt_util.as_timestamp(since) if since is not None else None)
+    _LOGGER.info("[_async_replay_journal] Replayed SIA frames per account: %s", str(replayed))
+    return {"replayed": replayed}
+
+
 async def _async_update_listener(hass: HomeAssistant, config_entry):
-    """Handles config options update."""
+    """Handles config options update. Las opciones del receptor SIA se aplican reiniciandolo, sin recargar"""
+    runtime = hass.data[DOMAIN][config_entry.entry_id]
+    changed = {key for key in config_entry.options.keys() | runtime.options.keys() if config_entry.options.get(key) != runtime.options.get(key)}
+    runtime.options = dict(config_entry.options)
+    if(changed & RECEIVER_OPTIONS):
+        runtime.coordinator.apply_receiver_options(config_entry.options)
+        await runtime.coordinator.api.async_reconfigure_receiver()
+        if(changed <= RECEIVER_OPTIONS):
+            return
     await hass.config_entries.async_reload(config_entry.entry_id)       # Reload the integration when the options change.
-                                                                        # TODO: Debe quitar el listener SIA  y reemplazarlo por el nuevo. Por el momento se hace solo
+                                                                        # El receptor SIA retiene los eventos de la cuenta durante la recarga
 
 
 async def async_remove_config_entry_device(hass: HomeAssistant, config_entry: ConfigEntry, device_entry: DeviceEntry) -> bool:
@@ -63,11 +109,22 @@ async def async_remove_config_entry_device(hass: HomeAssistant, config_entry: Co
     return True
 
 
+async def async_remove_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> None:
+    """La entrada se borra, no se va a volver a registrar. Se descartan los eventos retenidos de la cuenta y la cache del panel"""
+    if(GarnetAPI.messageserver is not None and not GarnetAPI.messageserver.closed):
+        GarnetAPI.messageserver.remove(config_entry.data[CONF_ACCOUNT])
+    await cache_store(hass, config_entry.data[CONF_ACCOUNT]).async_remove()
+
+
 async def async_unload_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> bool:
     """Unload a config entry. This is called when you remove your integration or shutdown HA."""
     
-    hass.data[DOMAIN][config_entry.entry_id].cancel_update_listener()       # Remove the config options update listener
+    runtime = hass.data[DOMAIN][config_entry.entry_id]
+    runtime.cancel_update_listener()                        # Remove the config options update listener
     unload_ok = await hass.config_entries.async_unload_platforms(config_entry, PLATFORMS)   # Unload platforms
     if unload_ok:
+        await runtime.coordinator.api.async_disconnect()    # El receptor SIA retiene los eventos hasta que la entrada se vuelva a registrar
         hass.data[DOMAIN].pop(config_entry.entry_id)        # Remove the config entry from the hass data object.
+        if(len(hass.data[DOMAIN]) == 0):
+            hass.services.async_remove(DOMAIN, SERVICE_REPLAY_JOURNAL)
     return unload_ok                                        # Return that unloading was successful.
@@ -1,5 +1,6 @@
 """API Placeholder."""
 
+import asyncio
 import logging
 
 from collections.abc import Callable
@@ -13,14 +14,29 @@ from .const import (
     COMM_BASE_ID,
     DEFAULT_KEEPALIVE_INTERVAL,
     DEFAULT_REFRESH_INTERVAL,
+    DEFAULT_COALESCE_DELAY,
+    DEFAULT_SIA_WORKERS,
+    DEFAULT_SIA_TCP,
+    DEFAULT_SIA_JOURNAL,
+    DEFAULT_SIA_RCVBUF,
+    DEFAULT_SIA_SIDECAR,
+    DEFAULT_SIA_BIND_ADDRESS,
+    DEFAULT_SIA_ALLOWED_NETWORKS,
+    SIA_SIDECAR_SOCKET,
+    SIA_JOURNAL_DIR,
     REFRESHBUTTON_BASE_ID,
-    DEFAULT_UDP_PORT
+    DEFAULT_UDP_PORT,
+    CACHE_STORE_VERSION,
+    CACHE_SAVE_DELAY
 )
 from .httpapi import HTTP_API, GarnetEntity, DeviceType
 
 from homeassistant.core import HomeAssistant 
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.storage import Store
 
 from .siaserver import SIAUDPServer, siacode
+from .metrics import MetricsRegistry
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -35,6 +51,14 @@ class GarnetAPI:
     __coordinator_update_callback: Callable = None
     keepalive_interval: int = DEFAULT_KEEPALIVE_INTERVAL
     refresh_interval: int = DEFAULT_REFRESH_INTERVAL
+    coalesce_delay: float = DEFAULT_COALESCE_DELAY / 1000
+    sia_workers: int = DEFAULT_SIA_WORKERS
+    sia_tcp: bool = DEFAULT_SIA_TCP
+    sia_journal: bool = DEFAULT_SIA_JOURNAL
+    sia_rcvbuf: int = DEFAULT_SIA_RCVBUF
+    sia_sidecar: bool = DEFAULT_SIA_SIDECAR
+    sia_bind_address: str = DEFAULT_SIA_BIND_ADDRESS
+    sia_allowed_networks: str = DEFAULT_SIA_ALLOWED_NETWORKS
 
     @property
     def controller_name(self) -> str:
@@ -54,72 +78,246 @@ class GarnetAPI:
         self.system = None
         self.hass = hass
         self.sia_port = DEFAULT_UDP_PORT
+        self.__pending_update = None
+        self.httpapi: HTTP_API | None = None
+        self.store = cache_store(hass, account)
+        self.reload_callback: Callable | None = None       # Recarga la integracion si cambian las particiones o zonas del panel
+        self.revalidate_task: asyncio.Task | None = None
+        self.status_refresh_task: asyncio.Task | None = None
+        self.connection_monitor_task: asyncio.Task | None = None
+        self.metrics = MetricsRegistry()
+        self.__sia_events = self.metrics.counter("sia_events")
+        self.__state_changes = self.metrics.counter("sia_state_changes")
+        self.__stale_events = self.metrics.counter("sia_stale_events")
+        self.__coordinator_updates = self.metrics.counter("coordinator_updates")
+        self.__refresh_time = self.metrics.histogram("status_refresh_ms")
+
+
+    async def async_connect(self, use_cache: bool = True) -> bool:
+        """Levanta el receptor SIA en el event loop y luego conecta la API HTTP. Devuelve estado de conexion al coordinador.
+           Con use_cache = False no se usa la cache en disco y la conexion valida las credenciales contra la nube"""
+        # Crea el socket UDP para recibir mensajes SIA. Solo uno no importa la cantidad de integraciones activas
+        # Si falla no sigue. El bind es sincronico asi que un error de puerto se informa sin esperas
+        # El sidecar, la cantidad de workers, el listener TCP, el journal, el buffer de recepcion, la direccion y las redes permitidas
+        # los define la primera integracion que levanta el receptor. Un cambio de opciones posterior los aplica con async_reconfigure_receiver
+        if(GarnetAPI.messageserver == None or GarnetAPI.messageserver.closed):       # Cerrado al quedar sin suscriptores
+            try:
+                GarnetAPI.messageserver = SIAUDPServer(**self.__receiver_settings())
+                await GarnetAPI.messageserver.async_start()
+            except Exception as err:
+                GarnetAPI.messageserver = None
+                _LOGGER.exception(err)
+                raise APIConnectionError(err)
+        connected = await self.__async_connect_http(use_cache)
+        GarnetAPI.messageserver.add(self.__sia_processing_task, self.account, snapshot=self.__snapshot_time, status=self.__receiver_status)
+        return connected
 
 
-    def connect(self) -> bool:
-        """Devuelve estado de conexion al coordinador"""
+    async def async_check_credentials(self) -> None:
+        """Valida usuario, clave y panel contra la nube sin levantar el receptor SIA ni tareas de fondo. Para el config flow"""
+        httpapi = HTTP_API(email=self.email, pwd=self.password, panelid=self.systemid, controller=self.controller_name,
+                           session=async_get_clientsession(self.hass))
         try:
-            # Crea el socket UDP para recibir mensajes SIA. Solo uno no importa la cantidad de integraciones activas
-            # Si falla no sigue.
-            if(GarnetAPI.messageserver == None):
-                GarnetAPI.messageserver = SIAUDPServer(port=self.sia_port) 
-
-            # Obtiene el modelo de datos de la WEB de garnet
-            # SI no falla recien se registra como listener de mensajes SIA e informa que esta conectado
-            self.httpapi = HTTP_API(email=self.email, pwd=self.password, panelid=self.systemid, controller=self.controller_name)    
-            self.httpapi.connect()
-            GarnetAPI.messageserver.add(self.__sia_processing_task, self.account)
-            self.connected = True
+            await httpapi.async_check_access()
+        except Exception as err:
+            _LOGGER.exception(err)
+            raise APIConnectionError(err)
+        finally:
+            httpapi.close()
+
 
-            # Finalmente crea la tarea de monitoreo de keepalive
-            self.status_refresh_task = threading.Thread(target=self.__status_refresh_task, name="statusrefresh")
-            self.status_refresh_task.start()
+    async def async_replay_journal(self, speed: float = 1.0, since: float | None = None, retime: bool = True) -> int:
+        """Reproduce las tramas guardadas de esta cuenta como si llegaran del panel. Sirve para reproducir incidentes.
+           Con retime los eventos toman el momento de la reproduccion, sino el modelo descarta los anteriores a su estado"""
+        return await GarnetAPI.messageserver.async_replay(self.hass.config.path(SIA_JOURNAL_DIR), speed=speed, account=self.account, since=since,
+                                                          retime=retime)
 
-            # Finalmente crea la tarea de monitoreo de keepalive
-            self.connection_monitor_task = threading.Thread(target=self.__connection_monitor_task, name="keepalive")
-            self.connection_monitor_task.start()
 
-            return self.connected
+    async def __async_connect_http(self, use_cache: bool = True) -> bool:
+        """Obtiene el modelo de datos y lanza las tareas de refresco y keepalive. Si hay cache en disco las entidades
+           se crean con ella y la WEB de garnet se consulta en segundo plano, sino se espera la consulta completa"""
+        if(self.httpapi is not None):
+            self.httpapi.close()                        # Reintento de conexion, la instancia anterior deja de renovar su token
+        try:
+            self.httpapi = HTTP_API(email=self.email, pwd=self.password, panelid=self.systemid, controller=self.controller_name,
+                                    session=async_get_clientsession(self.hass), metrics=self.metrics)
+            cached = await self.store.async_load() if use_cache else None
+            if(cached is not None and self.httpapi.restore(cached)):
+                _LOGGER.info("[__async_connect_http] Panel %s restored from cache, revalidating in background", self.systemid)
+                self.revalidate_task = self.hass.async_create_background_task(self.__revalidate(), name="garnet-revalidate")
+            else:
+                await self.httpapi.async_connect()
+                self.__save_cache()
+            self.connected = True
         except Exception as err:                        #TODO: manejar diferentes tipos de excepciones
             _LOGGER.exception(err)
             raise APIConnectionError(err)
+        self.status_refresh_task = self.hass.async_create_background_task(self.__status_refresh_task(), name="statusrefresh")
+        self.connection_monitor_task = self.hass.async_create_background_task(self.__connection_monitor_task(), name="keepalive")
+        return self.connected
+
+
+    async def __revalidate(self) -> None:
+        """Actualiza con la WEB de garnet el modelo restaurado de la cache. Si falla se sigue con la cache,
+           el refresco periodico y los eventos SIA la ponen al dia"""
+        try:
+            if(await self.httpapi.async_revalidate()):
+                _LOGGER.info("[__revalidate] Partitions or zones of panel %s changed, reloading", self.systemid)
+                await self.store.async_save(self.httpapi.snapshot())   # La integracion recargada debe leer la configuracion nueva
+                if(self.reload_callback is not None):
+                    self.reload_callback()
+            self.__schedule_update(immediate=True)
+            self.__save_cache()
+        except Exception as err:
+            _LOGGER.warning("[__revalidate] Cannot revalidate cached panel data, using cache: %s", str(err))
+
+
+    def __save_cache(self) -> None:
+        """Agenda la escritura de la cache. Los cambios seguidos se escriben juntos. Corre en el event loop"""
+        if(self.httpapi is not None and self.httpapi.devices is not None):
+            self.store.async_delay_save(self.httpapi.snapshot, CACHE_SAVE_DELAY)
+
+
+    def __cancel_tasks(self) -> None:
+        """Detiene las tareas de refresco y keepalive y la renovacion del token. Un request en curso se cancela"""
+        for task in (self.status_refresh_task, self.connection_monitor_task, self.revalidate_task):
+            if(task is not None):
+                task.cancel()
+        if(self.httpapi is not None):
+            self.httpapi.close()
+        self.status_refresh_task = None
+        self.connection_monitor_task = None
+        self.revalidate_task = None
 
 
     def disconnect(self) -> bool:
-        """Devuelve estado de desconexion al coordinador."""
-        GarnetAPI.messageserver.remove(self.client)
+        """Devuelve estado de desconexion al coordinador. Quita la cuenta del receptor SIA, debe llamarse desde el event loop"""
         self.connected = False
+        self.__cancel_tasks()
+        if(self.__pending_update is not None):
+            self.__pending_update.cancel()
+            self.__pending_update = None
+        if(GarnetAPI.messageserver is not None and not GarnetAPI.messageserver.closed):
+            GarnetAPI.messageserver.remove(self.account)
         return True
 
 
+    async def async_disconnect(self) -> bool:
+        """Desconexion por descarga de la integracion. El receptor SIA sigue abierto y retiene los eventos de la cuenta
+           hasta que la integracion recargada se vuelva a registrar, asi una recarga no pierde alarmas"""
+        self.connected = False
+        self.__cancel_tasks()
+        if(self.__pending_update is not None):
+            self.__pending_update.cancel()
+            self.__pending_update = None
+        if(self.httpapi is not None and self.httpapi.devices is not None):
+            await self.store.async_save(self.httpapi.snapshot())   # La cache queda al dia para la integracion recargada
+        if(GarnetAPI.messageserver is not None and not GarnetAPI.messageserver.closed):
+            GarnetAPI.messageserver.release(self.account)
+        return True
+
+
+    def __receiver_settings(self) -> dict:
+        """Configuracion del receptor SIA segun las opciones de esta cuenta"""
+        return {"port": self.sia_port, "workers": self.sia_workers, "tcp": self.sia_tcp,
+                "journal": self.hass.config.path(SIA_JOURNAL_DIR) if self.sia_journal else None,
+                "rcvbuf": self.sia_rcvbuf * 1024,
+                "sidecar": self.hass.config.path(SIA_SIDECAR_SOCKET) if self.sia_sidecar else None,
+                "address": self.sia_bind_address,
+                "networks": self.sia_allowed_networks.split(",")}
+
+
+    async def async_reconfigure_receiver(self) -> None:
+        """Aplica las opciones de recepcion de esta cuenta al receptor SIA compartido sin recargar la integracion.
+           Vale para todas las cuentas, la ultima configuracion aplicada es la que queda. Si el bind falla la supervision reintenta"""
+        if(GarnetAPI.messageserver is None or GarnetAPI.messageserver.closed):
+            return
+        try:
+            await GarnetAPI.messageserver.async_reconfigure(**self.__receiver_settings())
+        except Exception as err:
+            _LOGGER.error("[async_reconfigure_receiver] SIA receiver cannot listen @ %s:%d (%s). Retrying in background", self.sia_bind_address or "*", self.sia_port, str(err))
+
+
     def setcallback(self, message_callback: Callable | None = None ) -> bool:
         """Aegistra la funcion de update de estado de entidades."""
         self.__coordinator_update_callback = message_callback
 
 
-    def __connection_monitor_task(self):
-        """Thread para monitoreo de la conexion"""
-        time.sleep(self.keepalive_interval)
+    def __snapshot_time(self) -> float | None:
+        """Momento (epoch) del ultimo estado obtenido por HTTP. El receptor lo compara con el timestamp corregido de las tramas"""
+        if(not self.connected):
+            return None
+        return self.httpapi.status_time
+
+
+    def __receiver_status(self, active: bool) -> None:
+        """El receptor SIA se detuvo o se recupero. Corre en el event loop"""
+        s = self.httpapi.__get_device_by_id__(COMM_BASE_ID)
+        s.native_state = self.__comm_state(s)
+        self.__schedule_update(immediate=True)
+
+
+    def __comm_state(self, s: GarnetEntity) -> str:
+        """Estado del comunicador: Degraded si el receptor SIA esta caido, sino segun la ultima trama recibida"""
+        if(GarnetAPI.messageserver is None or GarnetAPI.messageserver.degraded):
+            return "Degraded"
+        seen = GarnetAPI.messageserver.last_seen.get(self.account, 0)
+        t = time.time() - max(s.uptime, seen)                  # Los keep alive no llegan al callback, los registra el receptor
+        return "Disconnected" if t > int(1.5 *self.keepalive_interval) else "Connected"
+
+
+    def __schedule_update(self, immediate: bool = False) -> None:
+        """Pide publicar el estado al coordinador. Puede llamarse desde cualquier thread.
+           Los cambios que llegan dentro de coalesce_delay se publican juntos en una sola actualizacion"""
+        if(threading.get_ident() == self.hass.loop_thread_id):
+            self.__request_update(immediate)
+        else:
+            self.hass.loop.call_soon_threadsafe(self.__request_update, immediate)
+
+
+    def __request_update(self, immediate: bool) -> None:
+        """Agenda la publicacion. Corre en el event loop"""
+        if(immediate):
+            self.__publish_update()
+        elif(self.__pending_update is None):
+            if(self.coalesce_delay > 0):
+                self.__pending_update = self.hass.loop.call_later(self.coalesce_delay, self.__publish_update)
+            else:
+                self.__pending_update = self.hass.loop.call_soon(self.__publish_update)     # Una por vuelta del loop
+
+
+    def __publish_update(self) -> None:
+        """Envia el estado de los dispositivos al coordinador"""
+        if(self.__pending_update is not None):
+            self.__pending_update.cancel()
+            self.__pending_update = None
+        self.__coordinator_updates.inc()
+        self.__coordinator_update_callback(self.httpapi.devices)
+        self.__save_cache()
+
+
+    async def __connection_monitor_task(self):
+        """Tarea para monitoreo de la conexion"""
+        await asyncio.sleep(self.keepalive_interval)
         s = self.httpapi.__get_device_by_id__(COMM_BASE_ID)
         while(self.connected):
             try:
-                time.sleep(self.keepalive_interval)    
-                t = time.time() - s.uptime
-                n = "Disconnected" if t > int(1.5 *self.keepalive_interval) else "Connected"
-                _LOGGER.debug("Checking last keepalive received was %d seconds before, previous state was %s",t, s.native_state)
+                await asyncio.sleep(self.keepalive_interval)
+                n = self.__comm_state(s)
+                _LOGGER.debug("Checking communicator state is %s, previous state was %s", n, s.native_state)
                 if n != s.native_state:
                     s.native_state = n
-                    self.__coordinator_update_callback(self.httpapi.devices)
+                    self.__schedule_update()
             except Exception as err:                        
                 _LOGGER.exception(err)
 
 
-    def __status_refresh_task(self):
-        """Thread para refresco de estado"""
-        time.sleep(self.refresh_interval) 
+    async def __status_refresh_task(self):
+        """Tarea para refresco de estado"""
+        await asyncio.sleep(self.refresh_interval)
         while(self.connected):
             try:
-                time.sleep(self.refresh_interval)
+                await asyncio.sleep(self.refresh_interval)
                 disarm = True  
                 for device in self.httpapi.devices:
                     if device.device_type == DeviceType.PARTITION:
@@ -128,76 +326,105 @@ class GarnetAPI:
                             disarm = False
                 if disarm:
                     _LOGGER.debug("Actualizando estado de sensores")
-                    self.httpapi.get_state()
-                    self.__coordinator_update_callback(self.httpapi.devices)
+                    start = time.perf_counter()
+                    await self.httpapi.async_get_state()
+                    self.__refresh_time.observe((time.perf_counter() - start) * 1000)
+                    self.__schedule_update()
                 else:
                     _LOGGER.debug("No actualiza estado de sensores por estar alguna particion armada")
             except Exception as err:                        
                 _LOGGER.exception(err)
 
 
-    def __sia_processing_task(self, partition: int = 0, zone: int = 0, user: int = 0, action: siacode = siacode.none) -> None:
-        """Funcion que recibe notificaciones del cliente. No debe ser bloqueante"""
+    def __sia_processing_task(self, partition: int = 0, zone: int = 0, user: int = 0, action: siacode = siacode.none, description: str = None,
+                              timestamp: float | None = None) -> None:
+        """Funcion que recibe notificaciones del cliente. No debe ser bloqueante.
+           timestamp es el momento del evento (epoch). Un dispositivo con estado posterior (por ejemplo una consulta HTTP) no se modifica"""
         update = False
+        self.__sia_events.inc()
         _LOGGER.debug("[__sia_processing_task] Receiving action:%s, partition:%d, zone:%d and  user:%d",str(action), partition, zone, user)
         device = self.httpapi.__get_device_by_id__(COMM_BASE_ID)
         device.uptime = time.time()                             # 25/05/30 Ahora se actualiza con cualquier mensaje no solo keep alive
-        if(action == siacode.bypass): # bypass de una zona
+        if(timestamp is None):
+            timestamp = device.uptime
+
+        def fresh(d: GarnetEntity) -> bool:
+            if(d.accepts(timestamp)):
+                return True
+            self.__stale_events.inc()
+            _LOGGER.debug("[__sia_processing_task] %s from %s is older than the state of %s, discarded", str(action), time.strftime("%H:%M:%S", time.localtime(timestamp)), d.name)
+            return False
+        if(action in (siacode.bypass, siacode.unbypass, siacode.triggerzone, siacode.restorezone) and self.httpapi.__get_device_by_id__(ZONE_BASE_ID + zone) is None):
+            _LOGGER.info("[__sia_processing_task] Zone %d from %s is not configured", zone, str(action))   # Por ejemplo panico de teclado (zona 0)
+        elif(action in (siacode.trigger, siacode.restore) and self.httpapi.__get_device_by_id__(PARTITION_BASE_ID + partition) is None):
+            _LOGGER.info("[__sia_processing_task] Partition %d from %s is not configured", partition, str(action))
+        elif(action == siacode.event): # Evento conocido que no cambia el estado
+            _LOGGER.info("[__sia_processing_task] Panel event '%s' on partition %d, zone/user %d", description, partition, zone)
+        elif(action == siacode.bypass): # bypass de una zona
             device = self.httpapi.__get_device_by_id__(ZONE_BASE_ID + zone)
-            device.native_state = device.native_state | 2
-            update = True
+            if(fresh(device)):
+                device.native_state = device.native_state | 2
+                update = True
         elif(action == siacode.unbypass): # desactiva bypass de una zona
             device = self.httpapi.__get_device_by_id__(ZONE_BASE_ID + zone)
-            device.native_state = device.native_state & 5
-            update = True
+            if(fresh(device)):
+                device.native_state = device.native_state & 5
+                update = True
         elif(action == siacode.group_bypass): # armado de todas las zonas
             for d in self.httpapi.devices:
-                if d.device_type == DeviceType.ZONE:
+                if d.device_type == DeviceType.ZONE and fresh(d):
                     d.native_state = d.native_state | 4
-            update = True
+                    update = True
         elif(action == siacode.group_unbypass): # desarmado de todas las zonas
             for d in self.httpapi.devices:
-                if d.device_type == DeviceType.ZONE:
+                if d.device_type == DeviceType.ZONE and fresh(d):
                     d.native_state = d.native_state & 3
-            update = True
+                    update = True
         elif(action == siacode.present_arm or action == siacode.arm or action == siacode.keyboard_arm): # armado de particion
             device = self.httpapi.__get_device_by_id__(PARTITION_BASE_ID + partition)
-            f = False
-            for z in self.httpapi.devices: 
-                if(z.device_type == DeviceType.ZONE and z.native_state & 2): f = True  # Si hay alguna zona bypasseada es home sino away
-            device.native_state = "home" if f else "away"
-            if(not f):
-                for d in self.httpapi.devices:
-                    if d.device_type == DeviceType.ZONE:
-                        d.native_state = (d.native_state | 4) & 5  # Bloquea las zonas
-            update = True
+            if(fresh(device)):
+                f = False
+                for z in self.httpapi.devices: 
+                    if(z.device_type == DeviceType.ZONE and z.native_state & 2): f = True  # Si hay alguna zona bypasseada es home sino away
+                device.native_state = "home" if f else "away"
+                if(not f):
+                    for d in self.httpapi.devices:
+                        if d.device_type == DeviceType.ZONE and fresh(d):
+                            d.native_state = (d.native_state | 4) & 5  # Bloquea las zonas
+                update = True
         elif(action == siacode.present_disarm or action == siacode.disarm or action == siacode.keyboard_disarm or action == siacode.alarm_disarm): # desarmadp
             device = self.httpapi.__get_device_by_id__(PARTITION_BASE_ID + partition)
-            device.native_state = "disarmed"
-            for d in self.httpapi.devices:
-                if d.device_type == DeviceType.ZONE:
-                    d.native_state = d.native_state & 3
-            update = True
+            if(fresh(device)):
+                device.native_state = "disarmed"
+                for d in self.httpapi.devices:
+                    if d.device_type == DeviceType.ZONE and fresh(d):
+                        d.native_state = d.native_state & 3
+                update = True
         elif(action == siacode.triggerzone):  # Alarma en una zona
             device = self.httpapi.__get_device_by_id__(ZONE_BASE_ID + zone)
-            device.alarmed = True
-            update = True
+            if(fresh(device)):
+                device.alarmed = True
+                update = True
         elif(action == siacode.restorezone): # Reestablecimiento de alarma en zona
             device = self.httpapi.__get_device_by_id__(ZONE_BASE_ID + zone)
-            device.alarmed = False
-            update = True
+            if(fresh(device)):
+                device.alarmed = False
+                update = True
         elif(action == siacode.trigger): # Alarma en particion
             device = self.httpapi.__get_device_by_id__(PARTITION_BASE_ID + partition)
-            device.alarmed = True
-            update = True
+            if(fresh(device)):
+                device.alarmed = True
+                update = True
         elif(action == siacode.restore): # Se desalarma particion
             device = self.httpapi.__get_device_by_id__(PARTITION_BASE_ID + partition)
-            device.alarmed = False
-            update = True
+            if(fresh(device)):
+                device.alarmed = False
+                update = True
         elif(action != siacode.keepalive):
             _LOGGER.info("Mensaje con " + str(action) + " no se esta procesando") # Se trata de un codigo que no se procesa
         if(update):
-            self.__coordinator_update_callback(self.httpapi.devices)
+            self.__state_changes.inc()
+            self.__schedule_update()
 
 
     def get_devices(self) -> list[GarnetEntity]:
@@ -207,52 +434,44 @@ class GarnetAPI:
     
 
     async def async_force_device_status(self, device_id: int, new_state: any) -> None:
-        """Genera la accion sobre el device fisico. Version asincronica"""
+        """Genera la accion sobre el device fisico"""
         device = self.httpapi.__get_device_by_id__(device_id)
         if device.device_type == DeviceType.PARTITION:
             _LOGGER.debug("[async_force_device_status] API receives notification for partition to change with ID %i changed from %s to %s ", device_id, str(device.native_state), str(new_state))
             if(new_state == "home"):
                 try:
-                    result = await self.hass.async_add_executor_job(self.httpapi.arm_system, device_id, "home")
+                    result = await self.httpapi.async_arm_system(device_id, "home")
                 except Exception as err:
                     _LOGGER.exception(err)
             elif(new_state == "away"):
                 try:
-                    result = await self.hass.async_add_executor_job(self.httpapi.arm_system, device_id, "away")
+                    result = await self.httpapi.async_arm_system(device_id, "away")
                 except Exception as err:
                     _LOGGER.exception(err)
             elif(new_state == "disarmed"):
                 try:
-                    result = await self.hass.async_add_executor_job(self.httpapi.disarm_system, device_id)
+                    result = await self.httpapi.async_disarm_system(device_id)
                 except Exception as err:
                     _LOGGER.exception(err)
         if device.device_type == DeviceType.HOWLER:
             _LOGGER.debug("[async_force_device_status] API receives notification for howler with ID %i changed from %s to %s ", device_id, device.native_state, new_state)
             try:
-                result = await self.hass.async_add_executor_job(self.httpapi.horn_control, new_state)
-                device.native_state = new_state
+                result = await self.httpapi.async_horn_control(new_state)
+                if(device.accepts(time.time())):
+                    device.native_state = new_state
             except Exception as err:
                 _LOGGER.exception(err)
-        self.__coordinator_update_callback(self.httpapi.devices)
-
-
-    def force_device_status(self, device_id: int, new_state: any) -> None:
-        """Genera la accion sobre el device fisico. La funcion sincronica solo con botones"""
-        device = self.httpapi.__get_device_by_id__(device_id)
         if device.device_type == DeviceType.BUTTON:
-            _LOGGER.debug("[force_device_status] API receives notification for button %s with ID %i activation", device.name, device_id)
-            if(device_id == REFRESHBUTTON_BASE_ID):
-                try:
-                    self.httpapi.get_state()
-                except Exception as err:
-                    _LOGGER.exception(err)
-            else:
-                p = self.httpapi.__get_device_by_id__(PARTITION_BASE_ID + 1)
-                try:
-                    result = self.httpapi.report_emergency(device.name, p.device_id, p.name)
-                except Exception as err:
-                    _LOGGER.exception(err)
-        self.__coordinator_update_callback(self.httpapi.devices)
+            _LOGGER.debug("[async_force_device_status] API receives notification for button %s with ID %i activation", device.name, device_id)
+            try:
+                if(device_id == REFRESHBUTTON_BASE_ID):
+                    await self.httpapi.async_get_state()
+                else:
+                    p = self.httpapi.__get_device_by_id__(PARTITION_BASE_ID + 1)
+                    await self.httpapi.async_report_emergency(device.name, p.device_id, p.name)
+            except Exception as err:
+                _LOGGER.exception(err)
+        self.__schedule_update(immediate=True)
 
 
     def get_device_unique_id(self, device_id: str, device_type: DeviceType) -> str:
@@ -260,6 +479,11 @@ class GarnetAPI:
         return f"{DOMAIN}_{self.controller_name}_{device_id}"
 
 
+def cache_store(hass: HomeAssistant, account: str) -> Store:
+    """Cache en disco del modelo de datos de un panel"""
+    return Store(hass, CACHE_STORE_VERSION, f"{DOMAIN}.{account.replace('.', '_')}")
+
+
 class APIAuthError(Exception):
     """Exception class for auth error."""
 
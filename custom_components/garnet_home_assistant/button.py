@@ -71,9 +71,9 @@ class EmergencyButton(CoordinatorEntity, ButtonEntity):
         return attrs
 
 
-    def press(self) -> None:
+    async def async_press(self) -> None:
         """Handle the button press."""
-        self.coordinator.set_device_data(self.device_id, True)
+        await self.coordinator.async_force_device_status(self.device_id, True)
 
 
     @property
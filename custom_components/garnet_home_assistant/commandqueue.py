@@ -0,0 +1,84 @@
+"""Cola de comandos por panel hacia la nube de Garnet.
+
+La nube responde "Ya hay un comando en progreso" si dos comandos del mismo panel se superponen, asi que se ejecuta uno
+por vez. Los comandos del usuario (armar, desarmar, sirena, emergencia) pasan antes que las consultas de fondo y las
+consultas de estado pendientes se agrupan en una sola.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from .metrics import MetricsRegistry
+
+
+_LOGGER = logging.getLogger(__name__)
+
+PRIORITY_USER = 0       # Comandos pedidos por el usuario
+PRIORITY_POLL = 1       # Consultas de estado de fondo
+
+
+class PanelCommandQueue:
+    """Ejecuta de a un comando por vez en orden de prioridad y luego de llegada. Corre en el event loop"""
+
+    def __init__(self, metrics: MetricsRegistry | None = None) -> None:
+        self.busy = False
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.order = itertools.count()
+        self.state_task: asyncio.Task | None = None
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.__commands = self.metrics.counter("http_commands")
+        self.__merged = self.metrics.counter("http_polls_merged")
+        self.__wait_time = self.metrics.histogram("http_queue_wait_ms")
+
+
+    async def run(self, command: Callable[[], Awaitable[Any]], priority: int = PRIORITY_USER) -> Any:
+        """Espera el turno y ejecuta command(). Si se cancela mientras espera pierde el lugar sin bloquear a los demas"""
+        start = time.perf_counter()
+        if(self.busy):
+            turn = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.waiters, (priority, next(self.order), turn))
+            try:
+                await turn
+            except asyncio.CancelledError:
+                if(turn.done() and not turn.cancelled()):
+                    self.__next()                   # Ya tenia el turno, se lo pasa al siguiente
+                raise
+        self.busy = True
+        self.__wait_time.observe((time.perf_counter() - start) * 1000)
+        self.__commands.inc()
+        try:
+            return await command()
+        finally:
+            self.__next()
+
+
+    async def state(self, command: Callable[[], Awaitable[Any]]) -> Any:
+        """Consulta de estado single-flight: si ya hay una pendiente o en curso se espera esa en lugar de encolar otra"""
+        if(self.state_task is None or self.state_task.done()):
+            self.state_task = asyncio.get_running_loop().create_task(self.run(command, PRIORITY_POLL), name="garnet-state")
+            self.state_task.add_done_callback(lambda task: task.cancelled() or task.exception())  # Nadie la espera si todos cancelaron
+        else:
+            self.__merged.inc()
+            _LOGGER.debug("[state] State query already pending, waiting for it")
+        return await asyncio.shield(self.state_task)    # Cancelar a un interesado no cancela la consulta de los demas
+
+
+    def __next(self) -> None:
+        """Pasa el turno al primero de la cola que siga esperando"""
+        while(self.waiters):
+            (_, _, turn) = heapq.heappop(self.waiters)
+            if(not turn.done()):
+                turn.set_result(None)
+                return
+        self.busy = False
+
+
+    def pending(self) -> int:
+        """Comandos esperando turno"""
+        return sum(1 for (_, _, turn) in self.waiters if not turn.done())
@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import ipaddress
 import logging
 from typing import Any
 
@@ -25,6 +26,27 @@ from .const import (
     MIN_REFRESH_INTERVAL, 
     DEFAULT_REFRESH_INTERVAL, 
     CONF_REFRESH_INTERVAL,
+    DEFAULT_COALESCE_DELAY,
+    MAX_COALESCE_DELAY,
+    CONF_COALESCE_DELAY,
+    DEFAULT_SIA_WORKERS,
+    MAX_SIA_WORKERS,
+    CONF_SIA_WORKERS,
+    DEFAULT_SIA_TCP,
+    CONF_SIA_TCP,
+    DEFAULT_SIA_JOURNAL,
+    CONF_SIA_JOURNAL,
+    DEFAULT_SIA_RCVBUF,
+    MAX_SIA_RCVBUF,
+    CONF_SIA_RCVBUF,
+    DEFAULT_SIA_SIDECAR,
+    CONF_SIA_SIDECAR,
+    DEFAULT_UDP_PORT,
+    CONF_SIA_PORT,
+    DEFAULT_SIA_BIND_ADDRESS,
+    CONF_SIA_BIND_ADDRESS,
+    DEFAULT_SIA_ALLOWED_NETWORKS,
+    CONF_SIA_ALLOWED_NETWORKS,
 )
 
 
@@ -47,7 +69,7 @@ async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str,
     _LOGGER.debug("[validate_input]")
     api = GarnetAPI(hass, data[CONF_GARNETUSER], data[CONF_GARNETPASS], data[CONF_ACCOUNT], data[CONF_SYSTEM])
     try:
-       await hass.async_add_executor_job(api.connect)
+       await api.async_check_credentials()          # Solo HTTP, el receptor SIA lo levanta la entrada cuando se configura
     except APIConnectionError as err:
         _LOGGER.exception(err)
         raise CannotConnect from err
@@ -156,9 +178,23 @@ class GarnetIntOptionsFlowHandler(OptionsFlow):
 
     async def async_step_init(self, user_input=None):
         """Handle options flow."""
+        errors: dict[str, str] = {}
         if user_input is not None:
-            options = self.config_entry.options | user_input
-            return self.async_create_entry(title="", data=options)
+            try:
+                if(user_input.get(CONF_SIA_BIND_ADDRESS, "").strip()):       # Los sockets del receptor son AF_INET
+                    ipaddress.IPv4Address(user_input[CONF_SIA_BIND_ADDRESS].strip())
+            except ValueError:
+                errors[CONF_SIA_BIND_ADDRESS] = "invalid_address"
+            try:
+                for network in user_input.get(CONF_SIA_ALLOWED_NETWORKS, "").split(","):
+                    if(network.strip()):
+                        ipaddress.ip_network(network.strip(), strict=False)
+            except ValueError:
+                errors[CONF_SIA_ALLOWED_NETWORKS] = "invalid_network"
+            if(len(errors) == 0):
+                options = self.config_entry.options | user_input
+                return self.async_create_entry(title="", data=options)
+            self.options.update(user_input)
 
         data_schema = vol.Schema(
             {
@@ -170,9 +206,45 @@ class GarnetIntOptionsFlowHandler(OptionsFlow):
                     CONF_REFRESH_INTERVAL,
                     default=self.options.get(CONF_REFRESH_INTERVAL, DEFAULT_REFRESH_INTERVAL),
                 ): (vol.All(vol.Coerce(int), vol.Clamp(min=MIN_REFRESH_INTERVAL))),
+                vol.Required(
+                    CONF_COALESCE_DELAY,
+                    default=self.options.get(CONF_COALESCE_DELAY, DEFAULT_COALESCE_DELAY),
+                ): (vol.All(vol.Coerce(int), vol.Clamp(min=0, max=MAX_COALESCE_DELAY))),
+                vol.Required(
+                    CONF_SIA_WORKERS,
+                    default=self.options.get(CONF_SIA_WORKERS, DEFAULT_SIA_WORKERS),
+                ): (vol.All(vol.Coerce(int), vol.Clamp(min=0, max=MAX_SIA_WORKERS))),
+                vol.Required(
+                    CONF_SIA_TCP,
+                    default=self.options.get(CONF_SIA_TCP, DEFAULT_SIA_TCP),
+                ): bool,
+                vol.Required(
+                    CONF_SIA_JOURNAL,
+                    default=self.options.get(CONF_SIA_JOURNAL, DEFAULT_SIA_JOURNAL),
+                ): bool,
+                vol.Required(
+                    CONF_SIA_RCVBUF,
+                    default=self.options.get(CONF_SIA_RCVBUF, DEFAULT_SIA_RCVBUF),
+                ): (vol.All(vol.Coerce(int), vol.Clamp(min=0, max=MAX_SIA_RCVBUF))),
+                vol.Required(
+                    CONF_SIA_SIDECAR,
+                    default=self.options.get(CONF_SIA_SIDECAR, DEFAULT_SIA_SIDECAR),
+                ): bool,
+                vol.Required(
+                    CONF_SIA_PORT,
+                    default=self.options.get(CONF_SIA_PORT, DEFAULT_UDP_PORT),
+                ): (vol.All(vol.Coerce(int), vol.Clamp(min=1, max=65535))),
+                vol.Optional(
+                    CONF_SIA_BIND_ADDRESS,
+                    default=self.options.get(CONF_SIA_BIND_ADDRESS, DEFAULT_SIA_BIND_ADDRESS),
+                ): str,
+                vol.Optional(
+                    CONF_SIA_ALLOWED_NETWORKS,
+                    default=self.options.get(CONF_SIA_ALLOWED_NETWORKS, DEFAULT_SIA_ALLOWED_NETWORKS),
+                ): str,
             }
         )
-        return self.async_show_form(step_id="init", data_schema=data_schema)
+        return self.async_show_form(step_id="init", data_schema=data_schema, errors=errors)
 
 
 class CannotConnect(HomeAssistantError):
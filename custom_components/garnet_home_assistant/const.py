@@ -10,6 +10,35 @@ DEFAULT_REFRESH_INTERVAL = 200
 MIN_REFRESH_INTERVAL = 60
 CONF_REFRESH_INTERVAL = "conf_refresh"
 
+DEFAULT_COALESCE_DELAY = 250    # Milisegundos maximos que se demora una actualizacion para agrupar una rafaga de eventos
+MAX_COALESCE_DELAY = 5000
+CONF_COALESCE_DELAY = "conf_coalesce"
+
+DEFAULT_SIA_WORKERS = 0         # 0: el receptor SIA corre en el proceso de HA. N: N procesos con SO_REUSEPORT
+MAX_SIA_WORKERS = 16
+CONF_SIA_WORKERS = "conf_sia_workers"
+
+DEFAULT_SIA_TCP = False         # Ademas de UDP escucha SIA DC-09 sobre TCP en el mismo puerto
+CONF_SIA_TCP = "conf_sia_tcp"
+
+DEFAULT_SIA_JOURNAL = False     # Guarda las tramas SIA recibidas para poder reproducirlas luego
+CONF_SIA_JOURNAL = "conf_sia_journal"
+
+DEFAULT_SIA_RCVBUF = 256        # KiB del buffer de recepcion del socket SIA (SO_RCVBUF). 0 = valor del kernel
+MAX_SIA_RCVBUF = 16384
+CONF_SIA_RCVBUF = "conf_sia_rcvbuf"
+
+DEFAULT_SIA_SIDECAR = False     # Recepcion, parseo y ACK en un proceso aparte. Tiene prioridad sobre los workers
+CONF_SIA_SIDECAR = "conf_sia_sidecar"
+
+CONF_SIA_PORT = "conf_sia_port" # Puerto del receptor SIA. Por defecto DEFAULT_UDP_PORT
+
+DEFAULT_SIA_BIND_ADDRESS = ""   # Direccion local del receptor SIA. Vacio escucha en todas
+CONF_SIA_BIND_ADDRESS = "conf_sia_bind_address"
+
+DEFAULT_SIA_ALLOWED_NETWORKS = ""   # Redes de origen permitidas separadas por coma (ej. 192.168.1.0/24). Vacio permite cualquiera
+CONF_SIA_ALLOWED_NETWORKS = "conf_sia_allowed_networks"
+
 CONF_ACCOUNT = "conf_clientid"
 CONF_SYSTEM = "conf_systemid"
 CONF_GARNETUSER = "conf_username"
@@ -17,10 +46,48 @@ CONF_GARNETPASS = "conf_password"
 
 
 DEFAULT_UDP_PORT = 2123
-SIA_BUFFERSIZE = 1024
-MESSAGESERVER_TIMEOUT = 30
+SIA_BUFFERSIZE = 4103           # Trama DC-09 mas larga: encabezado (7) + bloque de hasta 0xFFF + \r
+SIA_DRAIN_LIMIT = 256           # Maximo de datagramas que se leen por vuelta del event loop
+ACK_TEMPLATE_CACHE_SIZE = 1024
+SIA_SUPERVISOR_INTERVAL = 5     # Segundos entre controles de que el receptor SIA sigue vivo
+SIA_RESTART_BACKOFF = 1         # Segundos de espera tras el primer reinicio fallido. Se duplica en cada intento
+SIA_RESTART_BACKOFF_MAX = 300   # Espera maxima entre reintentos
+SIA_HANDOVER_TIMEOUT = 120      # Segundos que se retienen los eventos de una cuenta mientras su integracion se recarga
+SIA_BACKLOG_WINDOW = 10         # Segundos desde que se levanta el socket en que se juntan los eventos atrasados del panel. Los actuales no esperan
+SIA_BACKLOG_SIZE = 256          # Maximo de eventos atrasados por cuenta
+SIA_BACKLOG_MAX_AGE = 300       # Segundos que se guarda el backlog de una cuenta que aun no se registro
+SIA_DEDUP_TTL = 30              # Segundos en que una trama con la misma secuencia se considera retransmision
+SIA_DEDUP_SIZE = 4096           # Maximo de tramas recordadas para detectar retransmisiones
+SIA_CLOCK_SAMPLES = 32          # Tramas por cuenta usadas para estimar el desfase del reloj del panel
+STATE_REORDER_WINDOW = 2        # Segundos en que dos cambios del mismo dispositivo se aplican en orden de llegada
+SIA_QUEUE_SIZE = 128            # Eventos encolados por cuenta antes de aplicar la politica de desborde
+SIA_QUEUE_POLICY = "latest"     # "latest" (se queda con el ultimo estado de cada entidad) o "drop_oldest"
+SIA_QUEUE_BATCH = 32            # Eventos despachados antes de ceder el event loop
+SIA_TCP_IDLE_TIMEOUT = 300      # Segundos sin datos antes de cerrar una conexion TCP
+SIA_TCP_MAX_CONNECTIONS = 256   # Conexiones TCP simultaneas
+SIA_JOURNAL_DIR = "garnet_sia_journal"      # Directorio del journal dentro de la configuracion de HA
+SIA_JOURNAL_SEGMENT_SIZE = 4 * 1024 * 1024  # Bytes por segmento antes de rotar
+SIA_JOURNAL_MAX_SIZE = 64 * 1024 * 1024     # Bytes totales. Se borran los segmentos mas viejos
+SIA_JOURNAL_FLUSH_INTERVAL = 2  # Segundos maximos que una trama espera en memoria antes de escribirse
+SIA_JOURNAL_FLUSH_SIZE = 64 * 1024          # Bytes acumulados que fuerzan la escritura
+SERVICE_REPLAY_JOURNAL = "replay_journal"   # Servicio que reproduce el journal en las entidades
+ATTR_SPEED = "speed"
+ATTR_SINCE = "since"
+ATTR_RETIME = "retime"
+SIA_SIDECAR_SOCKET = "garnet_sia.sock"      # Socket Unix del sidecar dentro de la configuracion de HA
+SIA_SIDECAR_RING = 4096         # Registros que guarda el sidecar para resincronizar una reconexion
+SIA_SIDECAR_HEARTBEAT = 5       # Segundos sin registros antes de enviar un heartbeat
+SIA_RATE_LIMIT = 20             # Tramas por segundo sostenidas por IP de origen. 0 deshabilita el limite
+SIA_RATE_BURST = SIA_BACKLOG_SIZE   # Rafaga maxima por IP. Alcanza para que un panel vuelque todo su buffer al reconectar
+SIA_RATE_SOURCES = 4096         # IPs de origen recordadas por el limitador
+SIA_SEEN_ACCOUNTS = 1024        # Cuentas recordadas por el receptor (ultima trama y reloj), incluidas las no suscritas
+SIA_LOG_INTERVAL = 60           # Segundos en que se agrupan los mensajes repetidos del mismo origen
+SIA_LOG_SOURCES = 64            # Origenes distintos registrados por intervalo, el resto se resume junto
 GARNETAPIURL = "web.garnetcontrol.app"
 GARNETAPITIMEOUT = 8500     #TODO obtenerlo de la API
+HTTP_REQUEST_TIMEOUT = 30       # Segundos maximos de un request HTTP. Debe superar GARNETAPITIMEOUT
+CACHE_STORE_VERSION = 1         # Version del formato de la cache en disco del panel
+CACHE_SAVE_DELAY = 10           # Segundos que se agrupan los cambios antes de escribir la cache
 
 PARTITION_BASE_ID = 0
 ZONE_BASE_ID = 10
@@ -32,4 +99,5 @@ TIMEDPANICBUTTON_BASE_ID = 54
 COMM_BASE_ID = 55
 REFRESHBUTTON_BASE_ID = 56
 
-TOKEN_TIME_SPAN = 600
\ No newline at end of file
+TOKEN_TIME_SPAN = 600
+TOKEN_REFRESH_MARGIN = 60     # Segundos antes del vencimiento en que el token se renueva en segundo plano
\ No newline at end of file
@@ -19,7 +19,25 @@ from .const import (
     CONF_KEEPALIVE_INTERVAL, 
     DEFAULT_KEEPALIVE_INTERVAL,
     CONF_REFRESH_INTERVAL, 
-    DEFAULT_REFRESH_INTERVAL
+    DEFAULT_REFRESH_INTERVAL,
+    CONF_COALESCE_DELAY,
+    DEFAULT_COALESCE_DELAY,
+    CONF_SIA_WORKERS,
+    DEFAULT_SIA_WORKERS,
+    CONF_SIA_TCP,
+    DEFAULT_SIA_TCP,
+    CONF_SIA_JOURNAL,
+    DEFAULT_SIA_JOURNAL,
+    CONF_SIA_RCVBUF,
+    DEFAULT_SIA_RCVBUF,
+    CONF_SIA_SIDECAR,
+    DEFAULT_SIA_SIDECAR,
+    CONF_SIA_PORT,
+    DEFAULT_UDP_PORT,
+    CONF_SIA_BIND_ADDRESS,
+    DEFAULT_SIA_BIND_ADDRESS,
+    CONF_SIA_ALLOWED_NETWORKS,
+    DEFAULT_SIA_ALLOWED_NETWORKS
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -53,9 +71,24 @@ class GarnetPanelIntegrationCoordinator(DataUpdateCoordinator):
         self.api = GarnetAPI(hass=hass, user=self.user, pwd=self.pwd, account=self.account, systemid=self.systemid)
         self.api.keepalive_interval = int(config_entry.options.get(CONF_KEEPALIVE_INTERVAL, DEFAULT_KEEPALIVE_INTERVAL))
         self.api.refresh_interval = int(config_entry.options.get(CONF_REFRESH_INTERVAL, DEFAULT_REFRESH_INTERVAL))
+        self.api.coalesce_delay = int(config_entry.options.get(CONF_COALESCE_DELAY, DEFAULT_COALESCE_DELAY)) / 1000
+        self.apply_receiver_options(config_entry.options)
         self.api.setcallback(message_callback=self.devices_update_callback)
+        self.api.reload_callback = lambda: hass.config_entries.async_schedule_reload(config_entry.entry_id)
 
  
+    def apply_receiver_options(self, options: dict) -> None:
+        """Copia a la API las opciones del receptor SIA. Se aplican al conectar o con api.async_reconfigure_receiver"""
+        self.api.sia_workers = int(options.get(CONF_SIA_WORKERS, DEFAULT_SIA_WORKERS))
+        self.api.sia_tcp = bool(options.get(CONF_SIA_TCP, DEFAULT_SIA_TCP))
+        self.api.sia_journal = bool(options.get(CONF_SIA_JOURNAL, DEFAULT_SIA_JOURNAL))
+        self.api.sia_rcvbuf = int(options.get(CONF_SIA_RCVBUF, DEFAULT_SIA_RCVBUF))
+        self.api.sia_sidecar = bool(options.get(CONF_SIA_SIDECAR, DEFAULT_SIA_SIDECAR))
+        self.api.sia_port = int(options.get(CONF_SIA_PORT, DEFAULT_UDP_PORT))
+        self.api.sia_bind_address = str(options.get(CONF_SIA_BIND_ADDRESS, DEFAULT_SIA_BIND_ADDRESS)).strip()
+        self.api.sia_allowed_networks = str(options.get(CONF_SIA_ALLOWED_NETWORKS, DEFAULT_SIA_ALLOWED_NETWORKS))
+
+
     def get_device_info(self) -> DeviceInfo | None:
         """Returns device info for panel"""
         panel = self.api.httpapi.system
@@ -78,8 +111,8 @@ class GarnetPanelIntegrationCoordinator(DataUpdateCoordinator):
         """
         try:
             if not self.api.connected:
-                await self.hass.async_add_executor_job(self.api.connect)
-            devices = await self.hass.async_add_executor_job(self.api.get_devices)
+                await self.api.async_connect()
+            devices = self.api.get_devices()
         except APIAuthError as err:
             _LOGGER.exception(err)
             raise UpdateFailed(err) from err
@@ -105,11 +138,6 @@ class GarnetPanelIntegrationCoordinator(DataUpdateCoordinator):
             return None
  
 
-    def set_device_data(self, device_id: int, state: any) -> None:
-        """Push device data into API."""
-        self.api.force_device_status(device_id, state)
-
-
     async def async_force_device_status(self, device_id: int, state: any) -> None:
         """Push device data into API."""
         await self.api.async_force_device_status(device_id, state)
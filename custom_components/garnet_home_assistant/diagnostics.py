@@ -0,0 +1,44 @@
+"""Descarga de diagnostico: opciones, estado del receptor SIA y metricas"""
+
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .api import GarnetAPI
+from .const import DOMAIN, CONF_GARNETUSER, CONF_GARNETPASS
+
+
+TO_REDACT = {CONF_GARNETUSER, CONF_GARNETPASS}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, config_entry: ConfigEntry) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    coordinator = hass.data[DOMAIN][config_entry.entry_id].coordinator
+    server = GarnetAPI.messageserver
+    receiver = None
+    if(server is not None):
+        receiver = {
+            "port": server.port,
+            "active": server.active,
+            "degraded": server.degraded,
+            "address": server.address,
+            "errorcode": server.errorcode,
+            "workers": server.shards.workers if server.shards is not None else 0,
+            "overflow_detection": server.overflow_detection or (server.shards is not None and server.shards.overflow_detection),
+            "sidecar": {"connected": server.sidecar.connected, "last": server.sidecar.last, "lost": server.sidecar.lost} if server.sidecar is not None else None,
+            "tcp_connections": len(server.tcp.connections) if server.tcp is not None else None,
+            "subscribers": list(server.subscribers),
+            "clock_skew": {account: server.clock.skew(account) for account in server.clock.offsets},
+            "metrics": server.metrics.as_dict(),
+        }
+    return {
+        "entry": async_redact_data(config_entry.as_dict(), TO_REDACT),
+        "connected": coordinator.api.connected,
+        "api_metrics": coordinator.api.metrics.as_dict(),
+        "commands_pending": coordinator.api.httpapi.commands.pending() if coordinator.api.connected else None,
+        "receiver": receiver,
+    }
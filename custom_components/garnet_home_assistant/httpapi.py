@@ -1,16 +1,22 @@
 """Funciones de manejo de panel a traves de la api http de Garnet"""
 
+import asyncio
+import hashlib
 import logging
-import http.client
 import json
 import time
 
+import aiohttp
+
 from enum import StrEnum
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 
 from .const import (
     GARNETAPIURL, 
+    HTTP_REQUEST_TIMEOUT,
+    STATE_REORDER_WINDOW,
     TOKEN_TIME_SPAN, 
+    TOKEN_REFRESH_MARGIN,
     PARTITION_BASE_ID, 
     ZONE_BASE_ID, 
     HOWLER_BASE_ID, 
@@ -24,10 +30,15 @@ from .const import (
 )    
 
 from .httpdata import GarnetHTTPUser, GarnetPanelInfo, Zone
+from .commandqueue import PanelCommandQueue, PRIORITY_USER
+from .metrics import MetricsRegistry
 
 
 _LOGGER = logging.getLogger(__name__)
 
+TOKEN_ERRORS = ("Failed to authenticate token.", "No token provided.")     # Mensajes de la API ante un token invalido
+USER_PERMISSIONS = ("arm_permision", "disarm_permision", "disable_zone_permision", "horn_permision")     # Atributos de GarnetHTTPUser que se cachean
+
 
 class DeviceType(StrEnum):
     """Tipos de entidades manejadas por la integracion."""
@@ -48,6 +59,16 @@ class GarnetEntity:
     alarmed: bool
     icon: str 
     uptime: float
+    state_time: float = 0.0         # Momento (epoch) del dato que origino el estado actual, trama SIA o consulta HTTP
+
+
+    def accepts(self, timestamp: float, window: float = STATE_REORDER_WINDOW) -> bool:
+        """True si un dato de ese momento puede aplicarse: no es anterior al estado actual mas alla de la ventana.
+           Dentro de la ventana el orden no es confiable (el timestamp SIA es de un segundo) y se aplica en orden de llegada"""
+        if(timestamp + window < self.state_time):
+            return False
+        self.state_time = max(self.state_time, timestamp)
+        return True
 
 
     def __str__(self):
@@ -77,8 +98,10 @@ class HTTP_API:
     zonasInhibidas: int 
 
 
-    def __init__(self, email: str, pwd: str, panelid: str, controller: str) -> None:        
-        """Initialise."""
+    def __init__(self, email: str, pwd: str, panelid: str, controller: str, session: aiohttp.ClientSession,
+                 metrics: MetricsRegistry | None = None) -> None:        
+        """Initialise. session es la sesion aiohttp de HA.
+           Los comandos al panel pasan por su cola de comandos, de a uno por vez"""
         self.panelid = panelid
         self.user = GarnetHTTPUser(email=email, password=pwd)
         self.session_token = SessionData()             # Token de session
@@ -86,53 +109,167 @@ class HTTP_API:
         self.zone_mask = 0
         self.devices = None
         self.controller_name = controller
-
-
-    def connect(self):
-        """Se conecta a la api y obtiene la informacion de la cuenta y panel actualizando el modelo de datos """
+        self.status_time = None                         # Momento en que se obtuvo el ultimo estado del panel
+        self.last_update = None                         # lastUpdate de la configuracion en la nube cuando se leyo
+        self.seq = 1
+        self.session = session
+        self.commands = PanelCommandQueue(metrics)
+        self.login_task: asyncio.Task | None = None     # Login en curso, compartido por todos los requests
+        self.refresh_handle: asyncio.TimerHandle | None = None
+        self.closed = False                             # Despues de close no se vuelve a loguear ni se agendan renovaciones
+
+
+    async def async_connect(self) -> None:
+        """Se conecta a la api y obtiene la informacion de la cuenta y panel actualizando el modelo de datos"""
         try:
-            self.__collect_system_info()    # Levanta configuracion 
+            try:
+                self.last_update = await self.async_get_lastupdate()    # Antes de leer la configuracion para no perder un cambio
+            except (InvokeGarnetAPIException, UnresponsiveGarnetAPI) as err:
+                _LOGGER.debug("[async_connect] lastUpdate not available: %s", str(err))
+            await self.__async_collect_system_info()
             retries = 5
             while(retries > 0):             # En el proceso de obtener estado inicial es importante varios retries porque la WEB de Garnet es lenta
                 try:
-                    self.get_state()        # Actualiza status
+                    await self.async_get_state()
                     retries = 0
-                except UnresponsiveGarnetAPI as err: # Si la API no responde conviene esperar
-                    time.sleep(3)
+                except UnresponsiveGarnetAPI as err:
+                    await asyncio.sleep(3)
                     if retries > 0:
                         retries = retries -1
                     else:
                         raise(err)
-        except Exception as err:            # Catch solo para debug porque la excepcion se reenvia
+        except Exception as err:
             _LOGGER.exception(err)
             raise err
 
 
-    def __token(self) -> str:
+    async def async_check_access(self) -> None:
+        """Verifica usuario, clave y acceso al panel leyendo su configuracion. No consulta el estado del panel"""
+        await self.__async_collect_system_info()
+
+
+    async def __async_request(self, method: str, path: str, body: dict | None = None, token: str | None = None) -> tuple[int, dict]:
+        """Request a la API por la sesion aiohttp de HA. Una cancelacion corta el request"""
+        async with self.session.request(method, f"https://{GARNETAPIURL}{path}", data=json.dumps(body) if body is not None else '',
+                                        headers=self.__headers(body, token), timeout=aiohttp.ClientTimeout(total=HTTP_REQUEST_TIMEOUT)) as response:
+            return (response.status, self.__decode(response.status, await response.read()))
+
+
+    def __decode(self, status: int, data: bytes) -> dict:
+        """Respuesta JSON. Un 401 sin cuerpo JSON se informa como token rechazado"""
+        try:
+            return json.loads(data.decode("utf-8"))
+        except ValueError:
+            if(status == 401):
+                return {"success": False, "message": "Failed to authenticate token."}
+            raise
+
+
+    def __headers(self, body: dict | None, token: str | None) -> dict:
+        headers = {}
+        if(token is not None):
+            headers['x-access-token'] = token
+        if(body is not None):
+            headers['Content-Type'] = 'application/json'
+        return headers
+
+
+    def __raise_error(self, response: dict) -> None:
+        """Excepcion segun el mensaje de una respuesta sin exito"""
+        if("message" in response):
+            if(response["message"] in TOKEN_ERRORS):
+                _LOGGER.warning(response["message"])
+                raise TokenRejectedException(response["message"])   # Rechazado aun despues de renovar el token
+            elif((response["message"] == "No se recibió respuesta del sistema en el tiempo máximo esperado") or (response["message"] == "Ya hay un comando en progreso")):
+                raise UnresponsiveGarnetAPI(response["message"])
+            else:                
+                raise InvokeGarnetAPIException(response["message"])
+        else:
+            raise InvokeGarnetAPIException(f"Invalid JSON {str(response)}")
+
+
+    def __token_age(self) -> float:
         _span = time.time() - self.session_token.creation
         _LOGGER.debug(f"Token timespan is {_span} with max configured is {TOKEN_TIME_SPAN}")            
-        if _span > TOKEN_TIME_SPAN:
-            self.__login()            #TODO catchear excepcion y plan de recovery
+        return _span
+
+
+    async def __async_token(self) -> str:
+        """Token vigente. Cerca del vencimiento lo renueva en segundo plano y el request usa el actual"""
+        if self.session_token.token is None or self.__token_age() > TOKEN_TIME_SPAN:
+            return await self.__async_relogin(None)
+        if self.__token_age() > TOKEN_TIME_SPAN - TOKEN_REFRESH_MARGIN:
+            self.__refresh_token()
         return self.session_token.token
 
 
-    def __login(self) -> None:
-        """Obtiene token de sesion."""
-        _LOGGER.debug("Executing Login() method")
+    async def __async_relogin(self, rejected: str | None) -> str:
+        """Login compartido: los que llegan mientras hay uno en curso esperan ese. Si el token rechazado ya fue
+           reemplazado se usa el nuevo sin volver a loguearse"""
+        if(rejected is not None and self.session_token.token != rejected):
+            return self.session_token.token
+        if(self.closed):
+            raise InvokeGarnetAPIException("Garnet HTTP API is closed")
+        self.__refresh_token()
+        await asyncio.shield(self.login_task)           # Cancelar a un interesado no corta el login de los demas
+        return self.session_token.token
+
+
+    def __refresh_token(self) -> None:
+        """Lanza el login en segundo plano si no hay uno en curso. Corre en el event loop"""
+        if(self.closed):
+            return
+        if(self.login_task is None or self.login_task.done()):
+            self.login_task = asyncio.get_running_loop().create_task(self.__async_login(), name="garnet-login")
+            self.login_task.add_done_callback(self.__login_done)
+
+
+    def __login_done(self, task: asyncio.Task) -> None:
+        """Al terminar el login agenda la proxima renovacion antes del vencimiento"""
+        if(task.cancelled() or self.closed):
+            return
+        if(task.exception() is not None):
+            _LOGGER.warning("[__login_done] Token refresh failed: %s", str(task.exception()))
+            return
+        if(self.refresh_handle is not None):
+            self.refresh_handle.cancel()
+        self.refresh_handle = asyncio.get_running_loop().call_later(max(TOKEN_TIME_SPAN - TOKEN_REFRESH_MARGIN, 1), self.__refresh_token)
+
+
+    def close(self) -> None:
+        """Detiene la renovacion del token en segundo plano y la consulta de estado en curso. Corre en el event loop"""
+        self.closed = True
+        if(self.refresh_handle is not None):
+            self.refresh_handle.cancel()
+            self.refresh_handle = None
+        if(self.login_task is not None):
+            self.login_task.cancel()
+            self.login_task = None
+        if(self.commands.state_task is not None):
+            self.commands.state_task.cancel()
+
+
+    def __credentials(self) -> dict:
         body = {}
         body["email"] = self.user.email
         body["password"] = self.user.password
+        return body
+
 
-        response = {}
+    async def __async_login(self) -> None:
+        """Obtiene token de sesion."""
+        _LOGGER.debug("Executing __async_login() method")
+        body = self.__credentials()
         try:
-            conn = http.client.HTTPSConnection(GARNETAPIURL)
             _LOGGER.debug(f"Executing POST on /users_api/v1/auth/login with body={json.dumps(body)}")
-            conn.request("POST", "/users_api/v1/auth/login", json.dumps(body), { 'Content-Type': 'application/json' })
-            response = json.loads(conn.getresponse().read().decode("utf-8"))
-            conn.close()
+            (_, response) = await self.__async_request("POST", "/users_api/v1/auth/login", body)
         except Exception as err:
             _LOGGER.exception(err)
             raise InvokeGarnetAPIException(err)
+        self.__login_response(response)
+
+
+    def __login_response(self, response: dict) -> None:
         if("success" in response and response["success"]):
             _LOGGER.info("Successful login to GARNET http")            
             self.session_token.token = response["accessToken"]
@@ -141,87 +278,185 @@ class HTTP_API:
             if self.user.name is None:                  # En el primer login completa los datos del usuario que usa para loguearse
                 self.user.name = f"{response["userData"]["nombre"]} {response["userData"]["apellido"]}" 
         else:
-            if("message" in response):
-                if((response["message"] == "No se recibió respuesta del sistema en el tiempo máximo esperado") or (response["message"] == "Ya hay un comando en progreso")):
-                    raise UnresponsiveGarnetAPI(response["message"])   
-                else:                
-                    raise InvokeGarnetAPIException(response["message"])
-            else:
-                raise InvokeGarnetAPIException(f"Invalid JSON {str(response)}")
+            self.__raise_error(response)
 
 
-    def __collect_system_info(self) -> None:
+    async def __async_collect_system_info(self) -> None:
         """Obtiene informacion de zonas y sistema GARNET."""
-        _LOGGER.debug("Executing __collect_system_info() method")
-        response = {}
+        _LOGGER.debug("Executing __async_collect_system_info() method")
+        (permissions, system, devices, partition_mask, zone_mask) = self.__system_info_response(await self.__async_get_system_info())
+        if self.user.arm_permision is None:
+            for (key, value) in permissions.items():
+                setattr(self.user, key, value)
+        if(self.system is None):
+            self.system = system
+        if self.devices == None:    # Se construye la estructura inicial de dispositivos
+            (self.devices, self.partition_mask, self.zone_mask) = (devices, partition_mask, zone_mask)
+
+
+    async def __async_get_system_info(self) -> dict:
+        """Respuesta de /systems/<id>"""
         try:
-            conn = http.client.HTTPSConnection(GARNETAPIURL)
-            _token = self.__token()
-            _LOGGER.debug(f"Executing GET on /users_api/v1/systems/{self.panelid} with no body and header='x-access-token': {_token}")
-            conn.request("GET", f"/users_api/v1/systems/{self.panelid}", '', { 'x-access-token': _token })
-            response = json.loads(conn.getresponse().read().decode("utf-8"))
-            conn.close()
+            _LOGGER.debug(f"Executing GET on /users_api/v1/systems/{self.panelid} with no body")
+            return await self.__async_authorized_request("GET", f"/users_api/v1/systems/{self.panelid}")
         except Exception as err:
             _LOGGER.exception(err)
             raise InvokeGarnetAPIException(err)
-        if("success" in response and response["success"]):
-            if self.user.arm_permision is None:
-                self.user.arm_permision = response["message"]["sistema"]['userPermissions']["atributos"]["puedeArmar"]
-                self.user.disarm_permision = response["message"]["sistema"]['userPermissions']["atributos"]["puedeDesarmar"]
-                self.user.disable_zone_permision = response["message"]["sistema"]['userPermissions']["atributos"]["puedeInhibirZonas"]
-                self.user.horn_permision = response["message"]["sistema"]['userPermissions']["atributos"]["puedeInteractuarConSirena"]
-            if(self.system is None):
-                if response["message"]["sistema"]["id"] == self.panelid:
-                    self.system = GarnetPanelInfo( id = response["message"]["sistema"]["id"], guid = response["message"]["sistema"]["id"], name = response["message"]["sistema"]["nombre"])
-                    self.system.model = response["message"]["sistema"]["programation"]["data"]["alarmPanel"]["model"]                                                                                 
-                    self.system.version = response["message"]["sistema"]["programation"]["data"]["alarmPanel"]["version"]                                                                                 
-                    self.system.modelName = response["message"]["sistema"]["programation"]["data"]["alarmPanel"]["modelName"]                                                                                 
-                    self.system.versionName = response["message"]["sistema"]["programation"]["data"]["alarmPanel"]["versionName"]
-                else:
-                    raise SystemDoesNotExistException(f"El sistema con id {self.panelid} no se encuentra registrado en Garnet Control")
-
-            if self.devices == None:    # Se construye la estructura inicial de dispositivos
-
-                self.devices = []
-                for partition in response["message"]["sistema"]["programation"]["data"]["partitions"]:
-                    if partition["enabled"]:
-                        self.partition_mask = self.partition_mask | (2 ** (partition["number"] - 1))
-                        self.devices.append(GarnetEntity(device_id=partition["number"]  + PARTITION_BASE_ID, 
-                                                         device_unique_id=f"{self.controller_name}_P_{partition["number"] }",
-                                                        device_type=DeviceType.PARTITION, name=partition["name"], 
-                                                        alarmed=None, native_state="Unknown", uptime=0, icon=None))
-
-                for zone in response["message"]["sistema"]["programation"]["data"]["zones"]:
-                    if zone["enabled"]:
-                        self.zone_mask = self.zone_mask | (2 ** (zone["number"] - 1))
-                        self.devices.append(GarnetEntity(device_id=zone["number"] + ZONE_BASE_ID, device_unique_id=f"{self.controller_name}_Z_{zone["number"]}",
-                                                        device_type=DeviceType.ZONE, name=zone["name"] if ("name" in zone) else "", 
-                                                        alarmed=None, native_state="Unknown", uptime=0, 
-                                                        icon=Zone.translate_icon(icon=zone["icon"] if ("icon" in zone) else "0")))
-            
-                self.devices.append(GarnetEntity(device_id=HOWLER_BASE_ID, device_unique_id=f"{self.controller_name}_S_1",device_type=DeviceType.HOWLER, 
-                                                 name="Sirena", alarmed=False, native_state=None, uptime=0, icon="mdi:alarm-bell"))
-                self.devices.append(GarnetEntity(device_id=POLICEBUTTON_BASE_ID, device_unique_id=f"{self.controller_name}_B_1",device_type=DeviceType.BUTTON, 
-                                                 name="Panico", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:police-badge-outline"))
-                self.devices.append(GarnetEntity(device_id=DOCTORBUTTON_BASE_ID, device_unique_id=f"{self.controller_name}_B_2",device_type=DeviceType.BUTTON, 
-                                                 name="Incendio", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:fire-alert"))
-                self.devices.append(GarnetEntity(device_id=FIREBUTTON_BASE_ID, device_unique_id=f"{self.controller_name}_B_3",device_type=DeviceType.BUTTON, 
-                                                 name="Medico", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:doctor"))
-                self.devices.append(GarnetEntity(device_id=TIMEDPANICBUTTON_BASE_ID, device_unique_id=f"{self.controller_name}_B_4",device_type=DeviceType.BUTTON, 
-                                                 name="Panico demorado", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:alarm"))
-                self.devices.append(GarnetEntity(device_id=REFRESHBUTTON_BASE_ID, device_unique_id=f"{self.controller_name}_B_8",device_type=DeviceType.BUTTON, 
-                                                 name="Refrescar estado", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:refresh"))
-                self.devices.append(GarnetEntity(device_id=COMM_BASE_ID, device_unique_id=f"{self.controller_name}_X_1",device_type=DeviceType.TEXT_SENSOR, 
-                                                 name="Comunicador", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:wifi"))
 
-        else:
-            if("message" in response):
-                if((response["message"] == "No se recibió respuesta del sistema en el tiempo máximo esperado") or (response["message"] == "Ya hay un comando en progreso")):
-                    raise UnresponsiveGarnetAPI(response["message"])
-                else:
-                    raise InvokeGarnetAPIException(response["message"])
-            else:
-                raise InvokeGarnetAPIException(f"Invalid JSON {str(response)}")
+
+    def __system_info_response(self, response: dict) -> tuple[dict, GarnetPanelInfo, list[GarnetEntity], int, int]:
+        """Arma el modelo de datos con la respuesta de /systems/<id> sin tocar el actual.
+           Devuelve (permisos, panel, dispositivos, mascara de particiones, mascara de zonas)"""
+        if(not ("success" in response and response["success"])):
+            self.__raise_error(response)
+        permissions = {
+            "arm_permision": response["message"]["sistema"]['userPermissions']["atributos"]["puedeArmar"],
+            "disarm_permision": response["message"]["sistema"]['userPermissions']["atributos"]["puedeDesarmar"],
+            "disable_zone_permision": response["message"]["sistema"]['userPermissions']["atributos"]["puedeInhibirZonas"],
+            "horn_permision": response["message"]["sistema"]['userPermissions']["atributos"]["puedeInteractuarConSirena"],
+        }
+        if response["message"]["sistema"]["id"] != self.panelid:
+            raise SystemDoesNotExistException(f"El sistema con id {self.panelid} no se encuentra registrado en Garnet Control")
+        system = GarnetPanelInfo( id = response["message"]["sistema"]["id"], guid = response["message"]["sistema"]["id"], name = response["message"]["sistema"]["nombre"])
+        system.model = response["message"]["sistema"]["programation"]["data"]["alarmPanel"]["model"]                                                                                 
+        system.version = response["message"]["sistema"]["programation"]["data"]["alarmPanel"]["version"]                                                                                 
+        system.modelName = response["message"]["sistema"]["programation"]["data"]["alarmPanel"]["modelName"]                                                                                 
+        system.versionName = response["message"]["sistema"]["programation"]["data"]["alarmPanel"]["versionName"]
+
+        partition_mask = 0
+        zone_mask = 0
+        devices = []
+        for partition in response["message"]["sistema"]["programation"]["data"]["partitions"]:
+            if partition["enabled"]:
+                partition_mask = partition_mask | (2 ** (partition["number"] - 1))
+                devices.append(GarnetEntity(device_id=partition["number"]  + PARTITION_BASE_ID, 
+                                            device_unique_id=f"{self.controller_name}_P_{partition["number"] }",
+                                            device_type=DeviceType.PARTITION, name=partition["name"], 
+                                            alarmed=None, native_state="Unknown", uptime=0, icon=None))
+
+        for zone in response["message"]["sistema"]["programation"]["data"]["zones"]:
+            if zone["enabled"]:
+                zone_mask = zone_mask | (2 ** (zone["number"] - 1))
+                devices.append(GarnetEntity(device_id=zone["number"] + ZONE_BASE_ID, device_unique_id=f"{self.controller_name}_Z_{zone["number"]}",
+                                            device_type=DeviceType.ZONE, name=zone["name"] if ("name" in zone) else "", 
+                                            alarmed=None, native_state="Unknown", uptime=0, 
+                                            icon=Zone.translate_icon(icon=zone["icon"] if ("icon" in zone) else "0")))
+
+        devices.append(GarnetEntity(device_id=HOWLER_BASE_ID, device_unique_id=f"{self.controller_name}_S_1",device_type=DeviceType.HOWLER, 
+                                    name="Sirena", alarmed=False, native_state=None, uptime=0, icon="mdi:alarm-bell"))
+        devices.append(GarnetEntity(device_id=POLICEBUTTON_BASE_ID, device_unique_id=f"{self.controller_name}_B_1",device_type=DeviceType.BUTTON, 
+                                    name="Panico", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:police-badge-outline"))
+        devices.append(GarnetEntity(device_id=DOCTORBUTTON_BASE_ID, device_unique_id=f"{self.controller_name}_B_2",device_type=DeviceType.BUTTON, 
+                                    name="Incendio", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:fire-alert"))
+        devices.append(GarnetEntity(device_id=FIREBUTTON_BASE_ID, device_unique_id=f"{self.controller_name}_B_3",device_type=DeviceType.BUTTON, 
+                                    name="Medico", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:doctor"))
+        devices.append(GarnetEntity(device_id=TIMEDPANICBUTTON_BASE_ID, device_unique_id=f"{self.controller_name}_B_4",device_type=DeviceType.BUTTON, 
+                                    name="Panico demorado", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:alarm"))
+        devices.append(GarnetEntity(device_id=REFRESHBUTTON_BASE_ID, device_unique_id=f"{self.controller_name}_B_8",device_type=DeviceType.BUTTON, 
+                                    name="Refrescar estado", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:refresh"))
+        devices.append(GarnetEntity(device_id=COMM_BASE_ID, device_unique_id=f"{self.controller_name}_X_1",device_type=DeviceType.TEXT_SENSOR, 
+                                    name="Comunicador", alarmed=False, native_state="Unknown", uptime=0, icon="mdi:wifi"))
+        return (permissions, system, devices, partition_mask, zone_mask)
+
+
+    async def __async_reload_system_info(self) -> bool:
+        """Vuelve a leer la configuracion del panel. Devuelve True si cambiaron las particiones o zonas.
+           Los dispositivos que siguen existiendo conservan su estado y toman el nombre e icono nuevos.
+           El modelo nuevo se arma aparte y reemplaza al actual recien con la respuesta completa: mientras se espera
+           la nube los eventos SIA y el coordinador siguen viendo el modelo anterior"""
+        (permissions, system, devices, partition_mask, zone_mask) = self.__system_info_response(await self.__async_get_system_info())
+        for (key, value) in permissions.items():        # Tambien se releen los permisos
+            setattr(self.user, key, value)
+        self.system = system
+        (self.partition_mask, self.zone_mask) = (partition_mask, zone_mask)
+        known = {d.device_unique_id: d for d in self.devices}
+        for d in devices:
+            if(d.device_unique_id in known):
+                known[d.device_unique_id].name = d.name
+                known[d.device_unique_id].icon = d.icon
+        if({d.device_unique_id for d in devices} == set(known)):
+            return False
+        self.devices = [known.get(d.device_unique_id, d) for d in devices]
+        return True
+
+
+    async def async_revalidate(self) -> bool:
+        """Revalida contra la nube un modelo restaurado de la cache. La configuracion solo se vuelve a leer si cambio
+           lastUpdate, el estado siempre. Devuelve True si cambiaron las particiones o zonas"""
+        last = None
+        try:
+            last = await self.async_get_lastupdate()
+        except (InvokeGarnetAPIException, UnresponsiveGarnetAPI) as err:
+            _LOGGER.debug("[async_revalidate] lastUpdate not available, reloading configuration: %s", str(err))
+        changed = False
+        if(last is None or last != self.last_update):
+            _LOGGER.debug("[async_revalidate] Panel configuration changed (%s -> %s)", self.last_update, last)
+            changed = await self.__async_reload_system_info()
+            self.last_update = last
+        await self.async_get_state()
+        return changed
+
+
+    def snapshot(self) -> dict:
+        """Modelo de datos serializable para la cache en disco: configuracion, permisos y estado.
+           Ni el token ni el email se guardan: el login se hace en segundo plano y el usuario se identifica por un hash"""
+        return {
+            "panelid": self.panelid,
+            "user_hash": self.__user_hash(),
+            "controller": self.controller_name,
+            "user": {key: getattr(self.user, key) for key in USER_PERMISSIONS},
+            "system": {"id": self.system.id, "guid": self.system.guid, "name": self.system.name, "model": self.system.model,
+                       "version": self.system.version, "modelName": self.system.modelName, "versionName": self.system.versionName},
+            "partition_mask": self.partition_mask,
+            "zone_mask": self.zone_mask,
+            "status_time": self.status_time,
+            "last_update": self.last_update,
+            "seq": self.seq,
+            "devices": [asdict(d) for d in self.devices],
+        }
+
+
+    def restore(self, data: dict) -> bool:
+        """Carga el modelo de datos de la cache. False si es de otro panel o usuario o esta incompleta"""
+        if(data.get("panelid") != self.panelid or data.get("user_hash") != self.__user_hash() or data.get("controller") != self.controller_name):
+            return False
+        try:
+            for key in USER_PERMISSIONS:
+                setattr(self.user, key, data["user"][key])
+            system = data["system"]
+            self.system = GarnetPanelInfo(id=system["id"], guid=system["guid"], name=system["name"])
+            self.system.model = system["model"]
+            self.system.version = system["version"]
+            self.system.modelName = system["modelName"]
+            self.system.versionName = system["versionName"]
+            self.partition_mask = data["partition_mask"]
+            self.zone_mask = data["zone_mask"]
+            self.status_time = data["status_time"]
+            self.last_update = data["last_update"]
+            self.seq = data["seq"]
+            self.devices = [GarnetEntity(**{**d, "device_type": DeviceType(d["device_type"])}) for d in data["devices"]]
+        except (KeyError, TypeError, ValueError) as err:
+            _LOGGER.warning("[restore] Ignoring invalid panel cache: %s", str(err))
+            self.user = GarnetHTTPUser(email=self.user.email, password=self.user.password)
+            self.system = None
+            self.devices = None
+            self.partition_mask = 0
+            self.zone_mask = 0
+            self.status_time = None
+            self.last_update = None
+            self.seq = 1
+            return False
+        return True
+
+
+    def __user_hash(self) -> str:
+        """Identifica al usuario de la cache sin guardar su email"""
+        return hashlib.sha256(self.user.email.strip().lower().encode()).hexdigest()
+
+
+    def __user_label(self) -> str:
+        """Nombre del usuario para los mensajes. Restaurado de la cache no se conoce hasta el primer login"""
+        return self.user.name if self.user.name is not None else self.__user_hash()[:12]
 
 
     def __get_device_by_id__(self, device_id: int) -> GarnetEntity | None:
@@ -242,11 +477,13 @@ class HTTP_API:
         return str(self.seq).zfill(3)
 
 
-    def __update_status(self, status: str) -> None:
-        """Parseo del estado del panel"""
+    def __update_status(self, status: str, timestamp: float) -> None:
+        """Parseo del estado del panel. timestamp es el envio de la consulta.
+           Los dispositivos que cambiaron despues por una trama SIA conservan ese estado"""
         # Nota: se obtiene de la funcion processStatus en js de la web de garnetcontrol
         _LOGGER.debug("Executing __update_status() method")
         _LOGGER.debug("Se recibe trama " + status)
+        self.status_time = timestamp
 
         registroProblemas1 = int(status[1:3], 16) # No usado
         registroProblemas2 = int(status[3:5], 16) # No usado
@@ -288,6 +525,9 @@ class HTTP_API:
 
             if  self.partition_mask & (2 ** i):
                 p = self.__get_device_by_id__(PARTITION_BASE_ID + i + 1)
+                if(not p.accepts(timestamp)):
+                    _LOGGER.debug("Particion %d cambio por SIA despues de la consulta, se conserva %s", i + 1, p.native_state)
+                    continue
                 p.alarmed = False
                 if partitionStatus[i] == "DEMORADO":
                     p.native_state = "home"
@@ -310,6 +550,9 @@ class HTTP_API:
             m = (2 ** i)
             if  self.zone_mask & m:
                 z = self.__get_device_by_id__(ZONE_BASE_ID + i + 1)
+                if(not z.accepts(timestamp)):
+                    _LOGGER.debug("Zona %d cambio por SIA despues de la consulta, se conserva %s", i + 1, z.native_state)
+                    continue
                 z.alarmed = (self.zonasEnAlarma & m) != 0
                 z.native_state = (1 if (self.zonasAbiertas & m)  != 0 else 0) + \
                                  (2 if (self.zonasInhibidas & m) != 0 else 0) + \
@@ -319,178 +562,137 @@ class HTTP_API:
         estadoDeSalidas = int(status[7:9], 16)
         _LOGGER.debug("Estado de salidas cableadas es %d ", estadoDeSalidas)
         howler = self.__get_device_by_id__(HOWLER_BASE_ID)
-        howler.native_state = "on" if (estadoDeSalidas & 1) > 0 else "off"
+        if(howler.accepts(timestamp)):
+            howler.native_state = "on" if (estadoDeSalidas & 1) > 0 else "off"
         _LOGGER.debug("Sirena en estado %s", howler.native_state )
 
         estadoDeSalidasInalambricas = int(status[33:35], 16)
         _LOGGER.debug("Estado de salidas inalambricas es %d ", estadoDeSalidasInalambricas)
 
 
-    def get_state(self) -> None:
+    async def __async_authorized_request(self, method: str, path: str, body: dict | None = None) -> dict:
+        """Request con token. Si el servidor rechaza el token se vuelve a loguear y reintenta una sola vez"""
+        _token = await self.__async_token()
+        (status, response) = await self.__async_request(method, path, body, _token)
+        if(self.__token_rejected(status, response)):
+            _LOGGER.info("[__async_authorized_request] Token rejected by Garnet, logging in again")
+            (status, response) = await self.__async_request(method, path, body, await self.__async_relogin(_token))
+        return response
+
+
+    def __token_rejected(self, status: int, response: dict) -> bool:
+        return status == 401 or (isinstance(response, dict) and not response.get("success") and response.get("message") in TOKEN_ERRORS)
 
-        """Chequeo de estado."""
-        body = {}
-        body["seq"] = self.__sequence()
-        body["timeout"] = GARNETAPITIMEOUT
 
-        response = {}
+    async def __async_command(self, path: str, body: dict) -> dict:
+        """Envia un comando al panel. Devuelve el mensaje de la respuesta"""
         try:
-            conn = http.client.HTTPSConnection(GARNETAPIURL)
-            _token = self.__token()
-            _LOGGER.debug(f"Executing POST on /users_api/v1/systems/{self.panelid}/commands/state with body={json.dumps(body)} and header='x-access-token': {_token}")
-            conn.request("POST", f"/users_api/v1/systems/{self.panelid}/commands/state", json.dumps(body), { 'x-access-token': _token, 'Content-Type': 'application/json' })
-            response = json.loads(conn.getresponse().read().decode("utf-8"))
-            conn.close()
+            _LOGGER.debug(f"Executing POST on {path} with body={json.dumps(body)}")
+            response = await self.__async_authorized_request("POST", path, body)
         except Exception as err:
             _LOGGER.exception(err)
             raise InvokeGarnetAPIException(err)
+        if(not ("success" in response and response["success"])):
+            self.__raise_error(response)
+        return response["message"]
 
-        if("success" in response and response["success"]):
-            self.__update_status(response["message"]["status"])
-        else: 
-            if("message" in response):
-                if((response["message"] == "Failed to authenticate token.") or (response["message"] == "No token provided.")):
-                    _LOGGER.warning(response["message"])
-                    raise Exception(response["message"])        # Esto no deberia ocurrir porque se supone que el tiempo de vida del token esta controlado
-                elif((response["message"] == "No se recibió respuesta del sistema en el tiempo máximo esperado") or (response["message"] == "Ya hay un comando en progreso")):
-                    raise UnresponsiveGarnetAPI(response["message"])
-                else:                
-                    raise InvokeGarnetAPIException(response["message"])
-            else:
-                raise InvokeGarnetAPIException("Invalid JSON " + str(response))
 
+    def __state_command(self) -> tuple[str, dict]:
+        body = {}
+        body["seq"] = self.__sequence()
+        body["timeout"] = GARNETAPITIMEOUT
+        return (f"/users_api/v1/systems/{self.panelid}/commands/state", body)
 
-    def arm_system(self, partition: int, mode: str) -> None:
-        """Armado de particion."""
-        _LOGGER.debug(f"Executing arm_system({partition}) method")
 
-        if(not self.user.arm_permision):
-            raise PermissionError(f"User {self.user.name} has no permision for arming the partition")
+    async def async_get_state(self) -> None:
+        """Chequeo de estado. Si ya hay una consulta pendiente se espera esa"""
+        await self.commands.state(self.__async_get_state)
 
-        # init: #1 Se resuelve https://github.com/claudio-pires/garnet-home-assistant/issues/1
-        # Se llama a getState y si hay zonas abiertas no se procede
-        try:
-            self.get_state()
-            if self.zonasAbiertas > 0:
-                raise Exception((f"Open zones, Partition cannot be armed")) 
-        except Exception as err:
-            _LOGGER.exception(err)
-            raise err
-        # end: #1
 
+    async def __async_get_state(self) -> None:
+        (path, body) = self.__state_command()
+        sent = time.time()                      # El estado de la respuesta es posterior al envio
+        self.__update_status((await self.__async_command(path, body))["status"], sent)
+
+
+    def __arm_command(self, partition: int, mode: str) -> tuple[str, dict]:
         body = {}
         body["seq"] = self.__sequence(increment = 1)
         body["partNumber"] = str(partition)
         body["timeout"] = GARNETAPITIMEOUT
+        command = ("delayed" if mode == "home" else "away")
+        return (f"/users_api/v1/systems/{self.system.id}/commands/arm/{command}", body)
+
+
+    async def async_arm_system(self, partition: int, mode: str) -> None:
+        """Armado de particion."""
+        await self.commands.run(lambda: self.__async_arm_system(partition, mode), PRIORITY_USER)
+
 
-        response = {}
+    async def __async_arm_system(self, partition: int, mode: str) -> None:
+        _LOGGER.debug(f"Executing async_arm_system({partition}) method")
+        if(not self.user.arm_permision):
+            raise PermissionError(f"User {self.__user_label()} has no permision for arming the partition")
+        # init: #1 Se resuelve https://github.com/claudio-pires/garnet-home-assistant/issues/1
+        # Se llama a getState y si hay zonas abiertas no se procede. Ya tiene el turno de la cola
         try:
-            command = ("delayed" if mode == "home" else "away")
-            conn = http.client.HTTPSConnection(GARNETAPIURL)
-            _token=self.__token()
-            _LOGGER.debug(f"Executing POST on /users_api/v1/systems/{self.system.id}/commands/arm/{command} with body={json.dumps(body)} and header='x-access-token': {_token}")
-            conn.request("POST", f"/users_api/v1/systems/{self.system.id}/commands/arm/{command}", json.dumps(body), { 'x-access-token': _token, 'Content-Type': 'application/json' })
-            response = json.loads(conn.getresponse().read().decode("utf-8"))
-            conn.close()
+            await self.__async_get_state()
+            if self.zonasAbiertas > 0:
+                raise Exception((f"Open zones, Partition cannot be armed")) 
         except Exception as err:
             _LOGGER.exception(err)
-            raise InvokeGarnetAPIException(err)
-
-        if("success" in response and response["success"]):
-            self.__update_status(response["message"]["status"])
-        else: 
-            if("message" in response):
-                if((response["message"] == "Failed to authenticate token.") or (response["message"] == "No token provided.")):
-                    _LOGGER.warning(response["message"])
-                    raise Exception(response["message"])        # Esto no deberia ocurrir porque se supone que el tiempo de vida del token esta controlado
-                elif((response["message"] == "No se recibió respuesta del sistema en el tiempo máximo esperado") or (response["message"] == "Ya hay un comando en progreso")):
-                    raise UnresponsiveGarnetAPI(response["message"])
-                else:                
-                    raise InvokeGarnetAPIException(response["message"])
-            else:
-                raise InvokeGarnetAPIException("Invalid JSON " + str(response))
+            raise err
+        # end: #1
+        (path, body) = self.__arm_command(partition, mode)
+        sent = time.time()
+        self.__update_status((await self.__async_command(path, body))["status"], sent)
 
 
-    def disarm_system(self, partition: int) -> None:
-        """Desarmado de particion."""
+    def __disarm_command(self, partition: int) -> tuple[str, dict]:
         _LOGGER.debug(f"Executing disarm_system({partition}) method")
-
         if(not self.user.disarm_permision):
-            raise PermissionError("User " + self.user.name + " has no permision for disarming the partition")
-
+            raise PermissionError(f"User {self.__user_label()} has no permision for disarming the partition")
         body = {}
         body["seq"] = self.__sequence(increment = 1)
         body["partNumber"] = str(partition)
         body["timeout"] = GARNETAPITIMEOUT
+        return (f"/users_api/v1/systems/{self.system.id}/commands/disarm", body)
 
-        response = {}
-        try:
-            conn = http.client.HTTPSConnection(GARNETAPIURL)
-            _token=self.__token()
-            _LOGGER.debug(f"Executing POST on /users_api/v1/systems/{self.system.id}/commands/disarm with body={json.dumps(body)} and header='x-access-token': {_token}")
-            conn.request("POST", f"/users_api/v1/systems/{self.system.id}/commands/disarm", json.dumps(body), { 'x-access-token': _token, 'Content-Type': 'application/json' })
-            response = json.loads(conn.getresponse().read().decode("utf-8"))
-            conn.close()
-        except Exception as err:
-            _LOGGER.exception(err)
-            raise InvokeGarnetAPIException(err)
 
-        if("success" in response and response["success"]):
-            self.__update_status(response["message"]["status"])
-        else: 
-            if("message" in response):
-                if((response["message"] == "Failed to authenticate token.") or (response["message"] == "No token provided.")):
-                    _LOGGER.warning(response["message"])
-                    raise Exception(response["message"])        # Esto no deberia ocurrir porque se supone que el tiempo de vida del token esta controlado
-                elif((response["message"] == "No se recibió respuesta del sistema en el tiempo máximo esperado") or (response["message"] == "Ya hay un comando en progreso")):
-                    raise UnresponsiveGarnetAPI(response["message"])
-                else:                
-                    raise InvokeGarnetAPIException(response["message"])
-            else:
-                raise InvokeGarnetAPIException("Invalid JSON " + str(response))
+    async def async_disarm_system(self, partition: int) -> None:
+        """Desarmado de particion."""
+        await self.commands.run(lambda: self.__async_disarm_system(partition), PRIORITY_USER)
 
 
-    def horn_control(self, mode: str) -> None:
-        """Control de sirena."""
-        _LOGGER.debug(f"Executing horn_control({mode}) method")
+    async def __async_disarm_system(self, partition: int) -> None:
+        (path, body) = self.__disarm_command(partition)
+        sent = time.time()
+        self.__update_status((await self.__async_command(path, body))["status"], sent)
 
-        if(not self.user.horn_permision):
-            raise PermissionError("User " + self.user.name + " has no permision control the horn")
 
+    def __horn_command(self, mode: str) -> tuple[str, dict]:
+        _LOGGER.debug(f"Executing horn_control({mode}) method")
+        if(not self.user.horn_permision):
+            raise PermissionError(f"User {self.__user_label()} has no permision control the horn")
         body = {}
         body["seq"] = self.__sequence(increment = 1)
         body["timeout"] = GARNETAPITIMEOUT
+        command = ("set_bell" if mode == "on" else "unset_bell")
+        return (f"/users_api/v1/systems/{self.system.id}/commands/{command}", body)
 
-        response = {}
-        try:
-            conn = http.client.HTTPSConnection(GARNETAPIURL)
-            command = ("set_bell" if mode == "on" else "unset_bell")
-            _token=self.__token()
-            _LOGGER.debug(f"Executing POST on /users_api/v1/systems/{self.system.id}/commands/{command} with body={json.dumps(body)} and header='x-access-token': {_token}")
-            conn.request("POST", f"/users_api/v1/systems/{self.system.id}/commands/{command}", json.dumps(body), { 'x-access-token': _token, 'Content-Type': 'application/json' })
-            response = json.loads(conn.getresponse().read().decode("utf-8"))
-            conn.close()
-        except Exception as err:
-            _LOGGER.exception(err)
-            raise InvokeGarnetAPIException(err)
 
-        if("success" in response and response["success"]):
-            self.__update_status(response["message"]["status"])
-        else: 
-            if("message" in response):
-                if((response["message"] == "Failed to authenticate token.") or (response["message"] == "No token provided.")):
-                    _LOGGER.warning(response["message"])
-                    raise Exception(response["message"])        # Esto no deberia ocurrir porque se supone que el tiempo de vida del token esta controlado
-                elif((response["message"] == "No se recibió respuesta del sistema en el tiempo máximo, json.dumps(body),  esperado") or (response["message"] == "Ya hay un comando en progreso")):
-                    raise UnresponsiveGarnetAPI(response["message"])
-                else:                
-                    raise InvokeGarnetAPIException(response["message"])
-            else:
-                raise InvokeGarnetAPIException("Invalid JSON " + str(response))
+    async def async_horn_control(self, mode: str) -> None:
+        """Control de sirena."""
+        await self.commands.run(lambda: self.__async_horn_control(mode), PRIORITY_USER)
 
 
-    def report_emergency(self, type: str, partition_id: int, partition_name: str) -> None:
-        """Genera una emergencia."""
+    async def __async_horn_control(self, mode: str) -> None:
+        (path, body) = self.__horn_command(mode)
+        sent = time.time()
+        self.__update_status((await self.__async_command(path, body))["status"], sent)
+
+
+    def __emergency_command(self, type: str, partition_id: int, partition_name: str) -> tuple[str, dict]:
         _LOGGER.debug(f"Executing report_emergency({type},{partition_id},{partition_name}) method")
         body = {}
         body["partition"] = {}
@@ -500,31 +702,17 @@ class HTTP_API:
         body["partition"]["editedName"] = partition_name
         body["emergencyType"] = 1 if type == "Medico" else (3 if type == "Incendio" else (4 if type == "Panico" else 2))
         body["timeout"] = GARNETAPITIMEOUT
+        return (f"/users_api/v1/systems/{self.system.id}/commands/emergency", body)
+
+
+    async def async_report_emergency(self, type: str, partition_id: int, partition_name: str) -> None:
+        """Genera una emergencia."""
+        await self.commands.run(lambda: self.__async_report_emergency(type, partition_id, partition_name), PRIORITY_USER)
 
-        response = {}
-        try:
-            conn = http.client.HTTPSConnection(GARNETAPIURL)
-            _token=self.__token()
-            _LOGGER.debug(f"Executing POST on /users_api/v1/systems/{self.system.id}/commands/emergency with body={json.dumps(body)} and header='x-access-token': {_token}")
-            conn.request("POST", f"/users_api/v1/systems/{self.system.id}/commands/emergency", json.dumps(body), { 'x-access-token': _token, 'Content-Type': 'application/json' })
-            response = json.loads(conn.getresponse().read().decode("utf-8"))
-            conn.close()
-        except Exception as err:
-            _LOGGER.exception(err)
-            raise InvokeGarnetAPIException(err)
-        if("success" in response and response["success"]):
-            _LOGGER.info(response["message"]["response"])
-        else: 
-            if("message" in response):
-                if((response["message"] == "Failed to authenticate token.") or (response["message"] == "No token provided.")):
-                    _LOGGER.warning(response["message"])
-                    raise Exception(response["message"])        # Esto no deberia ocurrir porque se supone que el tiempo de vida del token esta controlado
-                elif((response["message"] == "No se recibió respuesta del sistema en el tiempo máximo esperado") or (response["message"] == "Ya hay un comando en progreso")):
-                    raise UnresponsiveGarnetAPI(response["message"])
-                else:                
-                    raise InvokeGarnetAPIException(response["message"])
-            else:
-                raise InvokeGarnetAPIException("Invalid JSON " + str(response))
+
+    async def __async_report_emergency(self, type: str, partition_id: int, partition_name: str) -> None:
+        (path, body) = self.__emergency_command(type, partition_id, partition_name)
+        _LOGGER.info((await self.__async_command(path, body))["response"])
 
 
     def bypass_zone(self, zone: int, mode: int) -> None:
@@ -585,12 +773,24 @@ class HTTP_API:
         #{"success":true,"message":{"timeout":4500}}
 
 
-    def get_lastupdate(self) -> None:
-        """Obtiene fecha del ultimo update."""
-        #TODO: Implementar
-        #sin header
+    async def async_get_lastupdate(self) -> str:
+        """Obtiene fecha del ultimo update. No es un comando al panel, no pasa por la cola"""
         #https://web.garnetcontrol.app/users_api/v1/systems/a10050008d96/lastUpdate
         #{"success":true,"message":{"lastUpdate":"2024-10-15T03:28:44.993Z","lastEvent":"2024-10-14T11:19:09.045Z"}}
+        try:
+            response = await self.__async_authorized_request("GET", f"/users_api/v1/systems/{self.panelid}/lastUpdate")
+        except Exception as err:
+            raise InvokeGarnetAPIException(err)
+        return self.__lastupdate_response(response)
+
+
+    def __lastupdate_response(self, response: dict) -> str:
+        if("success" in response and response["success"]):
+            try:
+                return response["message"]["lastUpdate"]
+            except (KeyError, TypeError):
+                raise InvokeGarnetAPIException(f"Invalid JSON {str(response)}")
+        self.__raise_error(response)
 
 
     def get_lasteventreport(self) -> None:
@@ -606,6 +806,9 @@ class UnresponsiveGarnetAPI(Exception):
 class InvokeGarnetAPIException(Exception):
     """Excepcion ante error en API Garnet."""
 
+class TokenRejectedException(InvokeGarnetAPIException):
+    """El servidor rechazo el token de sesion aun despues de renovarlo."""
+
 class SystemDoesNotExistException(Exception):
     """ID de panel no existe en Garnet Control."""
 
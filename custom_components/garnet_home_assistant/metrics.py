@@ -0,0 +1,94 @@
+"""Registro de metricas del receptor SIA y la API. Contadores e histogramas de bajo costo, sin dependencias"""
+
+from bisect import bisect_left
+from collections.abc import Callable
+
+
+# Limites superiores de los buckets en milisegundos. El ultimo bucket (sin limite) acumula el resto
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+
+class Counter:
+    """Contador monotono"""
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, n: int = 1) -> None:
+        self.value += n
+
+
+class Histogram:
+    """Histograma de buckets fijos. observe es una busqueda binaria y una suma"""
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds: tuple = LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if(value > self.max):
+            self.max = value
+
+    def quantile(self, q: float) -> float | None:
+        """Aproximacion del cuantil q: limite superior del bucket que lo contiene"""
+        if(self.count == 0):
+            return None
+        rank = q * self.count
+        seen = 0
+        for (i, n) in enumerate(self.counts):
+            seen += n
+            if(seen >= rank):
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 4),
+            "buckets": dict(zip([str(b) for b in self.bounds] + ["+inf"], self.counts)),
+        }
+
+
+class MetricsRegistry:
+    """Metricas por nombre. Los gauges se calculan al leerlos, asi los contadores que ya existen no se duplican"""
+
+    def __init__(self) -> None:
+        self.counters: dict[str, Counter] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.gauges: dict[str, Callable[[], float]] = {}
+
+    def counter(self, name: str) -> Counter:
+        return self.counters.setdefault(name, Counter())
+
+    def histogram(self, name: str, bounds: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.histograms.setdefault(name, Histogram(bounds))
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        self.gauges[name] = read
+
+    def value(self, name: str) -> float | None:
+        """Valor actual de un contador o gauge"""
+        if(name in self.counters):
+            return self.counters[name].value
+        if(name in self.gauges):
+            return self.gauges[name]()
+        return None
+
+    def as_dict(self) -> dict:
+        """Foto de todas las metricas para diagnostico"""
+        data = {name: c.value for (name, c) in self.counters.items()}
+        data.update({name: read() for (name, read) in self.gauges.items()})
+        data.update({name: h.as_dict() for (name, h) in self.histograms.items()})
+        return data
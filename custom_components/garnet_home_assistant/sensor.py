@@ -2,22 +2,48 @@
 
 import logging
 
-from homeassistant.components.sensor import SensorDeviceClass, SensorEntity 
+from homeassistant.components.sensor import SensorDeviceClass, SensorEntity, SensorStateClass
 from homeassistant.config_entries import ConfigEntry 
+from homeassistant.const import EntityCategory, Platform, UnitOfTime
 from homeassistant.core import HomeAssistant, callback 
-from homeassistant.helpers.device_registry import DeviceInfo 
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.device_registry import DeviceEntryType, DeviceInfo 
 from homeassistant.helpers.entity_platform import AddEntitiesCallback 
 from homeassistant.helpers.update_coordinator import CoordinatorEntity 
 
 from .const import DOMAIN
 from .httpapi import DeviceType, GarnetEntity
 from .coordinator import GarnetPanelIntegrationCoordinator
+from .api import GarnetAPI
+from .metrics import MetricsRegistry
 from enum import StrEnum
 
 
 _LOGGER = logging.getLogger(__name__)
 
 
+# Metricas expuestas como sensores de diagnostico (deshabilitados por defecto)
+# (clave, nombre, origen, metrica, cuantil o None si es contador/gauge)
+RECEIVER_METRICS = [
+    ("frames_received", "SIA frames received", "server", "frames_received", None),
+    ("frames_invalid", "SIA invalid frames", "server", "frames_invalid", None),
+    ("crc_failures", "SIA CRC failures", "server", "crc_failures", None),
+    ("unknown_accounts", "SIA unknown accounts", "server", "unknown_accounts", None),
+    ("unknown_events", "SIA unknown event codes", "server", "unknown_events", None),
+    ("duplicates_suppressed", "SIA duplicates suppressed", "server", "duplicates_suppressed", None),
+    ("kernel_drops", "SIA datagrams dropped by kernel", "server", "kernel_drops", None),
+    ("frames_rejected", "SIA frames rejected by source filter", "server", "frames_rejected", None),
+    ("receiver_restarts", "SIA receiver restarts", "server", "receiver_restarts", None),
+    ("queue_depth", "SIA queue depth", "server", "queue_depth", None),
+    ("ack_latency", "SIA ACK latency p95", "server", "ack_latency_ms", 0.95),
+    ("parse_time", "SIA parse time p95", "server", "parse_time_ms", 0.95),
+    ("callback_time", "SIA callback time p95", "server", "callback_time_ms", 0.95),
+    ("sia_events", "SIA events processed", "api", "sia_events", None),
+    ("sia_stale_events", "SIA events older than current state", "api", "sia_stale_events", None),
+    ("coordinator_updates", "Coordinator updates", "api", "coordinator_updates", None),
+]
+
+
 async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry, async_add_entities: AddEntitiesCallback):
     """Set up the Sensors."""
     coordinator: GarnetPanelIntegrationCoordinator = hass.data[DOMAIN][config_entry.entry_id].coordinator
@@ -36,6 +62,24 @@ async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry, asyn
         for device in coordinator.data.devices
         if device.device_type == DeviceType.TEXT_SENSOR
     ])
+    owner = _owns_receiver_metrics(hass, config_entry)
+    async_add_entities([
+        ReceiverMetricSensor(coordinator, *metric)
+        for metric in RECEIVER_METRICS
+        if metric[2] == "api" or owner
+    ])
+
+
+def _owns_receiver_metrics(hass: HomeAssistant, config_entry: ConfigEntry) -> bool:
+    """Las metricas del receptor son del proceso y no de la cuenta, las publica una sola entrada:
+       la que ya las tiene registradas o, si ninguna, la primera que se configura"""
+    registry = er.async_get(hass)
+    entity_id = registry.async_get_entity_id(Platform.SENSOR, DOMAIN, _receiver_metric_unique_id(RECEIVER_METRICS[0][0]))
+    return entity_id is None or registry.async_get(entity_id).config_entry_id == config_entry.entry_id
+
+
+def _receiver_metric_unique_id(key: str) -> str:
+    return f"{DOMAIN}-receiver-metric-{key}"
         
     
 class ZoneSensor(CoordinatorEntity, SensorEntity):
@@ -250,4 +294,75 @@ class PartitionSensor(CoordinatorEntity, SensorEntity):
     def icon(self):
         if(self._icon):
             return self._icon
-        return None    
\ No newline at end of file
+        return None
+
+
+class ReceiverMetricSensor(CoordinatorEntity, SensorEntity):
+    """Metrica del receptor SIA o de la API. Sensor de diagnostico, deshabilitado por defecto"""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+
+    def __init__(self, coordinator: GarnetPanelIntegrationCoordinator, key: str, name: str, source: str, metric: str, quantile: float | None) -> None:
+        """Initialise sensor."""
+        super().__init__(coordinator)
+        self.key = key
+        self._attr_name = name
+        self.source = source
+        self.metric = metric
+        self.quantile = quantile
+        if(quantile is not None):
+            self._attr_native_unit_of_measurement = UnitOfTime.MILLISECONDS
+            self._attr_state_class = SensorStateClass.MEASUREMENT
+        elif(metric == "queue_depth"):
+            self._attr_state_class = SensorStateClass.MEASUREMENT
+        else:
+            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+
+
+    @property
+    def should_poll(self) -> bool:
+        """Las metricas cambian sin que haya actualizaciones del coordinador"""
+        return True
+
+
+    async def async_update(self) -> None:
+        """No pide refresco al coordinador, solo vuelve a leer la metrica"""
+
+
+    def __registry(self) -> MetricsRegistry | None:
+        if(self.source == "api"):
+            return self.coordinator.api.metrics
+        return GarnetAPI.messageserver.metrics if GarnetAPI.messageserver is not None else None
+
+
+    @property
+    def available(self) -> bool:
+        return self.__registry() is not None
+
+
+    @property
+    def device_info(self) -> DeviceInfo:
+        """Las metricas de la API van en el panel, las del receptor en un dispositivo compartido por todas las cuentas"""
+        if(self.source == "api"):
+            return self.coordinator.get_device_info()
+        return DeviceInfo(name="Garnet SIA receiver", manufacturer="Garnet", entry_type=DeviceEntryType.SERVICE,
+                          identifiers={(DOMAIN, f"{DOMAIN} (receiver)")})
+
+
+    @property
+    def unique_id(self) -> str:
+        """Return unique id."""
+        if(self.source == "api"):
+            return f"{DOMAIN}-{self.coordinator.account}-metric-{self.key}"
+        return _receiver_metric_unique_id(self.key)
+
+
+    @property
+    def native_value(self) -> float | None:
+        registry = self.__registry()
+        if(registry is None):
+            return None
+        if(self.quantile is not None):
+            return registry.histogram(self.metric).quantile(self.quantile)
+        return registry.value(self.metric)
@@ -0,0 +1,196 @@
+"""Journal binario de tramas SIA recibidas. Solo se agrega al final, con rotacion de segmentos y tope de tamaño"""
+
+import asyncio
+import logging
+import mmap
+import os
+import socket
+import struct
+import time
+
+from collections.abc import Callable
+from typing import NamedTuple
+
+from .const import SIA_JOURNAL_FLUSH_INTERVAL, SIA_JOURNAL_FLUSH_SIZE, SIA_JOURNAL_MAX_SIZE, SIA_JOURNAL_SEGMENT_SIZE
+
+
+_LOGGER = logging.getLogger(__name__)
+
+_MAGIC = b"SIAJRNL1"                     # Encabezado de cada segmento
+_ENTRY = struct.Struct("!d4sHBH")       # Hora de recepcion, IP y puerto de origen, resultado del parseo y largo de la trama
+_SUFFIX = ".journal"
+
+# Resultado del parseo. El indice es lo que se guarda en el journal
+PARSE_RESULTS = (None, "bad header", "bad length", "truncated frame", "crc mismatch", "missing token", "missing header field", "malformed CID payload")
+_UNKNOWN_RESULT = 255
+
+
+class JournalEntry(NamedTuple):
+    """Una trama del journal. error es None si la trama fue valida"""
+    time: float
+    senderAddr: tuple
+    error: str | None
+    frame: bytes
+
+
+def _pack(frame: bytes, senderAddr: tuple, error: str | None, received: float) -> bytes:
+    try:
+        ip = socket.inet_aton(senderAddr[0])
+    except (OSError, TypeError, IndexError):
+        ip = bytes(4)                   # Origen IPv6 o desconocido
+    result = PARSE_RESULTS.index(error) if error in PARSE_RESULTS else _UNKNOWN_RESULT
+    return _ENTRY.pack(received, ip, senderAddr[1] if senderAddr else 0, result, len(frame)) + frame
+
+
+def segments(directory: str) -> list[str]:
+    """Segmentos del journal del mas viejo al mas nuevo"""
+    if(not os.path.isdir(directory)):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(_SUFFIX)]
+
+
+def read_segment(path: str) -> list[JournalEntry]:
+    """Lee un segmento con mmap. Una entrada final incompleta (corte durante la escritura) se ignora"""
+    entries = []
+    with open(path, "rb") as f:
+        if(os.fstat(f.fileno()).st_size <= len(_MAGIC)):
+            return entries
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if(m[:len(_MAGIC)] != _MAGIC):
+                _LOGGER.warning("[read_segment] %s is not a SIA journal segment", path)
+                return entries
+            offset = len(_MAGIC)
+            while(offset + _ENTRY.size <= len(m)):
+                (received, ip, port, result, length) = _ENTRY.unpack_from(m, offset)
+                start = offset + _ENTRY.size
+                if(start + length > len(m)):
+                    break
+                error = PARSE_RESULTS[result] if result < len(PARSE_RESULTS) else "unknown"
+                entries.append(JournalEntry(received, (socket.inet_ntoa(ip), port), error, m[start:start + length]))
+                offset = start + length
+    return entries
+
+
+def read_journal(directory: str, since: float | None = None) -> list[JournalEntry]:
+    """Lee todos los segmentos en orden. Con since solo devuelve lo recibido desde ese momento (epoch)"""
+    entries = []
+    for path in segments(directory):
+        entries.extend(e for e in read_segment(path) if since is None or e.time >= since)
+    return entries
+
+
+async def replay(entries: list[JournalEntry], feed: Callable[[JournalEntry], None], speed: float = 1.0) -> int:
+    """Reinyecta las entradas respetando los tiempos originales divididos por speed. speed = 0 las envia sin demoras"""
+    if(len(entries) == 0):
+        return 0
+    origin = entries[0].time
+    started = time.monotonic()
+    for entry in entries:
+        if(speed > 0):
+            delay = (entry.time - origin) / speed - (time.monotonic() - started)
+            if(delay > 0):
+                await asyncio.sleep(delay)
+        feed(entry)
+    return len(entries)
+
+
+class SIAJournal:
+    """Escritor del journal. append corre en el event loop y solo acumula en memoria.
+       La escritura a disco, la rotacion y el borrado de segmentos viejos corren en el executor"""
+
+    def __init__(self, directory: str, segment_size: int = SIA_JOURNAL_SEGMENT_SIZE, max_size: int = SIA_JOURNAL_MAX_SIZE) -> None:
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.pending = bytearray()
+        self.flushing = False
+        self.timer: asyncio.TimerHandle | None = None
+        self.written = 0
+        self.closing = False
+        self.__file = None
+
+
+    def append(self, frame: bytes, senderAddr: tuple, error: str | None) -> None:
+        """Agrega una trama. Se escribe a disco por lotes"""
+        self.pending += _pack(frame, senderAddr, error, time.time())
+        if(len(self.pending) >= SIA_JOURNAL_FLUSH_SIZE):
+            self.__flush()
+        elif(self.timer is None and not self.flushing):
+            self.timer = asyncio.get_running_loop().call_later(SIA_JOURNAL_FLUSH_INTERVAL, self.__flush)
+
+
+    def __flush(self) -> None:
+        """Envia lo acumulado al executor. Una sola escritura a la vez para no mezclar el orden"""
+        if(self.timer is not None):
+            self.timer.cancel()
+            self.timer = None
+        if(self.flushing or len(self.pending) == 0):
+            return
+        chunk = bytes(self.pending)
+        self.pending.clear()
+        self.flushing = True
+        asyncio.get_running_loop().run_in_executor(None, self.__write, chunk).add_done_callback(self.__flushed)
+
+
+    def __flushed(self, future: asyncio.Future) -> None:
+        self.flushing = False
+        if(future.exception() is not None):
+            _LOGGER.error("[__flushed] Cannot write SIA journal: %s", str(future.exception()))
+        if(self.closing):
+            self.close()
+        elif(len(self.pending) > 0):
+            self.__flush()
+
+
+    def __write(self, chunk: bytes) -> None:
+        """Escribe en el segmento actual. Corre en el executor"""
+        if(self.__file is not None and self.__file.tell() + len(chunk) > self.segment_size):
+            self.__file.close()
+            self.__file = None
+        if(self.__file is None):
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"sia-{int(time.time() * 1000):015d}{_SUFFIX}")
+            self.__file = open(path, "ab")
+            if(self.__file.tell() == 0):
+                self.__file.write(_MAGIC)
+            self.__enforce_cap()
+        self.__file.write(chunk)
+        self.__file.flush()
+        self.written += len(chunk)
+
+
+    def __enforce_cap(self) -> None:
+        """Borra los segmentos mas viejos hasta quedar debajo de max_size"""
+        paths = segments(self.directory)
+        sizes = [os.path.getsize(p) for p in paths]
+        total = sum(sizes)
+        for (path, size) in zip(paths[:-1], sizes[:-1]):     # Nunca el segmento actual
+            if(total <= self.max_size):
+                break
+            os.remove(path)
+            total -= size
+            _LOGGER.debug("[__enforce_cap] SIA journal segment %s removed", path)
+
+
+    def __close_file(self, chunk: bytes) -> None:
+        if(len(chunk) > 0):
+            self.__write(chunk)
+        if(self.__file is not None):
+            self.__file.close()
+            self.__file = None
+
+
+    def close(self) -> None:
+        """Escribe lo pendiente y cierra el segmento. Si hay una escritura en curso se cierra cuando termina"""
+        if(self.timer is not None):
+            self.timer.cancel()
+            self.timer = None
+        self.closing = True
+        if(self.flushing):
+            return
+        chunk = bytes(self.pending)
+        self.pending.clear()
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self.__close_file, chunk)
+        except RuntimeError:                    # Fuera del loop
+            self.__close_file(chunk)
@@ -1,14 +1,49 @@
 """Implementacion de servidor UDP que recibe los mensajes SIA"""
 
+import asyncio
+import ipaddress
 import logging
-import threading
 import socket
-import time
+import sys
 import datetime
+import time
 
+from collections import deque
+from collections.abc import Callable
 from enum import Enum
+from functools import cached_property, partial
 
-from .const import MESSAGESERVER_TIMEOUT, SIA_BUFFERSIZE, DEFAULT_UDP_PORT
+from . import contactid
+from .siatcp import SIATCPServer
+from . import siajournal
+from .metrics import MetricsRegistry
+
+from .const import (
+    ACK_TEMPLATE_CACHE_SIZE,
+    DEFAULT_SIA_RCVBUF,
+    DEFAULT_UDP_PORT,
+    SIA_BACKLOG_MAX_AGE,
+    SIA_BACKLOG_SIZE,
+    SIA_BACKLOG_WINDOW,
+    SIA_BUFFERSIZE,
+    SIA_CLOCK_SAMPLES,
+    SIA_DEDUP_SIZE,
+    SIA_DEDUP_TTL,
+    SIA_DRAIN_LIMIT,
+    SIA_HANDOVER_TIMEOUT,
+    SIA_LOG_INTERVAL,
+    SIA_LOG_SOURCES,
+    SIA_QUEUE_BATCH,
+    SIA_QUEUE_POLICY,
+    SIA_QUEUE_SIZE,
+    SIA_RATE_BURST,
+    SIA_RATE_LIMIT,
+    SIA_RATE_SOURCES,
+    SIA_RESTART_BACKOFF,
+    SIA_RESTART_BACKOFF_MAX,
+    SIA_SEEN_ACCOUNTS,
+    SIA_SUPERVISOR_INTERVAL,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -31,235 +66,1366 @@ class siacode(Enum):
     restorezone =     12
     trigger =         13
     restore =         14
+    event =           15        # Evento Contact ID conocido que no modifica el estado de las entidades
     dontdoanything =  100
     keepalive      =  101
 
 
-class SIAUDPServer():
-    """Clase para manejar mensajeria SIA"""
-
-    sia_thread = None
-    errorcode = None
-    active = False
-    port = DEFAULT_UDP_PORT
-
-
-    def __init__(self, port: int = DEFAULT_UDP_PORT):
-        """Thread que recibe los mensajes SIA."""
-        SIAUDPServer.subscribers = {}
-        SIAUDPServer.active = True
-        SIAUDPServer.port = port
-        SIAUDPServer.sia_thread = threading.Thread(target=SIAUDPServer.__messageserver_thread, name="SIA-Thread")
-        _LOGGER.info("Starting SIA UDP Server...")
-        SIAUDPServer.sia_thread.start()
-        timeout = 0
-        while(timeout < MESSAGESERVER_TIMEOUT and SIAUDPServer.errorcode == None):
-            _LOGGER.debug("Waiting for SIA Server socket to be ready...")
-            time.sleep(1)
-            timeout = timeout + 1
-        if(SIAUDPServer.errorcode != "success"):
-            SIAUDPServer.active = False
-            if(SIAUDPServer.errorcode == None):
-                raise Exception("timeout")
+def _crc16_table() -> tuple[int, ...]:
+    """Tabla de CRC-16/ARC (polinomio reflejado 0xA001) para procesar un byte por iteracion"""
+    table = []
+    for i in range(256):
+        crcx = i
+        for j in range(0, 8):
+            crcx = ((crcx >> 1) ^ 0xA001) if (crcx & 0x0001) else (crcx >> 1)
+        table.append(crcx)
+    return tuple(table)
+
+
+_CRC16_TABLE = _crc16_table()
+
+
+def crc16(data: bytes | bytearray | memoryview, crc: int = 0x0000) -> int:
+    """Calcula CRC-16/ARC. Recibe el CRC parcial para poder calcularlo de forma incremental"""
+    table = _CRC16_TABLE
+    for b in data:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+
+class SIAAckTemplate:
+    """ACK precalculado para una combinacion de cuenta, receptor y prefijo. Solo cambia la secuencia"""
+
+    __slots__ = ("suffix", "sequence", "ack")
+
+    TOKEN = b'"ACK"'
+    TOKEN_CRC = crc16(TOKEN)
+
+    def __init__(self, header: bytes, account: bytes) -> None:
+        """header es R<receiver>L<prefix> tal como vino en la trama"""
+        self.suffix = header + account + b"[]"
+        self.sequence = None
+        self.ack = None
+
+
+    def build(self, sequence: bytes) -> bytes:
+        """Devuelve el ACK firmado para la secuencia. Una retransmision reutiliza el ultimo ACK"""
+        if(sequence != self.sequence):
+            crc = crc16(self.suffix, crc16(sequence, SIAAckTemplate.TOKEN_CRC))
+            self.ack = b"\n%#04x0%d%s%s%s\r" % (crc, len(SIAAckTemplate.TOKEN) + len(sequence) + len(self.suffix), SIAAckTemplate.TOKEN, sequence, self.suffix)
+            self.sequence = sequence
+        return self.ack
+
+
+_ACK_TEMPLATES: dict[bytes, SIAAckTemplate] = {}
+
+
+def _ack_template(header: bytes, account: bytes) -> SIAAckTemplate:
+    """Template de ACK para R<receiver>L<prefix> y cuenta. Se cachea por la combinacion"""
+    key = header + b"#" + account
+    template = _ACK_TEMPLATES.get(key)
+    if(template is None):
+        if(len(_ACK_TEMPLATES) >= ACK_TEMPLATE_CACHE_SIZE):
+            _ACK_TEMPLATES.clear()
+        template = _ACK_TEMPLATES[key] = SIAAckTemplate(header, account)
+    return template
+
+
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)       # Linux. Python no siempre exporta la constante
+_OVFL_SPACE = socket.CMSG_SPACE(4) if hasattr(socket, "CMSG_SPACE") else 0
+
+
+def configure_socket(sock: socket.socket, rcvbuf: int) -> bool:
+    """Ajusta SO_RCVBUF (bytes, 0 deja el del kernel) y habilita el contador de descartes del kernel.
+       Devuelve True si el socket informa descartes (SO_RXQ_OVFL, solo Linux)"""
+    if(rcvbuf > 0):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        effective = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if(effective < rcvbuf):         # Linux duplica el valor pedido pero lo limita a net.core.rmem_max
+            _LOGGER.warning("[configure_socket] SIA receive buffer limited to %d bytes (requested %d). Check net.core.rmem_max", effective, rcvbuf)
+    if(not sys.platform.startswith("linux") or _OVFL_SPACE == 0):
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+    except OSError as err:
+        _LOGGER.debug("[configure_socket] SO_RXQ_OVFL not available: %s", str(err))
+        return False
+    return True
+
+
+def kernel_drops(ancdata: list) -> int | None:
+    """Contador acumulado de datagramas descartados por el kernel en el socket, tomado de los datos auxiliares de recvmsg"""
+    for (level, kind, data) in ancdata:
+        if(level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= 4):
+            return int.from_bytes(data[:4], byteorder=sys.byteorder)
+    return None
+
+
+_NULL_TOKEN = b'"NULL"'
+_CID_TOKEN = b'"ADM-CID"'
+_KEEPALIVE_EVENTS = (b"1602",)         # Test periodico: QEEE tal como viaja en la trama
+
+
+def keepalive_ack(datagram: bytes) -> tuple[str, bytes, bytes] | None:
+    """Camino rapido para keep alive (NULL) y test periodico (602).
+       Se reconocen por el token y los bytes del encabezado, se valida el CRC y se devuelve (cuenta, ACK, timestamp sin
+       decodificar) sin crear un SIAFrameProcessor. Cualquier otra trama, o una que no respete el formato, devuelve None y
+       sigue el camino normal"""
+    if(len(datagram) < 16 or datagram[0] != 0x0A):
+        return None
+    null = datagram.startswith(_NULL_TOKEN, 7)
+    if(not null and not datagram.startswith(_CID_TOKEN, 7)):
+        return None
+    try:
+        end = int(datagram[4:7], 16) + 7
+    except ValueError:
+        return None
+    q = 7 + (len(_NULL_TOKEN) if null else len(_CID_TOKEN))
+    r = datagram.find(b'R', q, end)
+    h = datagram.find(b'#', r, end) if r > 0 else -1
+    b = datagram.find(b'[', h, end) if h > 0 else -1
+    if(b < 0 or end > len(datagram)):
+        return None
+    if(not null):
+        c = datagram.find(b'|', b, end)
+        c = b + 1 if c < 0 else c + 1
+        if(datagram[c:c + 4] not in _KEEPALIVE_EVENTS):
+            return None
+    if(crc16(memoryview(datagram)[7:end]) != int.from_bytes(datagram[1:3], byteorder='big')):
+        return None
+    account = datagram[h + 1:b]
+    u = datagram.find(b'_', b, end)
+    return (account.decode(errors="replace"), _ack_template(datagram[r:h], account).build(datagram[q:r]), datagram[u + 1:end] if u > 0 else b"")
+
+
+def parse_timestamp(text: str) -> datetime.datetime | None:
+    """Timestamp SIA (<hh:mm:ss,MM-DD-YYYY>, hora del panel). None si no respeta el formato"""
+    try:
+        return datetime.datetime.strptime(text, "%H:%M:%S,%m-%d-%Y")
+    except ValueError:
+        return None
+
+
+class SIASourceFilter:
+    """Filtro por origen que se aplica antes de parsear: redes permitidas y token bucket por IP.
+       Acota el costo de lo que llegue al puerto, sea un panel mal configurado o un emisor hostil"""
+
+    def __init__(self, networks: list[str] | None = None, rate: float = SIA_RATE_LIMIT, burst: int = SIA_RATE_BURST, size: int = SIA_RATE_SOURCES) -> None:
+        """networks vacio permite cualquier origen. rate = 0 deshabilita el limite de tramas por segundo"""
+        self.networks = [ipaddress.ip_network(n.strip(), strict=False) for n in (networks or []) if n.strip()]
+        self.rate = rate
+        self.burst = burst
+        self.size = size
+        self.sources: dict[str, list] = {}          # IP -> [permitida, tokens, ultima trama]. Del menos al mas reciente
+        self.rejected = 0
+
+
+    def permitted(self, ip: str) -> bool:
+        """True si la IP pertenece a alguna red permitida"""
+        if(len(self.networks) == 0):
+            return True
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if(address.version == 6 and address.ipv4_mapped is not None):
+            address = address.ipv4_mapped
+        return any(address in network for network in self.networks)
+
+
+    def reject_reason(self, senderAddr: tuple) -> str | None:
+        """None si la trama puede procesarse, sino el motivo del rechazo"""
+        ip = senderAddr[0]
+        now = time.monotonic()
+        entry = self.sources.pop(ip, None)
+        if(entry is None):
+            if(len(self.sources) >= self.size):
+                self.sources.pop(next(iter(self.sources)))      # El origen que hace mas tiempo no envia
+            entry = [self.permitted(ip), self.burst, now]
+        self.sources[ip] = entry                                # Al final: el orden del dict es el de uso (LRU)
+        if(not entry[0]):
+            self.rejected += 1
+            return "source not allowed"
+        if(self.rate > 0):
+            tokens = min(self.burst, entry[1] + (now - entry[2]) * self.rate)
+            entry[2] = now
+            if(tokens < 1):
+                entry[1] = tokens
+                self.rejected += 1
+                return "rate limited"
+            entry[1] = tokens - 1
+        return None
+
+
+class SIALogSampler:
+    """Agrupa mensajes repetitivos por origen. El primero de cada (tipo, origen) en el intervalo se registra,
+       los siguientes solo se cuentan y se resumen en un unico mensaje al cerrar el intervalo"""
+
+    def __init__(self, interval: float = SIA_LOG_INTERVAL, sources: int = SIA_LOG_SOURCES) -> None:
+        self.interval = interval
+        self.sources = sources
+        self.window = time.monotonic()
+        self.counts: dict[tuple, int] = {}
+
+
+    def report(self, level: int, kind: str, source: str, msg: str, *args) -> None:
+        now = time.monotonic()
+        if(now - self.window >= self.interval):
+            self.flush(now)
+        key = (kind, source)
+        n = self.counts.get(key)
+        if(n is None):
+            if(len(self.counts) >= self.sources):
+                key = (kind, "other sources")               # Acota la memoria con muchos origenes distintos
+                n = self.counts.get(key, 1)
             else:
-                raise Exception(SIAUDPServer.errorcode)
+                _LOGGER.log(level, msg, *args)
+                n = 0
+        self.counts[key] = n + 1
+
+
+    def flush(self, now: float | None = None) -> None:
+        """Registra el resumen de lo suprimido en el intervalo"""
+        repeated = sorted(((n - 1, kind, source) for ((kind, source), n) in self.counts.items() if n > 1), reverse=True)
+        if(len(repeated) > 0):
+            _LOGGER.warning("[SIALogSampler] %d repeated SIA messages suppressed in the last %d seconds: %s", sum(r[0] for r in repeated),
+                            int((now or time.monotonic()) - self.window), ", ".join(f"{kind} from {source} x{n}" for (n, kind, source) in repeated[:10]))
+        self.counts.clear()
+        self.window = now or time.monotonic()
+
+
+class SIAPanelClock:
+    """Lleva el timestamp de las tramas de cada panel al reloj de HA (epoch).
+       El desfase de una cuenta es el minimo de (llegada - timestamp) de sus ultimas tramas: la demora de red solo suma,
+       y los eventos atrasados que el panel vuelca al reconectar no lo afectan. Absorbe tambien la zona horaria del panel"""
+
+    def __init__(self, samples: int = SIA_CLOCK_SAMPLES) -> None:
+        self.samples = samples
+        self.offsets: dict[str, deque[float]] = {}
+
+
+    def observe(self, account: str, timestamp: datetime.datetime | None, received: float) -> None:
+        """Registra una trama recien llegada (no una atrasada del backlog). Los keep alive tambien sirven"""
+        if(timestamp is None):
+            return
+        offsets = self.offsets.get(account)
+        if(offsets is None):
+            offsets = self.offsets[account] = deque(maxlen=self.samples)
+        offsets.append(received - timestamp.timestamp())
+
+
+    def skew(self, account: str) -> float | None:
+        """Segundos que hay que sumar al reloj del panel para llevarlo al de HA. None sin tramas con timestamp"""
+        offsets = self.offsets.get(account)
+        return min(offsets) if offsets else None
+
+
+    def event_time(self, frame: "SIAFrameProcessor") -> float:
+        """Momento del evento en el reloj de HA. Nunca es posterior a la llegada.
+           Sin timestamp o sin desfase estimado es la llegada. Una trama sin llegada registrada se toma como actual"""
+        if(frame.received is None):
+            return time.time()
+        skew = self.skew(frame.account)
+        if(frame.timestamp is None or skew is None):
+            return frame.received
+        return min(frame.timestamp.timestamp() + skew, frame.received)
+
+
+    def panel_time(self, frame: "SIAFrameProcessor") -> float | None:
+        """Timestamp de la trama llevado al reloj de HA (epoch). Sin desfase estimado se asume que el panel esta en hora.
+           None si la trama no tiene timestamp"""
+        if(frame.timestamp is None):
+            return None
+        skew = self.skew(frame.account)
+        return frame.timestamp.timestamp() + (skew if skew is not None else 0)
+
+
+class SIADuplicateFilter:
+    """Cache acotada por TTL de las tramas ya procesadas.
+
+    Si el ACK se pierde o llega tarde el panel reenvia la misma trama con la misma secuencia. La copia
+    se vuelve a confirmar pero no se despacha. Los keep alive no se filtran porque reprocesarlos no cambia nada.
+    """
+
+    def __init__(self, ttl: float = SIA_DEDUP_TTL, size: int = SIA_DEDUP_SIZE) -> None:
+        self.ttl = ttl
+        self.size = size
+        self.seen: dict[tuple, float] = {}          # Orden de insercion == orden temporal
+        self.suppressed = 0
+        self.suppressed_by_account: dict[str, int] = {}
+
+
+    def is_duplicate(self, frame: "SIAFrameProcessor") -> bool:
+        """Registra la trama y devuelve True si ya se habia recibido dentro del TTL"""
+        if(frame.token == "NULL"):
+            return False
+        now = time.monotonic()
+        seen = self.seen
+        while(len(seen) > 0):                   # Vencimiento desde el mas viejo
+            oldest = next(iter(seen))
+            if(now - seen[oldest] < self.ttl):
+                break
+            del seen[oldest]
+        key = (frame.account, frame.sequence, frame.eventcode, frame.zone)
+        if(key in seen):
+            self.suppressed += 1
+            self.suppressed_by_account[frame.account] = self.suppressed_by_account.get(frame.account, 0) + 1
+            return True
+        seen[key] = now
+        if(len(seen) > self.size):
+            del seen[next(iter(seen))]
+        return False
+
+
+class SIAEventQueue:
+    """Cola acotada de eventos de una cuenta.
+
+    El receptor solo parsea, confirma y encola. Una tarea del loop vacia la cola y llama al suscriptor,
+    asi un suscriptor lento no frena la lectura del socket. Si la cola se llena se aplica la politica:
+      - latest: el evento nuevo reemplaza al encolado (no alarma) que modifica la misma entidad. Si no
+                hay, se descarta el no-alarma mas viejo
+      - drop_oldest: se descarta el evento no-alarma mas viejo
+    Las alarmas nunca se descartan. Si la cola solo tiene alarmas se excede el limite.
+    """
+
+    def __init__(self, account: str, size: int = SIA_QUEUE_SIZE, policy: str = SIA_QUEUE_POLICY) -> None:
+        self.account = account
+        self.size = size
+        self.policy = policy
+        self.events: deque[tuple[tuple, bool, SIAFrameProcessor]] = deque()
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.high_water = 0
+        self.replaced = 0
+        self.dropped = 0
+
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+
+    def put(self, data: "SIAFrameProcessor", key: tuple, alarm: bool) -> None:
+        """Encola un evento. key es la entidad que modifica (ver SIADispatcher.fold_key)"""
+        events = self.events
+        if(len(events) >= self.size and not self.__make_room(key, alarm)):
+            self.dropped += 1
+            _LOGGER.warning("[put] Event queue for account %s is full, event %s discarded", self.account, data)
+        else:
+            events.append((key, alarm, data))
+        if(len(events) > self.high_water):
+            self.high_water = len(events)
+        self.wakeup.set()
+
+
+    def __make_room(self, key: tuple, alarm: bool) -> bool:
+        """Aplica la politica de desborde. Devuelve False si el evento nuevo debe descartarse"""
+        events = self.events
+        if(self.policy == "latest"):
+            for (i, queued) in enumerate(events):
+                if(queued[0] == key and not queued[1]):             # Una alarma encolada nunca se reemplaza
+                    del events[i]
+                    self.replaced += 1
+                    return True
+        for (i, queued) in enumerate(events):
+            if(not queued[1]):
+                del events[i]
+                self.dropped += 1
+                return True
+        return alarm                        # Solo hay alarmas encoladas. Una alarma entra igual
+
+
+# Acciones que modifican el mismo estado. Al plegar una rafaga solo importa la ultima de cada familia
+_FOLD_FAMILIES = {
+    siacode.unbypass: siacode.bypass,
+    siacode.group_unbypass: siacode.group_bypass,
+    siacode.present_arm: siacode.arm,
+    siacode.present_disarm: siacode.arm,
+    siacode.disarm: siacode.arm,
+    siacode.alarm_disarm: siacode.arm,
+    siacode.keyboard_arm: siacode.arm,
+    siacode.keyboard_disarm: siacode.arm,
+    siacode.restorezone: siacode.triggerzone,
+    siacode.restore: siacode.trigger,
+    siacode.dontdoanything: siacode.keepalive,
+}
+
+
+def _no_args(frame: "SIAFrameProcessor") -> dict:
+    return {}
+
+
+def _zone_args(frame: "SIAFrameProcessor") -> dict:
+    return {"zone": frame.zone, "partition": frame.partition}
+
+
+def _user_args(frame: "SIAFrameProcessor") -> dict:
+    return {"user": frame.zone, "partition": frame.partition}
+
+
+def _partition_args(frame: "SIAFrameProcessor") -> dict:
+    return {"partition": frame.partition}
+
+
+def _event_args(frame: "SIAFrameProcessor") -> dict:
+    return {"zone": frame.zone, "partition": frame.partition, "description": contactid.describe(frame.eventcode, frame.qualifier)}
+
+
+class SIADispatcher:
+    """Registro de despacho de eventos Contact ID.
+
+    Cada (eventcode, qualifier) tiene un handler y un extractor de argumentos. Si el handler es un siacode
+    se llama al suscriptor con action=handler y los argumentos extraidos de la trama. Si es un callable
+    se lo llama como handler(subscriber, **argumentos) para que resuelva por su cuenta.
+    """
+
+    def __init__(self) -> None:
+        self.handlers: dict[tuple[int, int], tuple[siacode | Callable, Callable]] = {}
+        self.load_defaults()
+
+
+    def load_defaults(self) -> None:
+        """Carga el despacho por defecto a partir de la tabla Contact ID"""
+        E, R, S = contactid.QUALIFIER_NEW_EVENT, contactid.QUALIFIER_RESTORE, contactid.QUALIFIER_STATUS
+        self.handlers.clear()
+        for eventcode in contactid.CONTACT_ID_EVENTS:       # Todo evento conocido al menos se informa
+            for qualifier in (E, R, S):
+                self.register(eventcode, qualifier, siacode.event, _event_args)
+        for eventcode in contactid.CONTACT_ID_EVENTS:
+            if(eventcode in contactid.ZONE_ALARM_EVENTS):               # Alarma de robo en una zona. El resto de las alarmas se informa como evento
+                self.register(eventcode, E, siacode.triggerzone, _zone_args)
+                self.register(eventcode, R, siacode.restorezone, _zone_args)
+            elif(eventcode in contactid.BYPASS_EVENTS and eventcode != 574):
+                self.register(eventcode, E, siacode.bypass, _zone_args)
+                self.register(eventcode, R, siacode.unbypass, _zone_args)
+        for eventcode in (400, 402, 403, 407, 408, 409):               # Apertura / cierre
+            self.register(eventcode, E, siacode.disarm, _user_args)
+            self.register(eventcode, R, siacode.arm, _user_args)
+        for eventcode in (441, 442):                                    # Armado presente
+            self.register(eventcode, E, siacode.present_disarm, _user_args)
+            self.register(eventcode, R, siacode.present_arm, _user_args)
+        self.register(401, E, siacode.keyboard_disarm, _user_args)
+        self.register(401, R, siacode.keyboard_arm, _user_args)
+        self.register(406, E, siacode.alarm_disarm, _user_args)
+        self.register(574, E, siacode.group_bypass, _partition_args)
+        self.register(574, R, siacode.group_unbypass, _partition_args)
+        self.register(459, E, siacode.trigger, _zone_args)
+        self.register(459, R, siacode.restore, _zone_args)
+        for eventcode in (602, 603, 627, 628):          # Test periodico y modo programacion. Solo sirven como keep alive
+            for qualifier in (E, R, S):
+                self.register(eventcode, qualifier, siacode.dontdoanything, _no_args)
+
+
+    def register(self, eventcode: int, qualifier: int, handler: siacode | Callable, extractor: Callable = _zone_args) -> None:
+        """Registra (o reemplaza) el handler de un evento"""
+        self.handlers[(eventcode, qualifier)] = (handler, extractor)
+
+
+    def unregister(self, eventcode: int, qualifier: int) -> None:
+        """Quita el handler de un evento"""
+        self.handlers.pop((eventcode, qualifier), None)
+
+
+    def fold_key(self, frame: "SIAFrameProcessor") -> tuple:
+        """Clave de la entidad que modifica el evento. Dos eventos con la misma clave se pisan"""
+        if(frame.token == "NULL"):
+            return (siacode.keepalive,)
+        entry = self.handlers.get((frame.eventcode, frame.qualifier))
+        if(entry is None or not isinstance(entry[0], siacode)):
+            return (id(frame),)                                 # No se puede saber que modifica, no se pliega
+        family = _FOLD_FAMILIES.get(entry[0], entry[0])
+        if(family in (siacode.bypass, siacode.triggerzone)):
+            return (family, frame.zone)
+        if(family == siacode.event):
+            return (family, frame.eventcode, frame.qualifier, frame.partition, frame.zone)
+        if(family == siacode.keepalive):
+            return (family,)
+        return (family, frame.partition)
+
+
+    def fold(self, frames: list["SIAFrameProcessor"], since: float | None = None, clock: SIAPanelClock | None = None) -> list["SIAFrameProcessor"]:
+        """Pliega una rafaga de eventos en el cambio neto de estado.
+           Ordena por timestamp de la trama llevado al reloj de HA con clock, descarta los anteriores a since (epoch)
+           y deja el ultimo evento de cada entidad. Las tramas sin timestamp no se descartan"""
+        clock = clock if clock is not None else SIAPanelClock()
+        times = [(clock.panel_time(frame), i, frame) for (i, frame) in enumerate(frames)]
+        times.sort(key=lambda t: (t[0] if t[0] is not None else float("-inf"), t[1]))
+        last = {}
+        for (when, _, frame) in times:
+            if(since is not None and when is not None and when < since):
+                continue
+            key = self.fold_key(frame)
+            last.pop(key, None)             # Se reinserta para respetar el orden del ultimo evento
+            last[key] = frame
+        return list(last.values())
+
+
+    def is_alarm(self, frame: "SIAFrameProcessor") -> bool:
+        """True si el evento es una alarma o su restauracion. Estos eventos nunca se descartan.
+           Las alarmas medicas, de incendio o panico no disparan una zona pero tampoco se descartan"""
+        if(frame.eventcode in contactid.ALARM_EVENTS):
+            return True
+        entry = self.handlers.get((frame.eventcode, frame.qualifier))
+        return entry is not None and entry[0] in (siacode.triggerzone, siacode.restorezone, siacode.trigger, siacode.restore)
+
+
+    def dispatch(self, subscriber: Callable, frame: "SIAFrameProcessor") -> bool:
+        """Envia el evento al suscriptor. Devuelve False si el evento no tiene handler"""
+        entry = self.handlers.get((frame.eventcode, frame.qualifier))
+        if(entry is None):
+            return False
+        (handler, extractor) = entry
+        if(isinstance(handler, siacode)):
+            subscriber(action=handler, **extractor(frame))
+        else:
+            handler(subscriber, **extractor(frame))
+        return True
+
+
+dispatcher = SIADispatcher()     # Despacho compartido. Se pueden registrar handlers adicionales en tiempo de ejecucion
+
+
+class SIAUDPServer(asyncio.DatagramProtocol):
+    """Clase para manejar mensajeria SIA. Corre sobre el event loop de HA"""
+
+    def __init__(self, port: int = DEFAULT_UDP_PORT, workers: int = 0, queue_size: int = SIA_QUEUE_SIZE, queue_policy: str = SIA_QUEUE_POLICY, tcp: bool = False,
+                 journal: str | None = None, rcvbuf: int = DEFAULT_SIA_RCVBUF * 1024, sidecar: str | None = None,
+                 address: str = '', networks: list[str] | None = None):
+        """Crea el socket UDP. El bind es sincronico para que cualquier error se informe de inmediato.
+           Con workers > 0 la recepcion, el parseo y el ACK se reparten en procesos separados (ver siashard).
+           Con tcp tambien se aceptan conexiones TCP en el mismo puerto (ver siatcp).
+           journal es el directorio donde se guardan las tramas recibidas (ver siajournal).
+           rcvbuf es el buffer de recepcion del socket en bytes.
+           Con sidecar (ruta de un socket Unix) la recepcion, el parseo y el ACK corren en un proceso aparte (ver siasidecar).
+           address es la direccion donde escucha ('' = todas) y networks las redes de origen permitidas (vacio = todas)"""
+        self.subscribers = {}
+        self.snapshots = {}
+        self.dispatcher = dispatcher
+        self.duplicates = SIADuplicateFilter()
+        self.backlog: dict[str, list[tuple[bool, SIAFrameProcessor]]] = {}    # (atrasada, trama). Solo las atrasadas se pliegan
+        self.queues: dict[str, SIAEventQueue] = {}
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.backlog_open = False
+        self.backlog_done = False                       # La ventana de inicio ya se cerro. Los reinicios no la vuelven a abrir
+        self.backlog_timer: asyncio.TimerHandle | None = None
+        self.backlog_start = 0.0                        # Apertura de la ventana de inicio (epoch). Lo anterior es atrasado
+        self.port = port
+        self.transport = None
+        self.active = False
+        self.errorcode = None
+        self.shards = None
+        self.sidecar = None
+        self.sources = SIASourceFilter(networks)
+        self.log = SIALogSampler()
+        self.tcp = SIATCPServer(self.process, port, address, allowed=self.sources.permitted) if tcp else None
+        self.journal = siajournal.SIAJournal(journal) if journal else None
+        self.last_seen: dict[str, float] = {}           # Ultima trama valida de cada cuenta (epoch). Del menos al mas reciente
+        self.clock = SIAPanelClock()
+        self.metrics = MetricsRegistry()
+        self.__keepalives = self.metrics.counter("keepalives_fast_path")
+        self.__received = self.metrics.counter("frames_received")
+        self.__valid = self.metrics.counter("frames_valid")
+        self.__invalid = self.metrics.counter("frames_invalid")
+        self.__crc_failures = self.metrics.counter("crc_failures")
+        self.__unknown_accounts = self.metrics.counter("unknown_accounts")
+        self.__unknown_events = self.metrics.counter("unknown_events")
+        self.__parse_time = self.metrics.histogram("parse_time_ms")
+        self.__ack_latency = self.metrics.histogram("ack_latency_ms")
+        self.__callback_time = self.metrics.histogram("callback_time_ms")
+        self.__kernel_drops = self.metrics.counter("kernel_drops")
+        self.__rejected = self.metrics.counter("frames_rejected")
+        self.__kernel_drops_seen = 0
+        self.overflow_detection = False
+        self.metrics.gauge("duplicates_suppressed", lambda: self.duplicates.suppressed)
+        self.metrics.gauge("queue_depth", lambda: sum(len(q.events) for q in self.queues.values()))
+        self.metrics.gauge("queue_high_water", lambda: max((q.high_water for q in self.queues.values()), default=0))
+        self.metrics.gauge("queue_replaced", lambda: sum(q.replaced for q in self.queues.values()))
+        self.metrics.gauge("queue_dropped", lambda: sum(q.dropped for q in self.queues.values()))
+        self.workers = workers
+        self.rcvbuf = rcvbuf
+        self.sidecar_path = sidecar
+        self.address = address
+        self.status_callbacks: dict[str, Callable[[bool], None]] = {}
+        self.supervisor: asyncio.Task | None = None
+        self.handovers: dict[str, asyncio.TimerHandle] = {}     # Cuentas liberadas que se estan volviendo a registrar
+        self.closed = False
+        self.degraded = False                           # La recepcion murio y todavia no se pudo reiniciar
+        self.__restarts = self.metrics.counter("receiver_restarts")
+        self.__wakeup = asyncio.Event()
+        self.__bind()
+
+
+    def __bind(self) -> None:
+        """Crea el socket UDP (o los de los workers, o el sidecar) en self.address:self.port. Es sincronico para informar errores de inmediato"""
+        _LOGGER.info("Starting SIA UDP Server @ UDP %s:%s", self.address or "*", str(self.port))
+        if(self.sidecar_path):
+            from .siasidecar import SIASidecarClient    # Import diferido, siasidecar depende de este modulo
+            try:
+                self.sidecar = SIASidecarClient(self.port, self.sidecar_path, rcvbuf=self.rcvbuf, address=self.address, sources=self.sources)
+            except OSError as err:
+                self.errorcode = str(err)
+                raise
+            self.sock = None
+            self.errorcode = "success"
+            return
+        if(self.workers > 0):
+            from .siashard import SIAShardPool          # Import diferido, siashard depende de este modulo
+            try:
+                self.shards = SIAShardPool(self.port, self.workers, address=self.address, rcvbuf=self.rcvbuf, sources=self.sources)
+            except OSError as err:
+                self.errorcode = str(err)
+                raise
+            self.sock = None
+            self.errorcode = "success"
+            return
+        self.sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)      # Create a datagram UDP socket
+        try:
+            self.overflow_detection = configure_socket(self.sock, self.rcvbuf)
+            self.sock.bind((self.address, self.port))                                   # Bind to address and ip
+        except OSError as err:
+            self.sock.close()
+            self.errorcode = str(err)
+            raise
+        self.sock.setblocking(False)
+        self.errorcode = "success"
+
+
+    async def async_start(self) -> None:
+        """Registra el socket en el event loop y lanza la supervision. Debe llamarse desde el loop de HA"""
+        try:
+            await self.__listen()
+        except OSError:
+            self.close()
+            raise
+        if(self.supervisor is None):
+            self.supervisor = asyncio.get_running_loop().create_task(self.__supervise(), name="SIA-Supervisor")
+
+
+    async def __listen(self) -> None:
+        """Pone a recibir lo creado por __bind"""
+        loop = asyncio.get_running_loop()
+        receiver = self.shards or self.sidecar          # Recepcion en otros procesos. Los registros llegan a los mismos callbacks
+        if(receiver is not None):
+            receiver.start(loop, self.__shard_frame, self.__shard_duplicate, self.__shard_invalid, self.__shard_keepalive, self.__shard_drops, self.__shard_rejected)
+            self.active = True
+        else:
+            await loop.create_datagram_endpoint(lambda: self, sock=self.sock)
+        if(self.tcp is not None):
+            try:
+                await self.tcp.async_start()
+            except OSError as err:
+                self.errorcode = str(err)
+                raise
+        # Al levantar el socket el panel envia todo lo que no pudo entregar. Durante un tiempo se junta y luego se aplica plegado.
+        # Solo en el primer bind: tras un reinicio los eventos siguen llegando en orden y van directo al suscriptor
+        if(not self.backlog_done):
+            self.backlog_open = True
+            self.backlog_start = time.time()
+            self.backlog_timer = loop.call_later(SIA_BACKLOG_WINDOW, self.__close_backlog)
         _LOGGER.debug("SIA UDP Server socket ready...")
 
 
-    def __messageserver_thread():
-        """Thread que maneja el socket UDP. Recibe los mensajes, descarta los invalidos. los parsea y responde el ACK
-           Luego envia al suscriptor que corresponda"""
-        #TODO: Cuando inicia el socket deberia descartar los mensajes recibidos porque en general el panel escupe todo lo que no pudo enviar
+    def __unbind(self) -> list[asyncio.Future]:
+        """Detiene la recepcion (socket, workers, sidecar y TCP). Suscriptores, colas, journal y metricas no se tocan.
+           Si la ventana de inicio estaba abierta se vuelve a armar completa en el proximo __listen.
+           Devuelve las esperas de los procesos de recepcion, que corren en el executor"""
+        if(self.backlog_timer is not None):
+            self.backlog_timer.cancel()
+            self.backlog_timer = None
+        stopping = []                                   # Procesos que terminan en el executor
+        if(self.tcp is not None):
+            self.tcp.close()
+        if(self.shards is not None):
+            stopping.append(self.shards.stop())
+            self.shards = None
+        if(self.sidecar is not None):
+            stopping.append(self.sidecar.stop())
+            self.sidecar = None
+        if(self.transport is not None):
+            transport = self.transport
+            self.transport = None                       # connection_lost ve que el cierre fue pedido
+            transport.close()
+        elif(self.sock is not None):
+            self.sock.close()
+        self.sock = None
+        self.active = False
+        return [future for future in stopping if future is not None]
+
+
+    def alive(self) -> bool:
+        """True si la recepcion sigue funcionando"""
+        if(self.shards is not None):
+            up = self.shards.alive()
+        elif(self.sidecar is not None):
+            up = self.sidecar.alive()
+        else:
+            up = self.transport is not None and not self.transport.is_closing()
+        if(up and self.tcp is not None):
+            up = self.tcp.server is not None and self.tcp.server.is_serving()
+        return up
+
+
+    async def async_restart(self, port: int | None = None, address: str | None = None) -> None:
+        """Reinicia la recepcion, opcionalmente en otro puerto o direccion, sin perder suscriptores, colas, journal ni metricas.
+           Si el bind falla la recepcion queda detenida, se lanza la excepcion y la supervision sigue reintentando"""
+        await asyncio.gather(*self.__unbind())          # Los procesos de recepcion deben liberar el puerto
+        await asyncio.sleep(0)                          # El transporte cierra el socket en la proxima vuelta del loop
+        if(port is not None):
+            self.port = port
+        if(address is not None):
+            self.address = address
+        if(self.tcp is not None):
+            (self.tcp.port, self.tcp.address) = (self.port, self.address)
+        try:
+            self.__bind()
+            await self.__listen()
+        except OSError:
+            self.__unbind()
+            self.__set_degraded(True)
+            raise
+        self.__restarts.inc()
+        self.__set_degraded(False)
+        _LOGGER.info("[async_restart] SIA receiver listening again @ %s:%d", self.address or "*", self.port)
+
+
+    async def async_reconfigure(self, port: int, workers: int, tcp: bool, journal: str | None, rcvbuf: int, sidecar: str | None,
+                                address: str, networks: list[str] | None) -> None:
+        """Aplica otra configuracion de recepcion (ver __init__) y la reinicia, sin perder suscriptores, colas ni metricas.
+           Las redes permitidas se aplican aunque el bind falle: sin recepcion no pasa nada que no deberia"""
+        await asyncio.gather(*self.__unbind())
+        self.sources = SIASourceFilter(networks)
+        self.workers = workers
+        self.rcvbuf = rcvbuf
+        self.sidecar_path = sidecar
+        self.tcp = SIATCPServer(self.process, port, address, allowed=self.sources.permitted) if tcp else None
+        if(journal != (self.journal.directory if self.journal is not None else None)):
+            if(self.journal is not None):
+                self.journal.close()
+            self.journal = siajournal.SIAJournal(journal) if journal else None
+        _LOGGER.info("[async_reconfigure] SIA receiver reconfigured: workers=%d, tcp=%s, journal=%s, sidecar=%s, networks=%s",
+                     workers, str(tcp), journal or "off", sidecar or "off", ",".join(str(n) for n in self.sources.networks) or "any")
+        await self.async_restart(port=port, address=address)
+
+
+    async def __supervise(self) -> None:
+        """Revisa la recepcion periodicamente (o apenas se cierra el socket) y la reinicia con espera exponencial si murio"""
+        while(True):
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), SIA_SUPERVISOR_INTERVAL)
+            except (TimeoutError, asyncio.TimeoutError):
+                pass
+            self.__wakeup.clear()
+            if(self.alive()):
+                continue
+            _LOGGER.error("[__supervise] SIA receiver @ %s:%d is down. Restarting", self.address or "*", self.port)
+            self.__set_degraded(True)
+            backoff = SIA_RESTART_BACKOFF
+            while(not self.alive()):                    # Tambien puede haberlo levantado un async_restart externo
+                try:
+                    await self.async_restart()
+                except Exception as err:
+                    self.errorcode = str(err)
+                    _LOGGER.warning("[__supervise] SIA receiver restart failed (%s). Retrying in %d seconds", str(err), backoff)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, SIA_RESTART_BACKOFF_MAX)
+
+
+    def __set_degraded(self, degraded: bool) -> None:
+        """Informa a los suscriptores que la recepcion se detuvo o se recupero"""
+        if(degraded == self.degraded):
+            return
+        self.degraded = degraded
+        for status in list(self.status_callbacks.values()):
+            try:
+                status(not degraded)
+            except Exception as err:
+                _LOGGER.exception(err)
+
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        """El socket quedo registrado en el loop"""
+        self.transport = transport
+        self.active = True
+
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        """El socket se cerro. Si no lo cerro __unbind la supervision lo reinicia"""
+        if(self.transport is None):
+            return
+        self.transport = None
+        self.active = False
+        if(exc is not None):
+            _LOGGER.error("[connection_lost] SIA socket closed with error %s", str(exc))
+            self.errorcode = str(exc)
+        _LOGGER.info("[connection_lost] SIA UDP Server stopped")
+        self.__wakeup.set()
+
+
+    def error_received(self, exc: Exception) -> None:
+        """Errores no fatales del socket (por ejemplo ICMP port unreachable al enviar el ACK)"""
+        _LOGGER.warning("[error_received] %s", str(exc))
+
+
+    def datagram_received(self, datagram: bytes, senderAddr: tuple) -> None:
+        """El loop entrega un datagrama. Se procesa y luego se vacia todo lo que ya esta en el buffer del socket en la misma pasada"""
+        self.process(datagram, senderAddr, self.transport.sendto)
+        self.__drain()
+
+
+    def __drain(self) -> None:
+        """Lee los datagramas pendientes sin volver al loop, asi una rafaga se procesa en una sola vuelta.
+           Con SO_RXQ_OVFL se lee con recvmsg para obtener el contador de descartes del kernel. Como es acumulado
+           alcanza con verlo en cualquier datagrama posterior al descarte, y los descartes solo ocurren con la cola llena"""
+        for _ in range(SIA_DRAIN_LIMIT):                 # Acotado para no acaparar el loop
+            try:
+                if(self.overflow_detection):
+                    (datagram, ancdata, _flags, senderAddr) = self.sock.recvmsg(SIA_BUFFERSIZE, _OVFL_SPACE)
+                    self.__kernel_dropped(kernel_drops(ancdata))
+                else:
+                    (datagram, senderAddr) = self.sock.recvfrom(SIA_BUFFERSIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as err:
+                self.error_received(err)
+                return
+            self.process(datagram, senderAddr, self.transport.sendto)
+
+
+    def __kernel_dropped(self, total: int | None) -> None:
+        """Actualiza el contador de descartes del kernel a partir del acumulado informado por el socket"""
+        if(total is None or total == self.__kernel_drops_seen):
+            return
+        dropped = (total - self.__kernel_drops_seen) & 0xFFFFFFFF
+        self.__kernel_drops_seen = total
+        self.__kernel_drops.inc(dropped)
+        _LOGGER.warning("[__kernel_dropped] Kernel dropped %d SIA datagrams (%d total). Increase the receive buffer", dropped, self.__kernel_drops.value)
+
+
+    def process(self, datagram: bytes, senderAddr: tuple, reply: Callable[[bytes, tuple], None]) -> None:
+        """Descarta los mensajes invalidos, parsea y responde el ACK por reply. Luego envia al suscriptor que corresponda.
+           Es comun a UDP y TCP, solo cambia la forma de responder"""
         try:
-            _LOGGER.info("[__messageserver_thread] Starting SIA parser @ UDP port #%s",str(SIAUDPServer.port))
-            UDPServerSocket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)      # Create a datagram UDP socket
-            UDPServerSocket.bind(('' , SIAUDPServer.port))                                               # Bind to address and ip
-            SIAUDPServer.errorcode = "success"
-            while(SIAUDPServer.active):
-                (datagram,senderAddr) = UDPServerSocket.recvfrom(SIA_BUFFERSIZE)                # Listen for incoming datagrams
-                data = SIAFrameProcessor(bytearray(datagram))
-                _LOGGER.debug("[__messageserver_thread] Received %s", str(data))
-                if(data.valid):                                                                 # Valid packet
-                    UDPServerSocket.sendto(str.encode(data.replyMessage()), senderAddr)         # Responde ACK
-                    if(data.account in SIAUDPServer.subscribers):
-                        if(data.eventcode == 0 and data.token == "NULL"):        # No es CID es un keep alive
-                            SIAUDPServer.subscribers[data.account](action=siacode.keepalive)
-                        elif(data.eventcode == 627 or       # Ingresando al modo de programacion remota
-                             data.eventcode == 628 or       # Saliendo del modo de programacion remota
-                             data.eventcode == 602):        # Test Periodico no se hace nada. Solo se envia a modo de keep alive pero ni haria falta enviarlo 
-                             SIAUDPServer.subscribers[data.account](action=siacode.dontdoanything)
-                        elif(data.eventcode == 570 and data.qualifier == 1):
-                            SIAUDPServer.subscribers[data.account](action = siacode.bypass, zone = data.zone, partition = data.partition)
-                        elif(data.eventcode == 570 and data.qualifier == 3):
-                            SIAUDPServer.subscribers[data.account](action = siacode.unbypass, zone = data.zone, partition = data.partition)
-                        elif(data.eventcode == 574 and data.qualifier == 1):
-                            SIAUDPServer.subscribers[data.account](action = siacode.group_bypass, partition = data.partition)
-                        elif(data.eventcode == 574 and data.qualifier == 3):
-                            SIAUDPServer.subscribers[data.account](action = siacode.group_unbypass, partition = data.partition)
-                        elif(data.eventcode == 441 and data.qualifier == 1):
-                            SIAUDPServer.subscribers[data.account](action = siacode.present_disarm, user = data.zone, partition = data.partition)
-                        elif(data.eventcode == 441 and data.qualifier == 3):
-                            SIAUDPServer.subscribers[data.account](action = siacode.present_arm, user = data.zone, partition = data.partition)
-                        elif(data.eventcode == 407 and data.qualifier == 1):
-                            SIAUDPServer.subscribers[data.account](action = siacode.disarm, user = data.zone, partition = data.partition)
-                        elif(data.eventcode == 407 and data.qualifier == 3):
-                            SIAUDPServer.subscribers[data.account](action = siacode.arm, user = data.zone, partition = data.partition)
-                        elif(data.eventcode == 406 and data.qualifier == 1):
-                            SIAUDPServer.subscribers[data.account](action = siacode.alarm_disarm, user = data.zone, partition = data.partition)
-                        elif(data.eventcode == 401 and data.qualifier == 1):
-                            SIAUDPServer.subscribers[data.account](action = siacode.keyboard_disarm, user = data.zone, partition = data.partition)
-                        elif(data.eventcode == 401 and data.qualifier == 3):
-                            SIAUDPServer.subscribers[data.account](action = siacode.keyboard_arm, user = data.zone, partition = data.partition)
-                        elif(data.eventcode == 130 and data.qualifier == 1):
-                            SIAUDPServer.subscribers[data.account](action = siacode.triggerzone, zone = data.zone, partition = data.partition)
-                        elif(data.eventcode == 130 and data.qualifier == 3):
-                            SIAUDPServer.subscribers[data.account](action = siacode.restorezone, zone = data.zone, partition = data.partition)
-                        elif(data.eventcode == 459 and data.qualifier == 1):
-                            SIAUDPServer.subscribers[data.account](action = siacode.trigger, zone = data.zone, partition = data.partition)
-                        elif(data.eventcode == 459 and data.qualifier == 3):
-                            SIAUDPServer.subscribers[data.account](action = siacode.restore, zone = data.zone, partition = data.partition)
-                        else:
-                            # Se trata de un codigo que no se interpreta aun. Analizar si se debe interpretar o descartar
-                            _LOGGER.warning("[__messageserver_thread] Panel has sent a message with eventcode: %d, qualifier: %d, partition: %d, zone: %d with  optionalExtendedData: %s and timestamp %s", data.eventcode, data.qualifier, data.partition, data.zone, data.mdata, data.timestamp)
-                            _LOGGER.warning("[__messageserver_thread] Please submit an issue on https://github.com/claudio-pires/garnet_home_assistant/issues/new/choose indicating this code ") # Se trata de un codigo que no se procesa
-                    else:
-                        _LOGGER.warning("[__messageserver_thread] Account %s is not a valid suscriber. This message comes from %s", data.account, str(senderAddr))   
+            reason = self.sources.reject_reason(senderAddr)                                 # Antes de parsear, acota el costo de un flood
+            if(reason is not None):
+                self.__reject(reason, senderAddr)
+                return
+            self.__received.inc()
+            start = time.perf_counter()
+            keepalive = keepalive_ack(datagram)
+            if(keepalive is not None):                                                      # Keep alive: solo ACK y ultima actividad
+                reply(keepalive[1], senderAddr)
+                self.__ack_latency.observe((time.perf_counter() - start) * 1000)
+                self.__keepalive(keepalive[0], keepalive[2])
+                if(self.journal is not None):
+                    self.journal.append(datagram, senderAddr, None)
+                return
+            data = SIAFrameProcessor(datagram)
+            self.__parse_time.observe((time.perf_counter() - start) * 1000)
+            _LOGGER.debug("[process] Received %s", data)
+            if(self.journal is not None):
+                self.journal.append(datagram, senderAddr, data.error)
+            if(data.valid):                                                                 # Valid packet
+                reply(data.replyMessage(), senderAddr)                                      # Responde ACK
+                self.__ack_latency.observe((time.perf_counter() - start) * 1000)
+                self.__valid.inc()
+                self.__seen(data.account)
+                if(self.duplicates.is_duplicate(data)):                                     # Retransmision por ACK perdido
+                    _LOGGER.debug("[process] Duplicated frame from %s suppressed", str(senderAddr))
                 else:
-                    _LOGGER.error("[__messageserver_thread] Invalid packet")
-            SIAUDPServer.sia_thread = None
-            SIAUDPServer.active = False
-            _LOGGER.info("[__messageserver_thread] Finalizing thread")
+                    self.__ingest(data, senderAddr)
+            else:
+                self.__count_invalid(data.error)
+                self.log.report(logging.ERROR, "invalid packet", senderAddr[0], "[process] Invalid packet from %s (%s)", str(senderAddr), data.error)
         except Exception as err:
             _LOGGER.exception(err)
-            SIAUDPServer.errorcode = str(err)
 
 
-    def add(self, callback, client: str):
-        """Agrega un callback al message server"""
-        if(client not in SIAUDPServer.subscribers):
+    def __seen(self, account: str) -> float:
+        """Registra la ultima trama valida de la cuenta. Cualquier cuenta llega hasta aca, asi que se acota como LRU"""
+        now = time.time()
+        if(self.last_seen.pop(account, None) is None and len(self.last_seen) >= SIA_SEEN_ACCOUNTS):
+            self.__forget(next(iter(self.last_seen)))       # La cuenta que hace mas tiempo no envia
+        self.last_seen[account] = now
+        return now
+
+
+    def __forget(self, account: str) -> None:
+        """Descarta lo que el receptor recuerda de una cuenta"""
+        self.last_seen.pop(account, None)
+        self.clock.offsets.pop(account, None)
+        self.duplicates.suppressed_by_account.pop(account, None)
+
+
+    def __shard_frame(self, payload: bytes, senderAddr: tuple) -> None:
+        """Trama enviada por un worker o el sidecar. Ya fue confirmada y filtrada"""
+        try:
+            self.__received.inc()
+            self.__valid.inc()
+            if(self.journal is not None):
+                self.journal.append(payload, senderAddr, None)
+            data = SIAFrameProcessor(payload, verify_crc=False)     # El worker ya valido el CRC
+            self.__seen(data.account)
+            self.__ingest(data, senderAddr)
+        except Exception as err:
+            _LOGGER.exception(err)
+
+
+    def __keepalive(self, account: str, timestamp: bytes) -> None:
+        """Keep alive resuelto por el camino rapido. No llega al suscriptor pero su timestamp alimenta el reloj del panel"""
+        self.__valid.inc()
+        self.__keepalives.inc()
+        now = self.__seen(account)
+        if(len(timestamp) > 0):
+            self.clock.observe(account, parse_timestamp(timestamp.decode(errors="replace")), now)
+
+
+    def __shard_keepalive(self, account: str, timestamp: bytes) -> None:
+        """Un worker o el sidecar confirmo un keep alive"""
+        self.__received.inc()
+        self.__keepalive(account, timestamp)
+
+
+    def __shard_drops(self, dropped: int) -> None:
+        """Un worker o el sidecar informo datagramas descartados por el kernel en su socket"""
+        self.__kernel_drops.inc(dropped)
+        _LOGGER.warning("[__shard_drops] Kernel dropped %d SIA datagrams on a receiver process socket (%d total). Increase the receive buffer", dropped, self.__kernel_drops.value)
+
+
+    def __reject(self, reason: str, senderAddr: tuple, count: int = 1) -> None:
+        self.__rejected.inc(count)
+        self.log.report(logging.WARNING, reason, senderAddr[0], "[__reject] SIA datagram from %s rejected (%s)", str(senderAddr), reason)
+
+
+    def __shard_rejected(self, count: int, senderAddr: tuple) -> None:
+        """Un worker o el sidecar rechazo tramas por origen. Llega agrupado, con el ultimo origen rechazado"""
+        self.__reject("rejected by source filter", senderAddr, count)
+
+
+    def __shard_duplicate(self, account: str) -> None:
+        """Un worker o el sidecar suprimio una retransmision"""
+        self.__received.inc()
+        self.__valid.inc()
+        self.duplicates.suppressed += 1
+        self.duplicates.suppressed_by_account[account] = self.duplicates.suppressed_by_account.get(account, 0) + 1
+
+
+    def __shard_invalid(self, reason: str, senderAddr: tuple) -> None:
+        """Un worker o el sidecar descarto una trama invalida"""
+        self.__received.inc()
+        self.__count_invalid(reason)
+        self.log.report(logging.ERROR, "invalid packet", senderAddr[0], "[__shard_invalid] Invalid packet from %s (%s)", str(senderAddr), reason)
+        if(self.journal is not None):
+            self.journal.append(b"", senderAddr, reason)        # El worker no envia la trama invalida, solo el motivo
+
+
+    def __count_invalid(self, error: str) -> None:
+        self.__invalid.inc()
+        if(error == "crc mismatch"):
+            self.__crc_failures.inc()
+
+
+    def __ingest(self, data: "SIAFrameProcessor", senderAddr: tuple) -> None:
+        """Trama valida y ya confirmada. Va al backlog de inicio o al suscriptor.
+           Durante la ventana de inicio solo se juntan los eventos atrasados que el panel envia al iniciar. Los actuales
+           y las alarmas van directo al suscriptor, o al backlog sin plegar si la cuenta aun no se registro"""
+        data.received = time.time()
+        late = self.backlog_open and self.__late(data)
+        if(late and not self.dispatcher.is_alarm(data)):
+            self.__queue_backlog(data, True)
+            return
+        if(not late):
+            self.clock.observe(data.account, data.timestamp, data.received)   # Lo atrasado del backlog no sirve para estimar el desfase
+        if(data.account in self.subscribers or data.account in self.handovers):
+            self.__enqueue(data)
+        elif(self.backlog_open):
+            self.__queue_backlog(data, False)
+        else:
+            self.__unknown_accounts.inc()
+            self.log.report(logging.WARNING, f"unknown account {data.account}", senderAddr[0], "[__ingest] Account %s is not a valid suscriber. This message comes from %s", data.account, str(senderAddr))
+
+
+    def __enqueue(self, data: "SIAFrameProcessor") -> None:
+        """Encola el evento en la cola de la cuenta. La tarea de la cola lo despacha"""
+        queue = self.queues.get(data.account)
+        if(queue is None):
+            queue = self.queues[data.account] = SIAEventQueue(data.account, self.queue_size, self.queue_policy)
+        if(queue.task is None or queue.task.done()):
+            queue.task = asyncio.get_running_loop().create_task(self.__queue_worker(queue), name=f"SIA-Queue-{data.account}")
+        queue.put(data, self.dispatcher.fold_key(data), self.dispatcher.is_alarm(data))
+
+
+    async def __queue_worker(self, queue: SIAEventQueue) -> None:
+        """Vacia la cola de una cuenta. Cede el loop cada SIA_QUEUE_BATCH eventos para que el socket se siga leyendo"""
+        while(True):
+            await queue.wakeup.wait()
+            queue.wakeup.clear()
+            n = 0
+            while(len(queue.events) > 0):
+                if(queue.account not in self.subscribers and queue.account in self.handovers):
+                    break                                       # Los eventos esperan al nuevo suscriptor (ver release)
+                (_key, _alarm, data) = queue.events.popleft()
+                if(data.account not in self.subscribers):
+                    _LOGGER.warning("[__queue_worker] Account %s is no longer suscribed. Event %s discarded", data.account, data)
+                    continue
+                start = time.perf_counter()
+                try:
+                    self.__dispatch(data)
+                except Exception as err:
+                    _LOGGER.exception(err)
+                self.__callback_time.observe((time.perf_counter() - start) * 1000)
+                n = n + 1
+                if(n % SIA_QUEUE_BATCH == 0):
+                    await asyncio.sleep(0)
+
+
+    def __dispatch(self, data: "SIAFrameProcessor") -> None:
+        """Traduce el evento Contact ID y lo envia al suscriptor con el momento del evento (epoch) en timestamp.
+           Con el el suscriptor descarta lo que sea anterior al estado que ya tiene"""
+        subscriber = partial(self.subscribers[data.account], timestamp=self.clock.event_time(data))
+        if(data.token == "NULL"):                               # No es CID es un keep alive
+            subscriber(action=siacode.keepalive)
+        elif(not self.dispatcher.dispatch(subscriber, data)):
+            # Se trata de un codigo que no se interpreta aun. Analizar si se debe interpretar o descartar
+            self.__unknown_events.inc()
+            _LOGGER.warning("[__dispatch] Panel has sent a message with eventcode: %d, qualifier: %d, partition: %d, zone: %d with  optionalExtendedData: %s and timestamp %s", data.eventcode, data.qualifier, data.partition, data.zone, data.mdata, data.timestamp)
+            _LOGGER.warning("[__dispatch] Please submit an issue on https://github.com/claudio-pires/garnet_home_assistant/issues/new/choose indicating this code ") # Se trata de un codigo que no se procesa
+
+
+    def __late(self, data: "SIAFrameProcessor") -> bool:
+        """True si la trama es anterior a la apertura de la ventana de inicio. Sin desfase estimado se asume que el panel
+           esta en hora. Una trama sin timestamp se toma como atrasada. El timestamp tiene resolucion de un segundo"""
+        when = self.clock.panel_time(data)
+        return when is None or when + 1 < self.backlog_start
+
+
+    def __queue_backlog(self, data: "SIAFrameProcessor", late: bool) -> None:
+        """Guarda un evento hasta que termine la ventana de inicio y la cuenta tenga suscriptor. late = se puede plegar"""
+        frames = self.backlog.setdefault(data.account, [])
+        if(len(frames) < SIA_BACKLOG_SIZE):
+            frames.append((late, data))
+        else:
+            _LOGGER.warning("[__queue_backlog] Backlog for account %s is full, event %s discarded", data.account, data)
+
+
+    def __close_backlog(self) -> None:
+        """Fin de la ventana de inicio. Aplica el backlog de las cuentas registradas"""
+        self.backlog_timer = None
+        self.backlog_open = False
+        self.backlog_done = True
+        for account in list(self.backlog):
+            if(account in self.subscribers):
+                self.__flush_backlog(account)
+        if(len(self.backlog) > 0):
+            asyncio.get_running_loop().call_later(SIA_BACKLOG_MAX_AGE, self.__expire_backlog)
+
+
+    def __expire_backlog(self) -> None:
+        """Descarta el backlog de cuentas que nunca se registraron"""
+        for account in list(self.backlog):
+            self.__unknown_accounts.inc()
+            _LOGGER.warning("[__expire_backlog] Account %s is not a valid suscriber. %d queued events discarded", account, len(self.backlog[account]))
+        self.backlog.clear()
+
+
+    def __flush_backlog(self, account: str) -> None:
+        """Pliega los eventos atrasados de una cuenta en el cambio neto de estado y los envia al suscriptor.
+           Despues van, en orden de llegada y sin plegar, los actuales y las alarmas que llegaron antes del registro"""
+        frames = self.backlog.pop(account, [])
+        snapshot = self.snapshots.get(account)
+        folded = self.dispatcher.fold([data for (late, data) in frames if late], snapshot() if snapshot is not None else None, self.clock)
+        held = [data for (late, data) in frames if not late]
+        _LOGGER.info("[__flush_backlog] Account %s sent %d queued events, %d applied after folding", account, len(frames), len(folded) + len(held))
+        for data in folded + held:
+            self.__enqueue(data)
+
+
+    async def async_replay(self, directory: str | None = None, speed: float = 1.0, account: str | None = None, since: float | None = None,
+                           retime: bool = False) -> int:
+        """Reproduce el journal a traves del parser y la cola del suscriptor, sin ACK ni filtro de duplicados.
+           speed multiplica la velocidad original (0 = sin demoras). Con account solo se reproducen las tramas de esa cuenta.
+           Con los tiempos originales el modelo descarta los eventos anteriores a su estado. retime los aplica como actuales"""
+        if(directory is None):
+            if(self.journal is None):
+                _LOGGER.warning("[async_replay] SIA journal is disabled and no directory was given. Nothing to replay")
+                return 0
+            directory = self.journal.directory
+        entries = await asyncio.get_running_loop().run_in_executor(None, siajournal.read_journal, directory, since)
+        entries = [entry for entry in entries if entry.error is None]
+        _LOGGER.info("[async_replay] Replaying %d SIA frames from %s at speed %s", len(entries), directory, str(speed))
+        return await siajournal.replay(entries, lambda entry: self.__replay_frame(SIAFrameProcessor(entry.frame), account, None if retime else entry.time), speed)
+
+
+    def __replay_frame(self, data: "SIAFrameProcessor", account: str | None, received: float | None) -> None:
+        """Trama del journal. Con la llegada original el momento del evento es el de entonces, sin llegada es el de la reproduccion"""
+        data.received = received
+        if(account is not None and data.account != account):
+            return
+        if(data.account in self.subscribers):
+            self.__enqueue(data)
+        else:
+            _LOGGER.debug("[__replay_frame] Account %s is not a valid suscriber. Replayed event %s discarded", data.account, data)
+
+
+    def close(self) -> None:
+        """Cierra el socket"""
+        self.closed = True
+        for handle in self.handovers.values():
+            handle.cancel()
+        self.handovers.clear()
+        if(self.supervisor is not None):
+            self.supervisor.cancel()
+            self.supervisor = None
+        for queue in self.queues.values():
+            if(queue.task is not None):
+                queue.task.cancel()
+        self.queues.clear()
+        self.log.flush()
+        if(self.journal is not None):
+            self.journal.close()
+        self.__unbind()
+        _LOGGER.info("[close] SIA UDP Server stopped")
+
+
+    def add(self, callback, client: str, snapshot: Callable[[], float | None] | None = None, status: Callable[[bool], None] | None = None):
+        """Agrega un callback al message server.
+           snapshot devuelve el momento (epoch) del ultimo estado obtenido por HTTP. Los eventos atrasados anteriores se descartan.
+           status(activo) se llama cuando la recepcion se detiene o se recupera"""
+        handover = self.handovers.pop(client, None)
+        if(handover is not None):
+            handover.cancel()
+            queue = self.queues.get(client)
+            _LOGGER.info("[add] Suscriber account %s registered again, %d held events delivered", str(client), len(queue) if queue is not None else 0)
+            if(queue is not None):
+                queue.wakeup.set()                          # La tarea de la cola retoma en orden con el nuevo callback
+        elif(client not in self.subscribers):
             _LOGGER.info("[add] New suscriber account %s", str(client))
         else:
             _LOGGER.warning("[add] Suscriber %s already registered", str(client))
-            SIAUDPServer.subscribers.pop(client)
-        SIAUDPServer.subscribers[client] = callback     # Siempre se registra el ultimo
+            self.subscribers.pop(client)
+        self.subscribers[client] = callback     # Siempre se registra el ultimo
+        self.snapshots[client] = snapshot
+        if(status is not None):
+            self.status_callbacks[client] = status
+        else:
+            self.status_callbacks.pop(client, None)
+        if(not self.backlog_open and client in self.backlog):
+            self.__flush_backlog(client)
 
 
     def remove(self, client: str):
-        """Quita un callback del message server"""
-        if(client in SIAUDPServer.subscribers):
+        """Quita un callback del message server. Tambien descarta los eventos retenidos de una cuenta liberada"""
+        handover = self.handovers.pop(client, None)
+        if(handover is not None):
+            handover.cancel()
+        if(client in self.subscribers or handover is not None):
             _LOGGER.info("[remove] Suscriber account %s removed", str(client))
-            SIAUDPServer.subscribers.pop(client)
+            self.subscribers.pop(client, None)
+            self.snapshots.pop(client, None)
+            self.status_callbacks.pop(client, None)
+            queue = self.queues.pop(client, None)
+            if(queue is not None and queue.task is not None):
+                queue.task.cancel()
         else:
             _LOGGER.warning("[remove] Suscriber %s is not registered", str(client))
-        if(len(SIAUDPServer.subscribers) == 0):
+        self.__forget(client)
+        if(len(self.subscribers) == 0 and len(self.handovers) == 0):
             _LOGGER.info("[remove] UDP socket killed because there are no more suscribers")
-            SIAUDPServer.active = False
+            self.close()
+
+
+    def release(self, client: str, timeout: float = SIA_HANDOVER_TIMEOUT) -> None:
+        """Quita el callback de una cuenta que se va a volver a registrar (recarga de la integracion). El socket sigue abierto.
+           Los eventos de la cuenta se retienen en su cola y se entregan en orden al proximo add. Si no vuelve en timeout se descartan"""
+        if(client not in self.subscribers):
+            _LOGGER.warning("[release] Suscriber %s is not registered", str(client))
+            return
+        self.subscribers.pop(client)
+        self.snapshots.pop(client, None)
+        self.status_callbacks.pop(client, None)
+        self.handovers[client] = asyncio.get_running_loop().call_later(timeout, self.__handover_expired, client)
+        _LOGGER.info("[release] Suscriber account %s released, its events are held for %d seconds", str(client), timeout)
+
+
+    def __handover_expired(self, client: str) -> None:
+        """La cuenta liberada no se volvio a registrar"""
+        self.handovers.pop(client, None)
+        self.__forget(client)
+        queue = self.queues.pop(client, None)
+        if(queue is not None):
+            if(queue.task is not None):
+                queue.task.cancel()
+            if(len(queue) > 0):
+                _LOGGER.warning("[__handover_expired] Account %s did not register again. %d held events discarded", str(client), len(queue))
+        if(len(self.subscribers) == 0 and len(self.handovers) == 0):
+            _LOGGER.info("[__handover_expired] UDP socket killed because there are no more suscribers")
+            self.close()
 
 
 class SIAFrameProcessor:
-    """Procesador de trama SIA."""
+    """Procesador de trama SIA.
 
-    def __init__(self, data: bytearray) -> None:
-        """Initialise."""
+    Recorre la trama una sola vez sobre un memoryview y solo registra los offsets de cada campo.
+    Token, cuenta, datos CID y timestamp se decodifican recien cuando se leen por primera vez.
+    Una trama mal formada queda con valid = False y el motivo en error, nunca lanza excepcion.
+    """
+
+    def __init__(self, data: bytes | bytearray, verify_crc: bool = True) -> None:
+        """Initialise. verify_crc = False para tramas cuyo CRC ya valido otro proceso (workers, sidecar)"""
         self.valid: bool = False
-        self.token: str = ""
-        self.sequence: str = ""
-        self.receiver: str = ""
-        self.prefix: str = ""
-        self.account: str = ""
-        self.mdata: str = ""
-        self.timestamp: datetime = None
-        self.qualifier: int = 0
-        self.eventcode: int = 0
-        self.partition: int = 0
-        self.zone: int = 0
-
-        
-        if(data[:1].decode("utf-8") == "\n"):   # Si el paquete no comienza con /n se descarta    
-
-            
-            self.ExpectedCRC = int.from_bytes(data[1:3], byteorder='big', signed=False)     # Se separa el CRC del paquete
-
-            self.l = int(data[4:7].decode("utf-8"),16)      # Se obtiene el largo del bloque de datos
-            self.DataBlock = data[7:self.l + 7]             # Se obtiene el bloque de datos
-
-
-            if(self.crc16(self.DataBlock) == self.ExpectedCRC):     # Calcula CRC del bloque de datos y lo compara con el recibido  
-
-                self.valid = True                                   # Si llega aca el paquete ya es valido
-
-                self.message_str = self.DataBlock.decode()
-                
-#                _LOGGER.debug("Message is " + self.message_str)
-                
-                self.n = self.message_str.find('"',1) + 1
-                self.token = self.message_str[:self.n].replace('"','')
-
-                self.message_str = self.message_str[self.n:]
-                self.n = self.message_str.find('R')
-                self.sequence = self.message_str[:self.n]
-
-                self.message_str = self.message_str[self.n:]
-               
-                self.n = self.message_str.find('L')
-                self.receiver = self.message_str[:self.n]
-
-                self.message_str = self.message_str[self.n:]
-               
-                self.n = self.message_str.find('#')
-                self.prefix = self.message_str[:self.n]
-
-                self.message_str = self.message_str[self.n:]
-               
-                self.n = self.message_str.find('[')
-                self.account = self.message_str[1:self.n] # Se agrega 1 para quitar el numeral al comienzo
-
-                self.message_str = self.message_str[self.n:]
-               
-                self.n = self.message_str.find('_') 
-                self.mdata = self.message_str[:self.n]
-
-                self.timestamp = datetime.datetime.strptime(self.message_str[self.n + 1:], "%H:%M:%S,%m-%d-%Y")
-
-                if(self.token == "ADM-CID"):
-                    if(self.mdata.find('][') > 1):        
-                        (_messagedata,self.optionalExtendedData) = self.mdata.split('][')
-                    else:
-                        _messagedata = self.mdata
-                        self.optionalExtendedData = None
-                    if(not(self.optionalExtendedData is None)):
-                        self.optionalExtendedData = self.optionalExtendedData.replace(']','').replace('[','')
-                    _messagedata = _messagedata.replace(']','').replace('[','')
-                    if(_messagedata.find('|') > 1): 
-                        (_acc, _d) = _messagedata.split('|')
-                    else:
-                        _acc = None
-                        _d = _messagedata
-                    (_a,_b,_c) = _d.split(' ')
-
-                    self.qualifier = int(_a[0], 10)
-                    self.eventcode = int(_a[1:], 10)
-                    self.partition = int(_b,10)
-                    self.zone = int(_c,10)
-
-
-    def crc16(self, data: bytearray):
-        """Calcula CRC de un bytearray"""
-        if data is None: return 0
-        crcx = 0x0000
-        for i in (range(0, len(data))):
-            crcx ^= data[i]
-            for j in range(0, 8):
-                crcx = ((crcx >> 1) ^ 0xA001) if ((crcx & 0x0001) > 0) else (crcx >> 1)
-        return crcx
-
-
-    def replyMessage(self):
-        """Genera mensaje de respuesta"""
-        replymessage = f"\"ACK\"{self.sequence}{self.receiver}{self.prefix}{self.account}[]"
-        replyCRC = self.crc16(bytearray(replymessage.encode()))
-        return f"\n{format(replyCRC, '#04x')}0{str(len(replymessage))}{replymessage}\r"
-    
+        self.error: str | None = None
+        self.raw = data
+        self.received: float | None = None          # Llegada (epoch). La asigna el receptor
+        self._view = memoryview(data)
+        self._cid_offsets: tuple | None = None
+
+        if(len(data) < 8 or data[0] != 0x0A):       # Si el paquete no comienza con /n se descarta
+            self.error = "bad header"
+            return
+
+        self.ExpectedCRC = int.from_bytes(data[1:3], byteorder='big', signed=False)     # Se separa el CRC del paquete
+        try:
+            self.l = int(data[4:7], 16)                                                  # Se obtiene el largo del bloque de datos
+        except ValueError:
+            self.error = "bad length"
+            return
+        end = self.l + 7
+        if(end > len(data)):
+            self.error = "truncated frame"
+            return
+
+        if(verify_crc and crc16(self._view[7:end]) != self.ExpectedCRC):     # Calcula CRC del bloque de datos y lo compara con el recibido
+            self.error = "crc mismatch"
+            return
+
+        # Unica pasada: cada busqueda arranca donde termino la anterior
+        # "TOKEN"<seq>R<receiver>L<prefix>#<account>[<data>]_<timestamp>
+        if(data[7] != 0x22):
+            self.error = "missing token"
+            return
+        q = data.find(b'"', 8, end)
+        r = data.find(b'R', q + 1, end) if q > 0 else -1
+        p = data.find(b'L', r, end) if r > 0 else -1
+        h = data.find(b'#', p, end) if p > 0 else -1
+        b = data.find(b'[', h, end) if h > 0 else -1
+        if(b < 0):
+            self.error = "missing header field"
+            return
+        u = data.find(b'_', b, end)
+        if(u < 0): u = end                  # El timestamp es opcional
+        self._token = (8, q)
+        self._sequence = (q + 1, r)
+        self._receiver = (r, p)             # Receiver y prefix incluyen la letra que los identifica (se usan asi en el ACK)
+        self._prefix = (p, h)
+        self._account = (h + 1, b)
+        self._mdata = (b, u)
+        self._timestamp = (u + 1, end)
+
+        if(data[8:q] == b"ADM-CID"):
+            self._cid_offsets = self.__walk_cid(data, b, u)
+            if(self._cid_offsets is None):
+                self.error = "malformed CID payload"
+                return
+
+        self.valid = True                   # Si llega aca el paquete ya es valido
+
+
+    @staticmethod
+    def __walk_cid(data: bytes | bytearray, start: int, end: int) -> tuple | None:
+        """Ubica los campos del bloque [<#acct|>QEEE PP ZZZ][<extendido>]. Devuelve None si no respeta el formato"""
+        close = data.find(b']', start, end)
+        if(close < 0):
+            return None
+        c = data.find(b'|', start, close)
+        c = start + 1 if c < 0 else c + 1
+        s1 = data.find(b' ', c, close)
+        s2 = data.find(b' ', s1 + 1, close) if s1 > 0 else -1
+        if(s1 != c + 4 or s2 < 0 or s2 == s1 + 1 or s2 + 1 >= close):
+            return None
+        if(not (data[c:s1] + data[s1 + 1:s2] + data[s2 + 1:close]).isdigit()):
+            return None
+        return (c, s1, s2, close)
+
+
+    def __field(self, offsets: tuple) -> str:
+        return self._view[offsets[0]:offsets[1]].tobytes().decode(errors="replace")
+
+
+    @cached_property
+    def token(self) -> str:
+        return self.__field(self._token) if self.valid else ""
+
+    @cached_property
+    def sequence(self) -> str:
+        return self.__field(self._sequence) if self.valid else ""
+
+    @cached_property
+    def receiver(self) -> str:
+        return self.__field(self._receiver) if self.valid else ""
+
+    @cached_property
+    def prefix(self) -> str:
+        return self.__field(self._prefix) if self.valid else ""
+
+    @cached_property
+    def account(self) -> str:
+        return self.__field(self._account) if self.valid else ""
+
+    @cached_property
+    def mdata(self) -> str:
+        return self.__field(self._mdata) if self.valid else ""
+
+
+    @cached_property
+    def optionalExtendedData(self) -> str | None:
+        if(self._cid_offsets is None):
+            return None
+        (_s, _e) = (self._cid_offsets[3] + 1, self._mdata[1])
+        if(_e - _s < 2):
+            return None
+        return self._view[_s:_e].tobytes().decode(errors="replace").replace(']','').replace('[','')
+
+
+    @cached_property
+    def timestamp(self) -> datetime.datetime | None:
+        if(not self.valid or self._timestamp[0] >= self._timestamp[1]):
+            return None
+        timestamp = parse_timestamp(self.__field(self._timestamp))
+        if(timestamp is None):
+            _LOGGER.debug("[timestamp] Invalid timestamp in frame %s", self.raw)
+        return timestamp
+
+
+    @cached_property
+    def _cid(self) -> tuple:
+        """(qualifier, eventcode, partition, zone). Los digitos ya fueron validados en el constructor"""
+        if(self._cid_offsets is None):
+            return (0, 0, 0, 0)
+        (c, s1, s2, close) = self._cid_offsets
+        v = self._view
+        return (v[c] - 0x30, int(v[c + 1:s1].tobytes()), int(v[s1 + 1:s2].tobytes()), int(v[s2 + 1:close].tobytes()))
+
+    @property
+    def qualifier(self) -> int:
+        return self._cid[0]
+
+    @property
+    def eventcode(self) -> int:
+        return self._cid[1]
+
+    @property
+    def partition(self) -> int:
+        return self._cid[2]
+
+    @property
+    def zone(self) -> int:
+        return self._cid[3]
+
+
+    def replyMessage(self) -> bytes:
+        """Genera mensaje de respuesta. El ACK sale de un template cacheado por cuenta/receptor/prefijo"""
+        template = _ack_template(self._view[self._receiver[0]:self._prefix[1]].tobytes(), self._view[self._account[0]:self._account[1]].tobytes())
+        return template.build(self._view[self._sequence[0]:self._sequence[1]].tobytes())
+
 
     def __str__(self):
         return f"<SIAFrameProcessor: Token: {self.token}, Sequence: {self.sequence}, Receiver: {self.receiver}, Prefix: {self.prefix}, Account: {self.account}, info: {self.mdata}, qualifier: {self.qualifier}, eventcode: {self.eventcode}, partition: {self.partition}, zone: {self.zone }, Timestamp: {self.timestamp}>"
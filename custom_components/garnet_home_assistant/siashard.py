@@ -0,0 +1,212 @@
+"""Receptor SIA repartido en varios procesos con SO_REUSEPORT para flotas grandes de paneles"""
+
+import asyncio
+import logging
+import multiprocessing
+import socket
+import struct
+import time
+
+from collections.abc import Callable
+
+from .const import SIA_BUFFERSIZE
+from .siaserver import _OVFL_SPACE, SIADuplicateFilter, SIAFrameProcessor, SIASourceFilter, configure_socket, kernel_drops, keepalive_ack
+
+
+_LOGGER = logging.getLogger(__name__)
+
+# Registro enviado por el worker al proceso de HA: tipo, IP y puerto de origen y luego la trama cruda
+_RECORD = struct.Struct("!c4sH")
+RECORD_FRAME = b"F"         # Trama valida, ya confirmada y no duplicada
+RECORD_INVALID = b"I"       # Trama invalida. El payload es el motivo
+RECORD_DUPLICATE = b"D"     # Retransmision suprimida. Solo para contadores
+RECORD_KEEPALIVE = b"K"     # Keep alive confirmado por el camino rapido. El payload es <cuenta>_<timestamp>
+RECORD_DROPS = b"O"         # Datagramas descartados por el kernel desde el ultimo aviso. El payload es la cantidad
+RECORD_REJECTED = b"R"      # Tramas rechazadas por origen desde el ultimo aviso (uno por segundo como maximo). El payload es la cantidad
+
+
+def _pack(kind: bytes, senderAddr: tuple, payload: bytes) -> bytes:
+    return _RECORD.pack(kind, socket.inet_aton(senderAddr[0]), senderAddr[1]) + payload
+
+
+def unpack(record: bytes) -> tuple[bytes, tuple, bytes]:
+    """Devuelve (tipo, direccion de origen, payload)"""
+    (kind, ip, port) = _RECORD.unpack_from(record)
+    return (kind, (socket.inet_ntoa(ip), port), record[_RECORD.size:])
+
+
+def _split_keepalive(payload: bytes) -> tuple[str, bytes]:
+    """Payload de un keep alive: <cuenta>_<timestamp>. El timestamp puede venir vacio"""
+    (account, _, timestamp) = payload.partition(b"_")
+    return (account.decode(), timestamp)
+
+
+def record_handlers(on_frame: Callable[[bytes, tuple], None], on_duplicate: Callable[[str], None], on_invalid: Callable[[str, tuple], None],
+                    on_keepalive: Callable[[str, bytes], None], on_drops: Callable[[int], None], on_rejected: Callable[[int, tuple], None]) -> dict:
+    """Tabla tipo de registro -> callback(payload, origen) del lado de HA"""
+    return {
+        RECORD_FRAME: lambda payload, senderAddr: on_frame(payload, senderAddr),
+        RECORD_DUPLICATE: lambda payload, senderAddr: on_duplicate(payload.decode()),
+        RECORD_INVALID: lambda payload, senderAddr: on_invalid(payload.decode(), senderAddr),
+        RECORD_KEEPALIVE: lambda payload, senderAddr: on_keepalive(*_split_keepalive(payload)),
+        RECORD_DROPS: lambda payload, senderAddr: on_drops(int(payload)),
+        RECORD_REJECTED: lambda payload, senderAddr: on_rejected(int(payload), senderAddr),
+    }
+
+
+def bind_shard_socket(address: str, port: int, rcvbuf: int = 0) -> tuple[socket.socket, bool]:
+    """Crea un socket UDP que comparte el puerto con los demas workers. Devuelve (socket, informa descartes del kernel)"""
+    if(not hasattr(socket, "SO_REUSEPORT")):
+        raise OSError("SO_REUSEPORT is not supported on this platform")
+    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        overflow_detection = configure_socket(sock, rcvbuf)
+        sock.bind((address, port))
+    except OSError:
+        sock.close()
+        raise
+    return (sock, overflow_detection)
+
+
+def receive_loop(sock: socket.socket, send: Callable[[bytes], None], overflow_detection: bool = False, sources: SIASourceFilter | None = None) -> None:
+    """Recibe, parsea, confirma y filtra duplicados en un socket bloqueante. Cada resultado sale como registro por send.
+       Solo lo que hay que despachar lleva la trama, el resto solo alimenta contadores. Lo usan los workers y el sidecar"""
+    sock.settimeout(None if sources is None else 1)                 # Con filtro de origen despierta para informar los rechazos pendientes
+    duplicates = SIADuplicateFilter()
+    drops_seen = 0
+    rejected = 0
+    (rejectedAddr, reported) = (None, time.monotonic())
+    while(True):
+        try:
+            if(overflow_detection):
+                (datagram, ancdata, _flags, senderAddr) = sock.recvmsg(SIA_BUFFERSIZE, _OVFL_SPACE)
+                total = kernel_drops(ancdata)
+                if(total is not None and total != drops_seen):
+                    send(_pack(RECORD_DROPS, senderAddr, str((total - drops_seen) & 0xFFFFFFFF).encode()))
+                    drops_seen = total
+            else:
+                (datagram, senderAddr) = sock.recvfrom(SIA_BUFFERSIZE)
+        except TimeoutError:
+            datagram = None
+        if(rejected > 0 and (datagram is None or time.monotonic() - reported >= 1)):
+            send(_pack(RECORD_REJECTED, rejectedAddr, str(rejected).encode()))     # Agrupado, un flood no satura el canal
+            (rejected, reported) = (0, time.monotonic())
+        if(datagram is None):
+            continue
+        if(sources is not None and sources.reject_reason(senderAddr) is not None):
+            (rejected, rejectedAddr) = (rejected + 1, senderAddr)
+            continue
+        try:
+            keepalive = keepalive_ack(datagram)
+            if(keepalive is not None):
+                sock.sendto(keepalive[1], senderAddr)
+                send(_pack(RECORD_KEEPALIVE, senderAddr, keepalive[0].encode() + b"_" + keepalive[2]))
+                continue
+            data = SIAFrameProcessor(datagram)
+            if(not data.valid):
+                send(_pack(RECORD_INVALID, senderAddr, data.error.encode()))
+                continue
+            sock.sendto(data.replyMessage(), senderAddr)            # El ACK sale desde aca, sin pasar por HA
+            if(duplicates.is_duplicate(data)):
+                send(_pack(RECORD_DUPLICATE, senderAddr, data.account.encode()))
+            else:
+                send(_pack(RECORD_FRAME, senderAddr, datagram))
+        except (BrokenPipeError, EOFError):
+            raise
+        except Exception as err:
+            logging.getLogger(__name__).exception(err)
+
+
+def worker_main(sock: socket.socket, conn, overflow_detection: bool = False, sources: SIASourceFilter | None = None) -> None:
+    """Proceso worker. Los registros viajan al proceso de HA por el pipe"""
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        receive_loop(sock, conn.send_bytes, overflow_detection, sources)
+    except (BrokenPipeError, EOFError):
+        return                                                      # El proceso de HA cerro el canal
+
+
+def join_processes(processes: list, timeout: float = 1) -> None:
+    """Espera que terminen los procesos. Bloquea, se corre en el executor"""
+    for process in processes:
+        process.join(timeout)
+
+
+class SIAShardPool:
+    """N procesos worker, cada uno con su socket en el mismo puerto. El kernel reparte las tramas por origen"""
+
+    def __init__(self, port: int, workers: int, address: str = '', rcvbuf: int = 0, sources: SIASourceFilter | None = None) -> None:
+        """Crea los sockets. El bind es sincronico para informar errores de inmediato"""
+        self.port = port
+        self.workers = workers
+        self.sockets: list[socket.socket] = []
+        self.overflow_detection = False
+        self.sources = sources
+        self.processes = []
+        self.channels = []
+        self.callbacks = {}
+        self.loop = None
+        try:
+            for _ in range(workers):
+                (sock, self.overflow_detection) = bind_shard_socket(address, port, rcvbuf)
+                self.sockets.append(sock)
+        except OSError:
+            for sock in self.sockets:
+                sock.close()
+            raise
+
+
+    def start(self, loop: asyncio.AbstractEventLoop, on_frame: Callable[[bytes, tuple], None],
+              on_duplicate: Callable[[str], None], on_invalid: Callable[[str, tuple], None], on_keepalive: Callable[[str, bytes], None],
+              on_drops: Callable[[int], None], on_rejected: Callable[[int, tuple], None]) -> None:
+        """Lanza los workers y registra sus canales en el loop"""
+        ctx = multiprocessing.get_context("spawn")          # fork no es seguro en un proceso con threads como HA
+        self.loop = loop
+        self.callbacks = record_handlers(on_frame, on_duplicate, on_invalid, on_keepalive, on_drops, on_rejected)
+        for (i, sock) in enumerate(self.sockets):
+            (reader, writer) = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=worker_main, args=(sock, writer, self.overflow_detection, self.sources), name=f"SIA-Worker-{i}", daemon=True)
+            process.start()
+            writer.close()
+            sock.close()                                    # El socket queda solo en el worker
+            loop.add_reader(reader.fileno(), self.__read_channel, reader)
+            self.processes.append(process)
+            self.channels.append(reader)
+        self.sockets = []
+        _LOGGER.info("[start] %d SIA workers listening on UDP port #%d", self.workers, self.port)
+
+
+    def __read_channel(self, reader) -> None:
+        """Vacia todos los registros pendientes de un worker"""
+        try:
+            while(reader.poll()):
+                (kind, senderAddr, payload) = unpack(reader.recv_bytes())
+                self.callbacks[kind](payload, senderAddr)
+        except (EOFError, OSError):
+            _LOGGER.error("[__read_channel] SIA worker channel closed")
+            self.loop.remove_reader(reader.fileno())
+
+
+    def alive(self) -> bool:
+        """True si todos los workers siguen corriendo"""
+        return len(self.processes) > 0 and all(p.is_alive() for p in self.processes)
+
+
+    def stop(self) -> asyncio.Future | None:
+        """Detiene los workers y cierra los canales. Devuelve la espera de los procesos, que corre en el executor"""
+        processes = self.processes
+        for reader in self.channels:
+            if(self.loop is not None):
+                self.loop.remove_reader(reader.fileno())
+            reader.close()
+        for process in processes:
+            process.terminate()
+        for sock in self.sockets:
+            sock.close()
+        self.channels = []
+        self.processes = []
+        self.sockets = []
+        if(len(processes) == 0 or self.loop is None):
+            return None
+        return self.loop.run_in_executor(None, join_processes, processes)   # Libera el puerto antes de un reinicio
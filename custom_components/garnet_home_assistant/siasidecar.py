@@ -0,0 +1,263 @@
+"""Receptor SIA en un proceso aparte (sidecar).
+
+El sidecar recibe, parsea, confirma y filtra duplicados (ver siashard.receive_loop), asi el ACK no depende de la carga
+de HA. Los registros se numeran y se entregan a la integracion por un socket Unix. Los ultimos quedan en un anillo
+para que un cliente que se reconecta pida lo que no recibio.
+
+Normalmente lo lanza SIAUDPServer. Tambien puede correrse por separado, la integracion lo usa si el socket ya existe:
+
+    python -m custom_components.garnet_home_assistant.siasidecar --port 2123 --socket /config/garnet_sia.sock
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+import threading
+import time
+
+from collections import deque
+from collections.abc import Callable
+from itertools import islice
+
+from .const import DEFAULT_SIA_RCVBUF, DEFAULT_UDP_PORT, SIA_SIDECAR_HEARTBEAT, SIA_SIDECAR_RING
+from .siaserver import SIASourceFilter, configure_socket
+from .siashard import join_processes, receive_loop, record_handlers, unpack
+
+
+_LOGGER = logging.getLogger(__name__)
+
+_WELCOME = struct.Struct("!QQQ")    # Sidecar -> cliente al conectar: instancia, primera secuencia en el anillo, proxima secuencia
+_HELLO = struct.Struct("!Q")        # Cliente -> sidecar: ultima secuencia recibida. Se envia lo posterior
+_HEADER = struct.Struct("!QI")      # Secuencia y largo del registro. Secuencia 0 es un heartbeat sin registro
+
+
+class SidecarRing:
+    """Registros numerados. Los ultimos size quedan para resincronizar"""
+
+    def __init__(self, size: int = SIA_SIDECAR_RING) -> None:
+        self.entries: deque[tuple[int, bytes]] = deque(maxlen=size)
+        self.next = 1
+        self.condition = threading.Condition()
+
+
+    def append(self, record: bytes) -> None:
+        with self.condition:
+            self.entries.append((self.next, record))
+            self.next += 1
+            self.condition.notify_all()
+
+
+    def first(self) -> int:
+        with self.condition:
+            return self.entries[0][0] if self.entries else self.next
+
+
+    def after(self, sequence: int, timeout: float) -> list[tuple[int, bytes]]:
+        """Registros posteriores a sequence. Espera hasta timeout si no hay ninguno"""
+        with self.condition:
+            if(self.next - 1 <= sequence):
+                self.condition.wait(timeout)
+            if(len(self.entries) == 0):
+                return []
+            start = max(0, sequence + 1 - self.entries[0][0])
+            return list(islice(self.entries, start, None))
+
+
+def _recv_exact(conn: socket.socket, size: int) -> bytes:
+    data = b""
+    while(len(data) < size):
+        chunk = conn.recv(size - len(data))
+        if(not chunk):
+            raise ConnectionError("client closed")
+        data += chunk
+    return data
+
+
+def _serve_client(conn: socket.socket, ring: SidecarRing, instance: int) -> None:
+    """Envia al cliente lo que no tiene y luego lo nuevo a medida que llega. Sin datos envia heartbeats"""
+    try:
+        conn.sendall(_WELCOME.pack(instance, ring.first(), ring.next))
+        (last,) = _HELLO.unpack(_recv_exact(conn, _HELLO.size))
+        while(True):
+            entries = ring.after(last, SIA_SIDECAR_HEARTBEAT)
+            if(len(entries) == 0):
+                conn.sendall(_HEADER.pack(0, 0))
+                continue
+            conn.sendall(b"".join(_HEADER.pack(seq, len(record)) + record for (seq, record) in entries))
+            last = entries[-1][0]
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+
+def sidecar_main(sock: socket.socket, path: str, overflow_detection: bool = False, sources: SIASourceFilter | None = None,
+                 ring_size: int = SIA_SIDECAR_RING) -> None:
+    """Proceso sidecar. Un thread recibe del socket UDP y el principal atiende a los clientes"""
+    logging.basicConfig(level=logging.WARNING)
+    ring = SidecarRing(ring_size)
+    instance = int.from_bytes(os.urandom(8), "big")
+    threading.Thread(target=receive_loop, args=(sock, ring.append, overflow_detection, sources), name="SIA-Sidecar-Receiver", daemon=True).start()
+    if(os.path.exists(path)):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(4)
+    while(True):
+        (conn, _) = server.accept()
+        threading.Thread(target=_serve_client, args=(conn, ring, instance), name="SIA-Sidecar-Client", daemon=True).start()
+
+
+def sidecar_running(path: str) -> bool:
+    """True si ya hay un sidecar atendiendo en path"""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+class SIASidecarClient:
+    """Lado de HA. Lanza el sidecar (o usa uno que ya corre) y recibe sus registros con reconexion y resincronizacion"""
+
+    def __init__(self, port: int, path: str, rcvbuf: int = 0, address: str = '', sources: SIASourceFilter | None = None) -> None:
+        """Si no hay sidecar corriendo crea el socket UDP. El bind es sincronico para informar errores de inmediato"""
+        self.port = port
+        self.path = path
+        self.sock = None
+        self.overflow_detection = False
+        self.sources = sources
+        self.process = None
+        self.task: asyncio.Task | None = None
+        self.loop = None
+        self.callbacks = {}
+        self.connected = False
+        self.heard = 0.0                    # Ultimo registro o heartbeat del sidecar (monotonic)
+        self.instance = None
+        self.last = 0
+        self.lost = 0
+        if(sidecar_running(path)):
+            _LOGGER.info("[__init__] Using running SIA sidecar at %s", path)
+            return
+        self.sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        try:
+            self.overflow_detection = configure_socket(self.sock, rcvbuf)
+            self.sock.bind((address, port))
+        except OSError:
+            self.sock.close()
+            raise
+
+
+    def start(self, loop: asyncio.AbstractEventLoop, on_frame: Callable[[bytes, tuple], None],
+              on_duplicate: Callable[[str], None], on_invalid: Callable[[str, tuple], None], on_keepalive: Callable[[str, bytes], None],
+              on_drops: Callable[[int], None], on_rejected: Callable[[int, tuple], None]) -> None:
+        """Lanza el sidecar si hace falta y la tarea que recibe sus registros"""
+        self.callbacks = record_handlers(on_frame, on_duplicate, on_invalid, on_keepalive, on_drops, on_rejected)
+        self.loop = loop
+        self.heard = time.monotonic()                       # Plazo para la primera conexion
+        if(self.sock is not None):
+            ctx = multiprocessing.get_context("spawn")
+            self.process = ctx.Process(target=sidecar_main, args=(self.sock, self.path, self.overflow_detection, self.sources), name="SIA-Sidecar", daemon=True)
+            self.process.start()
+            self.sock.close()                               # El socket queda solo en el sidecar
+            self.sock = None
+            _LOGGER.info("[start] SIA sidecar listening on UDP port #%d", self.port)
+        self.task = loop.create_task(self.__run(), name="SIA-Sidecar-Client")
+
+
+    async def __run(self) -> None:
+        """Mantiene la conexion con el sidecar. Al reconectar pide lo posterior al ultimo registro recibido"""
+        backoff = 0.1
+        while(True):
+            try:
+                (reader, writer) = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(backoff)                # El sidecar todavia no abrio el socket o se esta reiniciando
+                backoff = min(backoff * 2, 30)
+                continue
+            try:
+                await self.__resync(reader, writer)
+                backoff = 0.1
+                self.connected = True
+                while(True):
+                    (sequence, size) = _HEADER.unpack(await asyncio.wait_for(reader.readexactly(_HEADER.size), 3 * SIA_SIDECAR_HEARTBEAT))
+                    self.heard = time.monotonic()
+                    if(sequence == 0):
+                        continue
+                    (kind, senderAddr, payload) = unpack(await reader.readexactly(size))
+                    self.last = sequence
+                    try:
+                        self.callbacks[kind](payload, senderAddr)
+                    except Exception as err:
+                        _LOGGER.exception(err)
+            except (OSError, EOFError, asyncio.IncompleteReadError, TimeoutError, asyncio.TimeoutError) as err:
+                _LOGGER.warning("[__run] Connection with SIA sidecar lost (%s). Reconnecting", str(err) or type(err).__name__)
+            finally:
+                self.connected = False
+                writer.close()
+
+
+    async def __resync(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Acuerda desde que secuencia continuar. Si el sidecar es otro (se reinicio) se pide todo su anillo"""
+        (instance, first, _next) = _WELCOME.unpack(await reader.readexactly(_WELCOME.size))
+        if(instance != self.instance):
+            if(self.instance is not None):
+                _LOGGER.warning("[__resync] SIA sidecar was restarted, events received while it was down are lost")
+            self.instance = instance
+            self.last = 0
+        elif(self.last + 1 < first):
+            self.lost += first - self.last - 1
+            _LOGGER.warning("[__resync] %d SIA records lost while disconnected from sidecar", first - self.last - 1)
+        writer.write(_HELLO.pack(self.last))
+        await writer.drain()
+
+
+    def alive(self) -> bool:
+        """True si el sidecar corre (si lo lanzo esta instancia) y se supo de el dentro del plazo de heartbeat.
+           Vale tambien para un sidecar externo: sin conexion durante 3 heartbeats se considera caido"""
+        if(self.process is not None and not self.process.is_alive()):
+            return False
+        return self.connected or time.monotonic() - self.heard < 3 * SIA_SIDECAR_HEARTBEAT
+
+
+    def stop(self) -> asyncio.Future | None:
+        """Corta la conexion y detiene el sidecar si lo lanzo esta instancia. Devuelve la espera del proceso, que corre en el executor"""
+        if(self.task is not None):
+            self.task.cancel()
+            self.task = None
+        if(self.sock is not None):
+            self.sock.close()
+            self.sock = None
+        if(self.process is None):
+            return None
+        process = self.process
+        self.process = None
+        process.terminate()
+        if(self.loop is None):
+            return None
+        return self.loop.run_in_executor(None, join_processes, [process])   # Libera el puerto y el socket Unix antes de un reinicio
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Standalone SIA receiver for the Garnet integration")
+    parser.add_argument("--port", type=int, default=DEFAULT_UDP_PORT)
+    parser.add_argument("--socket", required=True, help="Unix socket path shared with Home Assistant")
+    parser.add_argument("--rcvbuf", type=int, default=DEFAULT_SIA_RCVBUF, help="receive buffer in KiB")
+    parser.add_argument("--bind", default='', help="listen address (default all)")
+    parser.add_argument("--allow", action="append", default=[], help="allowed source network, may be repeated (default any)")
+    args = parser.parse_args()
+    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    overflow_detection = configure_socket(sock, args.rcvbuf * 1024)
+    sock.bind((args.bind, args.port))
+    sidecar_main(sock, args.socket, overflow_detection, SIASourceFilter(args.allow))
+
+
+if __name__ == "__main__":
+    main()
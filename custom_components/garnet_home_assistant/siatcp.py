@@ -0,0 +1,110 @@
+"""Transporte SIA DC-09 sobre TCP con conexiones persistentes"""
+
+import asyncio
+import logging
+
+from collections.abc import Callable
+
+from .const import SIA_BUFFERSIZE, SIA_TCP_IDLE_TIMEOUT, SIA_TCP_MAX_CONNECTIONS
+
+
+_LOGGER = logging.getLogger(__name__)
+
+_HEADER_SIZE = 7        # \n + CRC (2) + '0' + largo (3 hex)
+
+
+def split_frames(buffer: bytearray) -> list[bytes]:
+    """Extrae las tramas completas del buffer de la conexion y deja en el lo que falta recibir.
+       No se puede cortar por \\r porque el CRC viaja en binario y puede contenerlo, se usa el largo del encabezado"""
+    frames = []
+    while(True):
+        start = buffer.find(b"\n")
+        if(start < 0):
+            buffer.clear()                  # Basura sin inicio de trama
+            return frames
+        if(start > 0):
+            del buffer[:start]
+        if(len(buffer) < _HEADER_SIZE):
+            return frames
+        try:
+            end = _HEADER_SIZE + int(buffer[4:7], 16)
+        except ValueError:
+            del buffer[:1]                  # Encabezado invalido, se busca el proximo inicio
+            continue
+        if(len(buffer) < end + 1):          # Falta el bloque de datos o el \r final
+            return frames
+        if(buffer[end] == 0x0D):
+            end = end + 1
+        frames.append(bytes(buffer[:end]))
+        del buffer[:end]
+
+
+class SIATCPServer:
+    """Listener TCP. Cada conexion tiene su buffer de armado de tramas y un timeout de inactividad.
+       Las tramas pasan por el mismo parser, ACK, filtro de duplicados y despacho que las recibidas por UDP"""
+
+    def __init__(self, process: Callable[[bytes, tuple, Callable[[bytes, tuple], None]], None], port: int, address: str = '',
+                 idle_timeout: float = SIA_TCP_IDLE_TIMEOUT, max_connections: int = SIA_TCP_MAX_CONNECTIONS,
+                 allowed: Callable[[str], bool] | None = None) -> None:
+        """process es el procesamiento de trama del receptor SIA: process(trama, origen, reply).
+           allowed(ip) decide si se acepta una conexion. Ademas process aplica el limite de tramas por origen"""
+        self.process = process
+        self.port = port
+        self.address = address
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.allowed = allowed
+        self.server: asyncio.Server | None = None
+        self.connections: set[asyncio.StreamWriter] = set()
+
+
+    async def async_start(self) -> None:
+        """Abre el listener TCP en el loop"""
+        self.server = await asyncio.start_server(self.__handle_connection, host=self.address or None, port=self.port, reuse_address=True)
+        _LOGGER.info("[async_start] SIA TCP Server listening @ TCP port #%d", self.port)
+
+
+    async def __handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Atiende una conexion persistente de un panel"""
+        peer = writer.get_extra_info("peername")
+        if(self.allowed is not None and not self.allowed(peer[0])):
+            _LOGGER.debug("[__handle_connection] SIA TCP connection from %s is not allowed", str(peer))
+            writer.close()
+            return
+        if(len(self.connections) >= self.max_connections):
+            _LOGGER.warning("[__handle_connection] Too many SIA TCP connections, %s rejected", str(peer))
+            writer.close()
+            return
+        _LOGGER.debug("[__handle_connection] New SIA TCP connection from %s", str(peer))
+        self.connections.add(writer)
+        buffer = bytearray()
+        reply = lambda ack, senderAddr: writer.write(ack)
+        try:
+            while(True):
+                chunk = await asyncio.wait_for(reader.read(SIA_BUFFERSIZE), self.idle_timeout)
+                if(not chunk):
+                    break
+                buffer += chunk
+                for frame in split_frames(buffer):
+                    self.process(frame, peer, reply)
+                if(len(buffer) > SIA_BUFFERSIZE):
+                    _LOGGER.warning("[__handle_connection] Oversized frame from %s discarded", str(peer))
+                    buffer.clear()
+                await writer.drain()
+        except (TimeoutError, asyncio.TimeoutError):
+            _LOGGER.debug("[__handle_connection] SIA TCP connection from %s idle, closing", str(peer))
+        except (ConnectionError, OSError) as err:
+            _LOGGER.debug("[__handle_connection] SIA TCP connection from %s lost: %s", str(peer), str(err))
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+
+    def close(self) -> None:
+        """Cierra el listener y todas las conexiones abiertas"""
+        if(self.server is not None):
+            self.server.close()
+            self.server = None
+        for writer in list(self.connections):
+            writer.close()
+        self.connections.clear()
@@ -0,0 +1,228 @@
+"""Benchmark del receptor SIA.
+
+Simula una flota de paneles que envian tramas DC-09 ADM-CID validas (keepalive, armado, desarmado, anulacion y
+disparo de zonas) contra el receptor real (siaserver) levantado en un puerto local, sin Home Assistant.
+Mide el RTT del ACK, tramas por segundo, ACK con CRC invalido, tramas sin ACK y la demora hasta que el evento
+llega al callback del suscriptor.
+
+    python scripts/sia_benchmark.py --panels 50 --rate 20 --duration 10
+"""
+
+import argparse
+import asyncio
+import importlib
+import multiprocessing
+import pathlib
+import random
+import statistics
+import sys
+import time
+import types
+
+
+PACKAGE = "garnet_home_assistant"
+ROOT = pathlib.Path(__file__).resolve().parent.parent / "custom_components" / PACKAGE
+
+
+def load_receiver():
+    """Importa los modulos del receptor sin ejecutar el __init__ del paquete, que depende de Home Assistant.
+       Se llama tambien en los procesos hijos (spawn) para que puedan importar siashard"""
+    if(PACKAGE not in sys.modules):
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [str(ROOT)]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.siaserver")
+
+
+siaserver = load_receiver()
+
+
+# Mezcla de eventos: (peso, token, payload CID o None). {p} particion, {z} zona, {u} usuario
+EVENT_MIX = [
+    (30, "NULL", None),
+    (10, "ADM-CID", "3401 {p} {u}"),      # Armado por usuario
+    (10, "ADM-CID", "1401 {p} {u}"),      # Desarmado por usuario
+    (10, "ADM-CID", "1570 {p} {z}"),      # Anulacion de zona
+    (10, "ADM-CID", "3570 {p} {z}"),      # Fin de anulacion
+    (15, "ADM-CID", "1130 {p} {z}"),      # Disparo de zona
+    (15, "ADM-CID", "3130 {p} {z}"),      # Restauracion de zona
+]
+
+
+def build_frame(account: str, sequence: int, token: str, payload: str | None) -> bytes:
+    """Arma una trama DC-09 con CRC correcto"""
+    stamp = time.strftime("_%H:%M:%S,%m-%d-%Y")
+    if(payload is None):
+        block = f'"{token}"{sequence:04d}R0L0#{account}[]{stamp}'.encode()
+    else:
+        block = f'"{token}"{sequence:04d}R0L0#{account}[#{account}|{payload}]{stamp}'.encode()
+    return b"\n" + siaserver.crc16(block).to_bytes(2, "big") + b"0" + b"%03X" % len(block) + block + b"\r"
+
+
+def parse_ack(ack: bytes) -> tuple[str, bool] | None:
+    """Devuelve (secuencia, CRC valido) de un ACK o None si no tiene el formato esperado"""
+    try:
+        start = ack.index(b'"ACK"')
+        block = ack[start:ack.rindex(b"\r")]
+        header = ack[1:start]                                   # CRC en hex (largo variable), '0' y largo en decimal
+        crc = int(header[:len(header) - len(str(len(block))) - 1], 16)
+        sequence = block[5:block.index(b"R")].decode()
+    except ValueError:
+        return None
+    return (sequence, siaserver.crc16(block) == crc)
+
+
+class Panel(asyncio.DatagramProtocol):
+    """Un panel simulado. Envia a ritmo fijo y registra el momento de envio de cada secuencia"""
+
+    def __init__(self, account: str, results: dict) -> None:
+        self.account = account
+        self.results = results
+        self.sequence = random.randrange(10000)
+        self.pending: dict[str, float] = {}
+        self.transport = None
+
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+
+    def datagram_received(self, datagram: bytes, senderAddr: tuple) -> None:
+        received = time.monotonic()
+        ack = parse_ack(datagram)
+        if(ack is None):
+            self.results["bad_ack"] += 1
+            return
+        (sequence, crc_ok) = ack
+        if(not crc_ok):
+            self.results["crc_failures"] += 1
+        sent = self.pending.pop(sequence, None)
+        if(sent is not None):
+            self.results["rtt"].append(received - sent)
+            self.results["acked"] += 1
+
+
+    def send(self) -> None:
+        (_, token, payload) = random.choices(EVENT_MIX, weights=[w for (w, _, _) in EVENT_MIX])[0]
+        self.sequence = (self.sequence + 1) % 10000
+        if(payload is not None):
+            payload = payload.format(p="01", z=f"{random.randint(1, 32):03d}", u=f"{random.randint(1, 16):03d}")
+        sequence = f"{self.sequence:04d}"
+        now = time.monotonic()
+        self.pending[sequence] = now
+        if(token != "NULL"):
+            self.results["sent_at"][(self.account, sequence)] = now
+        self.transport.sendto(build_frame(self.account, self.sequence, token, payload))
+        self.results["sent"] += 1
+
+
+async def run_fleet(port: int, panels: int, rate: float, duration: float) -> dict:
+    """Levanta los paneles y envia durante duration segundos. Cada panel arranca desfasado para no sincronizar rafagas"""
+    loop = asyncio.get_running_loop()
+    results = {"sent": 0, "acked": 0, "bad_ack": 0, "crc_failures": 0, "rtt": [], "sent_at": {}}
+    fleet = []
+    for n in range(panels):
+        (_, panel) = await loop.create_datagram_endpoint(lambda n=n: Panel(f"{9000 + n}", results), remote_addr=("127.0.0.1", port))
+        fleet.append(panel)
+
+    async def pace(panel: Panel) -> None:
+        await asyncio.sleep(random.random() / rate)
+        deadline = time.monotonic() + duration
+        next_send = time.monotonic()
+        while(next_send < deadline):
+            panel.send()
+            next_send += 1 / rate
+            await asyncio.sleep(max(0, next_send - time.monotonic()))
+
+    started = time.monotonic()
+    await asyncio.gather(*(pace(panel) for panel in fleet))
+    results["elapsed"] = time.monotonic() - started
+    await asyncio.sleep(1)                                  # Ultimos ACK en vuelo
+    for panel in fleet:
+        panel.transport.close()
+    results["unacked"] = sum(len(panel.pending) for panel in fleet)
+    return results
+
+
+def fleet_main(port: int, panels: int, rate: float, duration: float, conn) -> None:
+    """Proceso de la flota. Corre separado del receptor para no competir por el mismo event loop"""
+    conn.send(asyncio.run(run_fleet(port, panels, rate, duration)))
+    conn.close()
+
+
+class TimedDispatcher:
+    """Envuelve el despacho del receptor y registra cuando cada evento llega al suscriptor"""
+
+    def __init__(self, dispatcher, delivered: dict) -> None:
+        self.dispatcher = dispatcher
+        self.delivered = delivered
+
+
+    def __getattr__(self, name):
+        return getattr(self.dispatcher, name)
+
+
+    def dispatch(self, subscriber, frame) -> bool:
+        handled = self.dispatcher.dispatch(subscriber, frame)
+        self.delivered[(frame.account, frame.sequence)] = time.monotonic()
+        return handled
+
+
+def percentiles(values: list[float]) -> str:
+    if(len(values) < 2):
+        return "n/a"
+    q = statistics.quantiles(values, n=100)
+    return f"p50 {q[49] * 1000:.2f} ms  p95 {q[94] * 1000:.2f} ms  p99 {q[98] * 1000:.2f} ms  max {max(values) * 1000:.2f} ms"
+
+
+async def benchmark(args) -> None:
+    siaserver.SIA_BACKLOG_WINDOW = 0                        # Sin ventana de eventos atrasados, todo va directo al suscriptor
+    server = siaserver.SIAUDPServer(port=args.port, workers=args.workers, queue_size=args.queue_size)
+    server.sources.rate = 0                                 # Toda la flota sale de 127.0.0.1, sin limite por origen
+    delivered = {}
+    server.dispatcher = TimedDispatcher(server.dispatcher, delivered)
+    await server.async_start()
+    callbacks = {"count": 0}
+
+    def subscriber(**kwargs) -> None:
+        callbacks["count"] += 1
+
+    for n in range(args.panels):
+        server.add(subscriber, f"{9000 + n}")
+
+    ctx = multiprocessing.get_context("spawn")
+    (reader, writer) = ctx.Pipe(duplex=False)
+    fleet = ctx.Process(target=fleet_main, args=(args.port, args.panels, args.rate, args.duration, writer), name="SIA-Fleet")
+    fleet.start()
+    writer.close()
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(None, reader.recv)
+    fleet.join()
+    await asyncio.sleep(0.5)                                # Colas del receptor
+
+    latency = [delivered[key] - sent for (key, sent) in results["sent_at"].items() if key in delivered]
+    queues = server.queues.values()
+    print(f"panels {args.panels}  rate {args.rate}/s per panel  duration {results['elapsed']:.1f} s  workers {args.workers}")
+    print(f"sent {results['sent']}  acked {results['acked']}  unacked (dropped) {results['unacked']}  "
+          f"ACK CRC failures {results['crc_failures']}  malformed ACK {results['bad_ack']}")
+    print(f"throughput {results['acked'] / results['elapsed']:.0f} frames/s")
+    print(f"ACK RTT       {percentiles(results['rtt'])}")
+    print(f"callback      {percentiles(latency)}  ({callbacks['count']} callbacks, {len(results['sent_at']) - len(latency)} events not delivered)")
+    print(f"duplicates suppressed {server.duplicates.suppressed}  queue high water {max((q.high_water for q in queues), default=0)}  "
+          f"replaced {sum(q.replaced for q in queues)}  dropped {sum(q.dropped for q in queues)}")
+    server.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SIA receiver throughput and latency benchmark")
+    parser.add_argument("--port", type=int, default=12123, help="local UDP port for the receiver")
+    parser.add_argument("--panels", type=int, default=10, help="simulated panels (one account each)")
+    parser.add_argument("--rate", type=float, default=10, help="frames per second per panel")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of traffic")
+    parser.add_argument("--workers", type=int, default=0, help="receiver worker processes (see siashard)")
+    parser.add_argument("--queue-size", type=int, default=siaserver.SIA_QUEUE_SIZE, help="events queued per account")
+    asyncio.run(benchmark(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Configuracion comun de los tests.
+
+Los modulos del receptor SIA y de la cola de comandos no dependen de Home Assistant, pero el __init__ de la integracion
+si. Sin Home Assistant instalado el paquete se registra sin ejecutar su __init__ para poder importar esos modulos, y
+los pocos nombres de Home Assistant y aiohttp que importan api y httpapi se reemplazan por equivalentes minimos.
+La nube de Garnet, la sesion HTTP, la cache en disco y hass se simulan siempre (ver FakeGarnet y garnet).
+"""
+
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import threading
+import types
+
+from pathlib import Path
+
+import pytest
+
+
+COMPONENT = Path(__file__).resolve().parent.parent / "custom_components" / "garnet_home_assistant"
+
+
+def stand_in(name: str, **attributes) -> types.ModuleType:
+    """Registra un modulo con los atributos dados si no esta instalado"""
+    module = sys.modules.get(name)
+    if(module is None):
+        module = sys.modules[name] = types.ModuleType(name)
+    for (key, value) in attributes.items():
+        setattr(module, key, value)
+    return module
+
+
+if(importlib.util.find_spec("aiohttp") is None):
+    class ClientTimeout:
+        def __init__(self, total: float | None = None, **kwargs) -> None:
+            self.total = total
+    stand_in("aiohttp", ClientSession=object, ClientTimeout=ClientTimeout, ClientError=OSError)
+
+if(importlib.util.find_spec("homeassistant") is None):
+    for (name, path) in (("custom_components", COMPONENT.parent), ("custom_components.garnet_home_assistant", COMPONENT)):
+        if(name not in sys.modules):
+            package = types.ModuleType(name)
+            package.__path__ = [str(path)]
+            sys.modules[name] = package
+    for name in ("homeassistant", "homeassistant.helpers"):
+        stand_in(name).__path__ = []
+    stand_in("homeassistant.core", HomeAssistant=object)
+    stand_in("homeassistant.helpers.aiohttp_client", async_get_clientsession=None)      # Los tests usan FakeSession
+    stand_in("homeassistant.helpers.storage", Store=None)                              # Los tests usan FakeStore
+
+
+def sia_frame(body: bytes) -> bytes:
+    """Trama SIA DC-09 con CRC y largo para el bloque de datos"""
+    from custom_components.garnet_home_assistant.siaserver import crc16
+    return b"\n" + crc16(body).to_bytes(2, "big") + b"0" + b"%03X" % len(body) + body + b"\r"
+
+
+def cid_frame(sequence: int, event: bytes, account: bytes = b"1234", timestamp: bytes = b"12:00:01,01-02-2024") -> bytes:
+    """Trama ADM-CID. event es QEEE PP ZZZ, por ejemplo b"1130 01 003" """
+    return sia_frame(b'"ADM-CID"%04dR0L0#%s[#%s|%s]_%s' % (sequence, account, account, event, timestamp))
+
+
+STATUS_DISARMED = "1" + "0000" + "80" + "00" * 16      # Particion 1 lista, sin zonas abiertas, en alarma ni inhibidas
+
+
+def system_response(panelid: str = "P1") -> dict:
+    """Respuesta de /systems/<id> con una particion y dos zonas habilitadas"""
+    return {"success": True, "message": {"sistema": {
+        "id": panelid, "nombre": "Casa",
+        "userPermissions": {"atributos": {"puedeArmar": True, "puedeDesarmar": True, "puedeInhibirZonas": False,
+                                          "puedeInteractuarConSirena": True}},
+        "programation": {"data": {
+            "alarmPanel": {"model": 1, "version": 2, "modelName": "G-300", "versionName": "2.0"},
+            "partitions": [{"number": 1, "enabled": True, "name": "Planta baja"}, {"number": 2, "enabled": False, "name": ""}],
+            "zones": [{"number": 1, "enabled": True, "name": "Puerta", "icon": "0"}, {"number": 3, "enabled": True}],
+        }},
+    }}}
+
+
+class FakeGarnet:
+    """Nube de Garnet simulada. Registra los requests y responde segun la ruta.
+       delay demora cada respuesta, asi los tests pueden superponer requests"""
+
+    def __init__(self, panelid: str = "P1", password: str = "pw") -> None:
+        self.panelid = panelid
+        self.password = password
+        self.tokens: set[str] = set()
+        self.logins = 0
+        self.requests: list[tuple[str, str]] = []
+        self.status = STATUS_DISARMED
+        self.last_update = "2024-01-02T12:00:00Z"
+        self.delay = 0.0
+
+
+    def revoke(self) -> None:
+        """Invalida los tokens emitidos, como si vencieran en el servidor"""
+        self.tokens.clear()
+
+
+    def handle(self, method: str, path: str, body: dict | None, headers: dict) -> tuple[int, dict]:
+        self.requests.append((method, path))
+        if(path == "/users_api/v1/auth/login"):
+            if(body["password"] != self.password):
+                return (200, {"success": False, "message": "Usuario o contraseña incorrectos"})
+            self.logins += 1
+            token = f"token{self.logins}"
+            self.tokens.add(token)
+            return (200, {"success": True, "accessToken": token, "userData": {"nombre": "Ana", "apellido": "Gomez"}})
+        if(headers.get("x-access-token") not in self.tokens):
+            return (401, {"success": False, "message": "Failed to authenticate token."})
+        base = f"/users_api/v1/systems/{self.panelid}"
+        if(path == base):
+            return (200, system_response(self.panelid))
+        if(path == base + "/lastUpdate"):
+            return (200, {"success": True, "message": {"lastUpdate": self.last_update}})
+        if(path.startswith(base + "/commands/")):
+            return (200, {"success": True, "message": {"response": "COMANDO ENVIADO CON EXITO", "status": self.status}})
+        return (404, {"success": False, "message": "Not found"})
+
+
+class FakeResponse:
+    def __init__(self, garnet: FakeGarnet, method: str, path: str, body: dict | None, headers: dict) -> None:
+        self.request = (garnet, method, path, body, headers)
+        self.status = 0
+        self.data = b""
+
+
+    async def __aenter__(self) -> "FakeResponse":
+        (garnet, method, path, body, headers) = self.request
+        await asyncio.sleep(garnet.delay)
+        (self.status, response) = garnet.handle(method, path, body, headers)
+        self.data = json.dumps(response).encode()
+        return self
+
+
+    async def __aexit__(self, *exc) -> bool:
+        return False
+
+
+    async def read(self) -> bytes:
+        return self.data
+
+
+class FakeSession:
+    """Sesion aiohttp que envia los requests a FakeGarnet"""
+
+    def __init__(self, garnet: FakeGarnet) -> None:
+        self.garnet = garnet
+
+
+    def request(self, method: str, url: str, data: str = "", headers: dict | None = None, timeout=None) -> FakeResponse:
+        path = "/" + url.split("://", 1)[1].split("/", 1)[1]
+        return FakeResponse(self.garnet, method, path, json.loads(data) if data else None, headers or {})
+
+
+class FakeStore:
+    """Store de HA en memoria"""
+
+    def __init__(self, hass, version: int, key: str) -> None:
+        self.key = key
+        self.data = None
+
+
+    async def async_load(self):
+        return self.data
+
+
+    async def async_save(self, data) -> None:
+        self.data = json.loads(json.dumps(data))
+
+
+    def async_delay_save(self, data_func, delay: float = 0) -> None:
+        self.data = json.loads(json.dumps(data_func()))
+
+
+class FakeHass:
+    """Lo que GarnetAPI usa de HomeAssistant: el loop, rutas de configuracion y tareas de fondo"""
+
+    def __init__(self, config_dir: str) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.config = types.SimpleNamespace(path=lambda *parts: os.path.join(config_dir, *parts))
+        self.data = {}
+
+
+    def async_create_background_task(self, target, name: str) -> asyncio.Task:
+        return self.loop.create_task(target, name=name)
+
+
+@pytest.fixture
+def garnet(monkeypatch, tmp_path) -> FakeGarnet:
+    """Nube de Garnet simulada conectada a api y httpapi. Las caches de cada cuenta se conservan entre instancias de GarnetAPI,
+       el receptor SIA escucha en 127.0.0.1 en un puerto libre y se cierra al terminar el test"""
+    from custom_components.garnet_home_assistant import api
+    cloud = FakeGarnet()
+    stores: dict[str, FakeStore] = {}
+    monkeypatch.setattr(api, "async_get_clientsession", lambda hass: FakeSession(cloud))
+    monkeypatch.setattr(api, "Store", lambda hass, version, key: stores.setdefault(key, FakeStore(hass, version, key)))
+    monkeypatch.setattr(api.GarnetAPI, "sia_bind_address", "127.0.0.1")
+    cloud.config_dir = str(tmp_path)
+    yield cloud
+    if(api.GarnetAPI.messageserver is not None and not api.GarnetAPI.messageserver.closed):
+        api.GarnetAPI.messageserver.close()
+    api.GarnetAPI.messageserver = None
+
+
+async def connected_api(garnet: FakeGarnet, account: str = "1234", use_cache: bool = True):
+    """GarnetAPI conectado a la nube simulada, con hass simulado en el loop actual"""
+    from custom_components.garnet_home_assistant.api import GarnetAPI
+    api = GarnetAPI(FakeHass(garnet.config_dir), "a@b", "pw", account, garnet.panelid)
+    api.sia_port = 0
+    await api.async_connect(use_cache)
+    return api
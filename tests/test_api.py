@@ -0,0 +1,146 @@
+"""Tests de GarnetAPI: eventos SIA sobre el modelo de datos y publicacion al coordinador"""
+
+import asyncio
+import time
+
+import pytest
+
+from conftest import FakeHass, cid_frame, connected_api
+from custom_components.garnet_home_assistant.api import APIConnectionError, GarnetAPI
+from custom_components.garnet_home_assistant.const import ZONE_BASE_ID
+from custom_components.garnet_home_assistant.siaserver import siacode
+from custom_components.garnet_home_assistant.siajournal import read_journal
+
+
+def test_sia_events_coalesce_into_one_update(garnet):
+    async def run():
+        api = await connected_api(garnet)
+        updates = []
+        api.setcallback(updates.append)
+        api.coalesce_delay = 0.02
+        process = api._GarnetAPI__sia_processing_task
+        process(zone=1, action=siacode.bypass)
+        process(zone=3, action=siacode.bypass)
+        process(zone=1, action=siacode.triggerzone)
+        assert updates == []
+        await asyncio.sleep(0.05)
+        assert len(updates) == 1
+        zone = api.httpapi.__get_device_by_id__(ZONE_BASE_ID + 1)
+        assert zone.alarmed and zone.native_state & 2
+        assert api.metrics.value("coordinator_updates") == 1 and api.metrics.value("sia_state_changes") == 3
+        api.disconnect()
+    asyncio.run(run())
+
+
+def test_http_state_and_sia_events_apply_in_event_order(garnet, monkeypatch):
+    async def run():
+        api = await connected_api(garnet)
+        api.setcallback(lambda devices: None)
+        process = api._GarnetAPI__sia_processing_task
+        zone = api.httpapi.__get_device_by_id__(ZONE_BASE_ID + 1)
+        process(zone=1, action=siacode.triggerzone, timestamp=zone.state_time - 60)     # Anterior a la consulta HTTP
+        assert not zone.alarmed and api.metrics.value("sia_stale_events") == 1
+        process(zone=1, action=siacode.triggerzone)
+        assert zone.alarmed
+        now = time.time
+        with monkeypatch.context() as patch:                                            # Consulta enviada antes del disparo
+            patch.setattr(time, "time", lambda: now() - 60)
+            await api.httpapi.async_get_state()
+        assert zone.alarmed
+        await api.httpapi.async_get_state()
+        assert not zone.alarmed
+        api.disconnect()
+    asyncio.run(run())
+
+
+def test_replayed_journal_is_applied_with_the_replay_time(garnet, monkeypatch):
+    monkeypatch.setattr(GarnetAPI, "sia_journal", True)
+    async def run():
+        api = await connected_api(garnet)
+        api.setcallback(lambda devices: None)
+        server = api.messageserver
+        server._SIAUDPServer__close_backlog()
+        now = time.time
+        with monkeypatch.context() as patch:                               # Disparo de un minuto antes del estado leido por HTTP
+            patch.setattr(time, "time", lambda: now() - 60)
+            server.process(cid_frame(1, b"1130 01 001"), ("127.0.0.1", 5000), lambda reply, addr: None)
+            await asyncio.sleep(0.05)
+        zone = api.httpapi.__get_device_by_id__(ZONE_BASE_ID + 1)
+        assert not zone.alarmed and api.metrics.value("sia_stale_events") == 1
+        server.journal.close()
+        for _ in range(100):
+            if(read_journal(server.journal.directory)):
+                break
+            await asyncio.sleep(0.01)
+        assert await api.async_replay_journal(speed=0, retime=False) == 1
+        await asyncio.sleep(0.05)
+        assert not zone.alarmed and api.metrics.value("sia_stale_events") == 2
+        assert await api.async_replay_journal(speed=0) == 1
+        await asyncio.sleep(0.05)
+        assert zone.alarmed and api.metrics.value("sia_stale_events") == 2
+        api.disconnect()
+    asyncio.run(run())
+
+
+def test_receiver_options_are_applied_without_losing_subscribers(garnet):
+    async def run():
+        api = await connected_api(garnet)
+        server = api.messageserver
+        assert server.tcp is None and server.sources.permitted("127.0.0.1")
+        api.sia_tcp = True
+        api.sia_allowed_networks = "10.0.0.0/8"
+        await api.async_reconfigure_receiver()
+        assert api.messageserver is server and "1234" in server.subscribers
+        assert server.tcp is not None and server.alive()
+        replies = []
+        server.process(cid_frame(1, b"1130 01 001"), ("127.0.0.1", 5000), lambda reply, addr: replies.append(reply))
+        assert replies == [] and server.metrics.value("frames_rejected") == 1
+        api.disconnect()
+    asyncio.run(run())
+
+
+def test_reloaded_entry_receives_events_held_during_the_reload(garnet):
+    async def run():
+        api = await connected_api(garnet)
+        server = api.messageserver
+        server._SIAUDPServer__close_backlog()
+        await api.async_disconnect()
+        server.process(cid_frame(1, b"1130 01 001"), ("127.0.0.1", 5000), lambda reply, addr: None)
+        await asyncio.sleep(0.05)
+        assert len(server.queues["1234"]) == 1
+        reloaded = await connected_api(garnet)
+        reloaded.setcallback(lambda devices: None)
+        await asyncio.sleep(0.05)
+        assert reloaded.messageserver is server
+        assert reloaded.metrics.value("sia_events") == 1 and reloaded.metrics.value("sia_state_changes") == 1
+        reloaded.disconnect()
+    asyncio.run(run())
+
+
+def test_credentials_check_does_not_touch_the_receiver(garnet):
+    async def run():
+        api = GarnetAPI(FakeHass(garnet.config_dir), "a@b", "pw", "1234", garnet.panelid)
+        await api.async_check_credentials()
+        assert GarnetAPI.messageserver is None and garnet.logins == 1
+        bad = GarnetAPI(FakeHass(garnet.config_dir), "a@b", "wrong", "1234", garnet.panelid)
+        with pytest.raises(APIConnectionError):
+            await bad.async_check_credentials()
+        assert [task for task in asyncio.all_tasks() if task is not asyncio.current_task()] == []
+    asyncio.run(run())
+
+
+def test_cached_panel_connects_without_waiting_for_the_cloud(garnet):
+    async def run():
+        api = await connected_api(garnet)
+        await api.async_disconnect()
+        requests = len(garnet.requests)
+        reloaded = await connected_api(garnet)
+        reloaded.setcallback(lambda devices: None)
+        assert len(garnet.requests) == requests and reloaded.connected
+        assert [d.device_unique_id for d in reloaded.get_devices()] == [d.device_unique_id for d in api.httpapi.devices]
+        await asyncio.sleep(0.05)                                           # Revalidacion en segundo plano
+        paths = [path for (_, path) in garnet.requests[requests:]]
+        assert paths[0] == "/users_api/v1/auth/login" and "/users_api/v1/systems/P1" not in paths      # lastUpdate no cambio
+        assert reloaded.httpapi.user.name == "Ana Gomez"
+        reloaded.disconnect()
+    asyncio.run(run())
@@ -0,0 +1,73 @@
+"""Tests de la cola de comandos por panel"""
+
+import asyncio
+
+from custom_components.garnet_home_assistant.commandqueue import PRIORITY_POLL, PRIORITY_USER, PanelCommandQueue
+
+
+def command(log: list, name: str, delay: float = 0.01):
+    async def run():
+        log.append(("start", name))
+        await asyncio.sleep(delay)
+        log.append(("end", name))
+        return name
+    return run
+
+
+def test_commands_run_one_at_a_time_users_first():
+    async def run():
+        queue = PanelCommandQueue()
+        log = []
+        first = asyncio.create_task(queue.run(command(log, "first")))
+        await asyncio.sleep(0)
+        poll = asyncio.create_task(queue.run(command(log, "poll"), PRIORITY_POLL))
+        arm = asyncio.create_task(queue.run(command(log, "arm"), PRIORITY_USER))
+        horn = asyncio.create_task(queue.run(command(log, "horn"), PRIORITY_USER))
+        await asyncio.sleep(0)
+        assert queue.pending() == 3
+        assert await asyncio.gather(first, poll, arm, horn) == ["first", "poll", "arm", "horn"]
+        assert log == [("start", "first"), ("end", "first"), ("start", "arm"), ("end", "arm"),
+                       ("start", "horn"), ("end", "horn"), ("start", "poll"), ("end", "poll")]
+        assert not queue.busy and queue.metrics.value("http_commands") == 4
+    asyncio.run(run())
+
+
+def test_state_queries_are_single_flight():
+    async def run():
+        queue = PanelCommandQueue()
+        log = []
+        queries = [asyncio.create_task(queue.state(command(log, f"state{i}"))) for i in range(3)]
+        assert await asyncio.gather(*queries) == ["state0"] * 3
+        assert log == [("start", "state0"), ("end", "state0")]
+        assert queue.metrics.value("http_polls_merged") == 2
+        assert await queue.state(command(log, "state3")) == "state3"    # Terminada la consulta, la proxima es nueva
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_passes_the_turn():
+    async def run():
+        queue = PanelCommandQueue()
+        log = []
+        first = asyncio.create_task(queue.run(command(log, "first")))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(queue.run(command(log, "cancelled")))
+        last = asyncio.create_task(queue.run(command(log, "last")))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(first, last)
+        assert ("start", "cancelled") not in log and log[-1] == ("end", "last")
+        assert not queue.busy
+    asyncio.run(run())
+
+
+def test_cancelling_one_state_waiter_keeps_the_query():
+    async def run():
+        queue = PanelCommandQueue()
+        log = []
+        a = asyncio.create_task(queue.state(command(log, "state")))
+        b = asyncio.create_task(queue.state(command(log, "other")))
+        await asyncio.sleep(0)
+        a.cancel()
+        assert await b == "state"
+        assert log == [("start", "state"), ("end", "state")]
+    asyncio.run(run())
@@ -0,0 +1,124 @@
+"""Tests del cliente HTTP: orden de estados, manejo del token y cache en disco"""
+
+import asyncio
+import json
+
+import pytest
+
+from conftest import FakeGarnet, FakeSession, system_response
+from custom_components.garnet_home_assistant.httpapi import HTTP_API, DeviceType, GarnetEntity, InvokeGarnetAPIException
+
+
+def test_entity_accepts_within_reorder_window():
+    entity = GarnetEntity(device_id=1, device_unique_id="u", name="n", device_type=DeviceType.ZONE, native_state=None,
+                          alarmed=False, icon=None, uptime=0)
+    assert entity.accepts(100.0, window=2)
+    assert entity.accepts(99.0, window=2) and entity.state_time == 100.0        # Dentro de la ventana, no retrocede
+    assert not entity.accepts(97.0, window=2)
+    assert entity.accepts(105.0, window=2) and entity.state_time == 105.0
+
+
+def connected_http(garnet: FakeGarnet) -> HTTP_API:
+    return HTTP_API("a@b", garnet.password, garnet.panelid, "ctl", FakeSession(garnet))
+
+
+def test_concurrent_requests_share_one_login(garnet):
+    async def run():
+        api = connected_http(garnet)
+        garnet.delay = 0.01
+        assert await asyncio.gather(*(api.async_get_lastupdate() for _ in range(3))) == [garnet.last_update] * 3
+        assert garnet.logins == 1
+        api.close()
+    asyncio.run(run())
+
+
+def test_rejected_token_logs_in_again_once(garnet):
+    async def run():
+        api = connected_http(garnet)
+        await api.async_get_lastupdate()
+        garnet.revoke()
+        garnet.delay = 0.01
+        await asyncio.gather(api.async_get_lastupdate(), api.async_get_lastupdate())
+        assert garnet.logins == 2
+        api.close()
+    asyncio.run(run())
+
+
+def test_closed_api_does_not_log_in_or_refresh_again(garnet):
+    async def run():
+        api = connected_http(garnet)
+        await api.async_get_lastupdate()
+        assert api.refresh_handle is not None
+        garnet.delay = 0.05
+        state = asyncio.create_task(api.async_get_state())
+        await asyncio.sleep(0.01)
+        api.close()
+        assert api.refresh_handle is None
+        with pytest.raises(asyncio.CancelledError):
+            await state
+        garnet.revoke()
+        with pytest.raises(InvokeGarnetAPIException):
+            await api.async_get_lastupdate()
+        assert garnet.logins == 1 and api.refresh_handle is None and api.login_task is None
+    asyncio.run(run())
+
+
+def loaded_api(email: str = "a@b", panelid: str = "P1") -> HTTP_API:
+    api = HTTP_API(email, "pw", panelid, "ctl", None)
+    (permissions, api.system, api.devices, api.partition_mask, api.zone_mask) = api._HTTP_API__system_info_response(system_response(panelid))
+    for (key, value) in permissions.items():
+        setattr(api.user, key, value)
+    api.status_time = 1_700_000_000.0
+    api.last_update = "2024-01-02T12:00:00Z"
+    api.seq = 7
+    api.session_token.token = "secret-token"
+    api.devices[0].native_state = "armed_away"
+    return api
+
+
+def test_system_info_response_builds_model():
+    api = loaded_api()
+    assert (api.partition_mask, api.zone_mask) == (0b1, 0b101)
+    assert [d.device_unique_id for d in api.devices[:3]] == ["ctl_P_1", "ctl_Z_1", "ctl_Z_3"]
+    assert api.user.arm_permision and not api.user.disable_zone_permision
+
+
+def test_snapshot_round_trip_without_secrets():
+    snapshot = loaded_api().snapshot()
+    text = json.dumps(snapshot)
+    assert "secret-token" not in text and "a@b" not in text and "pw" not in text
+    api = HTTP_API(" A@B ", "pw", "P1", "ctl", None)
+    assert api.restore(json.loads(text))
+    assert api.snapshot() == snapshot
+    assert api.devices[0].device_type is DeviceType.PARTITION and api.devices[0].native_state == "armed_away"
+    assert api.session_token.token is None
+
+
+@pytest.mark.parametrize(("email", "panelid", "controller"), [("x@b", "P1", "ctl"), ("a@b", "P2", "ctl"), ("a@b", "P1", "other")])
+def test_restore_rejects_other_user_or_panel(email, panelid, controller):
+    api = HTTP_API(email, "pw", panelid, controller, None)
+    assert not api.restore(loaded_api().snapshot())
+    assert api.devices is None and api.system is None
+
+
+def test_restore_resets_state_on_broken_cache():
+    snapshot = loaded_api().snapshot()
+    del snapshot["devices"][0]["name"]
+    api = HTTP_API("a@b", "pw", "P1", "ctl", None)
+    assert not api.restore(snapshot)
+    assert (api.system, api.devices, api.partition_mask, api.zone_mask, api.status_time, api.seq) == (None, None, 0, 0, None, 1)
+    assert not api.user.arm_permision and api.user.email == "a@b"
+
+
+def test_permission_errors_after_restore_name_the_user_by_hash():
+    source = loaded_api()
+    source.user.disarm_permision = False
+    source.user.horn_permision = False
+    api = HTTP_API("a@b", "pw", "P1", "ctl", None)
+    assert api.restore(source.snapshot()) and api.user.name is None
+    async def run():
+        with pytest.raises(PermissionError, match="User [0-9a-f]{12} has no permision"):
+            await api.async_disarm_system(1)
+        with pytest.raises(PermissionError, match="User [0-9a-f]{12} has no permision"):
+            await api.async_horn_control("on")
+    asyncio.run(run())
@@ -0,0 +1,320 @@
+"""Tests del receptor SIA"""
+
+import asyncio
+import datetime
+import socket
+
+import pytest
+
+from conftest import cid_frame, sia_frame
+from custom_components.garnet_home_assistant import contactid, siaserver
+from custom_components.garnet_home_assistant.siaserver import (
+    SIAAckTemplate,
+    SIADispatcher,
+    SIADuplicateFilter,
+    SIAEventQueue,
+    SIAFrameProcessor,
+    SIAPanelClock,
+    SIAUDPServer,
+    crc16,
+    keepalive_ack,
+    siacode,
+)
+
+
+def baseline_crc16(data: bytes) -> int:
+    """CRC bit a bit, tal como lo calculaba la primera version del receptor"""
+    crcx = 0x0000
+    for b in data:
+        crcx ^= b
+        for _ in range(8):
+            crcx = ((crcx >> 1) ^ 0xA001) if (crcx & 0x0001) else (crcx >> 1)
+    return crcx
+
+
+def baseline_reply(sequence: str, receiver: str, prefix: str, account: str) -> bytes:
+    """ACK tal como lo armaba la primera version de SIAFrameProcessor.replyMessage"""
+    replymessage = f"\"ACK\"{sequence}{receiver}{prefix}{account}[]"
+    return f"\n{format(baseline_crc16(replymessage.encode()), '#04x')}0{str(len(replymessage))}{replymessage}\r".encode()
+
+
+def test_receiver_acks_frames_on_the_event_loop():
+    async def run():
+        server = SIAUDPServer(port=0, address="127.0.0.1")
+        port = server.sock.getsockname()[1]
+        await server.async_start()
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.setblocking(False)
+        loop = asyncio.get_running_loop()
+        try:
+            for (datagram, ack) in ((sia_frame(b'"NULL"0042R0L0#1234[]'), b'"ACK"0042R0L01234[]'),
+                                    (cid_frame(7, b"1130 01 003"), b'"ACK"0007R0L01234[]')):
+                client.sendto(datagram, ("127.0.0.1", port))
+                reply = await asyncio.wait_for(loop.sock_recv(client, 1024), 2)
+                assert reply.startswith(b"\n") and reply.endswith(ack + b"\r")
+            assert "1234" in server.last_seen and server.alive()
+        finally:
+            client.close()
+            server.close()
+        assert not server.alive() and server.closed
+    asyncio.run(run())
+
+
+def test_frame_processor_parses_cid():
+    data = SIAFrameProcessor(cid_frame(17, b"1130 02 005"))
+    assert data.valid and data.error is None
+    assert (data.token, data.sequence, data.receiver, data.prefix, data.account) == ("ADM-CID", "0017", "R0", "L0", "1234")
+    assert (data.qualifier, data.eventcode, data.partition, data.zone) == (1, 130, 2, 5)
+    assert data.timestamp == datetime.datetime(2024, 1, 2, 12, 0, 1)
+
+
+def test_frame_processor_extended_data_and_missing_timestamp():
+    data = SIAFrameProcessor(sia_frame(b'"ADM-CID"0001R0L0#1234[#1234|3401 01 002][Vx1]'))
+    assert data.valid
+    assert data.timestamp is None
+    assert data.optionalExtendedData == "Vx1"
+    assert (data.qualifier, data.eventcode) == (3, 401)
+
+
+@pytest.mark.parametrize(("datagram", "error"), [
+    (b"garbage", "bad header"),
+    (b"\n\x00\x000ZZZ\"NULL\"", "bad length"),
+    (cid_frame(1, b"1130 01 001")[:-12], "truncated frame"),
+    (b"\n\x00\x00" + cid_frame(1, b"1130 01 001")[3:], "crc mismatch"),
+    (sia_frame(b'"ADM-CID"0001R0L0#1234[#1234|11X0 01 001]'), "malformed CID payload"),
+    (sia_frame(b'"NULL"0001'), "missing header field"),
+])
+def test_frame_processor_rejects_malformed_frames(datagram, error):
+    data = SIAFrameProcessor(datagram)
+    assert not data.valid
+    assert data.error == error
+    assert data.account == ""
+
+
+@pytest.mark.parametrize("data", [b"", b"A", b'"ACK"0001R0L0#1234[]', bytes(range(256))])
+def test_crc16_matches_bitwise_implementation(data):
+    assert crc16(data) == baseline_crc16(data)
+
+
+def test_crc16_is_incremental():
+    assert crc16(b"world", crc16(b"hello ")) == crc16(b"hello world")
+
+
+@pytest.mark.parametrize("sequence", [b"0000", b"0042", b"9999"])
+def test_ack_template_matches_baseline_reply(sequence):
+    template = SIAAckTemplate(b"R0L0", b"1234")
+    assert template.build(sequence) == baseline_reply(sequence.decode(), "R0", "L0", "1234")
+
+
+def test_ack_template_reuses_last_ack():
+    template = SIAAckTemplate(b"R1L2", b"ABCD")
+    assert template.build(b"0007") is template.build(b"0007")
+
+
+def test_reply_message_matches_baseline_reply():
+    assert SIAFrameProcessor(cid_frame(17, b"1130 02 005")).replyMessage() == baseline_reply("0017", "R0", "L0", "1234")
+
+
+def test_keepalive_ack_null_and_periodic_test():
+    null = sia_frame(b'"NULL"0042R0L0#1234[]_12:00:00,01-02-2024')
+    assert keepalive_ack(null) == ("1234", baseline_reply("0042", "R0", "L0", "1234"), b"12:00:00,01-02-2024")
+    periodic = cid_frame(5, b"1602 00 000")
+    assert keepalive_ack(periodic) == ("1234", baseline_reply("0005", "R0", "L0", "1234"), b"12:00:01,01-02-2024")
+    assert keepalive_ack(sia_frame(b'"NULL"0001R0L0#1234[]'))[2] == b""
+
+
+@pytest.mark.parametrize("datagram", [
+    cid_frame(1, b"1130 01 001"),                                   # Evento normal, va por el parser
+    b"\n\x00\x00" + sia_frame(b'"NULL"0042R0L0#1234[]')[3:],        # CRC invalido
+    b"short",
+])
+def test_keepalive_ack_falls_back_to_parser(datagram):
+    assert keepalive_ack(datagram) is None
+
+
+def test_only_burglary_alarms_trigger_zones():
+    dispatcher = SIADispatcher()
+    calls = []
+    for event in (b"1130 01 003", b"1110 01 004", b"1100 01 005"):
+        dispatcher.dispatch(lambda **kw: calls.append(kw), SIAFrameProcessor(cid_frame(1, event)))
+    assert [call["action"] for call in calls] == [siacode.triggerzone, siacode.event, siacode.event]
+    assert calls[0]["zone"] == 3 and calls[0]["partition"] == 1
+    fire = SIAFrameProcessor(cid_frame(2, b"1110 01 004"))
+    assert dispatcher.is_alarm(fire)
+    assert 110 in contactid.ALARM_EVENTS and 110 not in contactid.ZONE_ALARM_EVENTS
+
+
+def test_dispatch_reports_unknown_codes():
+    assert not SIADispatcher().dispatch(lambda **kw: None, SIAFrameProcessor(cid_frame(1, b"1999 01 001")))
+
+
+def frame_at(account: str, event: bytes, sequence: int, when: datetime.datetime) -> SIAFrameProcessor:
+    return SIAFrameProcessor(cid_frame(sequence, event, account.encode(), when.strftime("%H:%M:%S,%m-%d-%Y").encode()))
+
+
+def test_fold_keeps_last_event_per_entity():
+    base = datetime.datetime(2024, 1, 2, 12, 0, 0)
+    frames = [
+        frame_at("1234", b"1130 01 003", 1, base),
+        frame_at("1234", b"3401 01 001", 2, base + datetime.timedelta(seconds=5)),     # Armado
+        frame_at("1234", b"3130 01 003", 3, base + datetime.timedelta(seconds=2)),     # Restauracion de la zona 3
+        frame_at("1234", b"1401 01 001", 4, base + datetime.timedelta(seconds=9)),     # Desarmado, pisa el armado
+    ]
+    folded = SIADispatcher().fold(frames)
+    assert [(f.qualifier, f.eventcode, f.zone) for f in folded] == [(3, 130, 3), (1, 401, 1)]
+
+
+def test_fold_discards_events_before_snapshot():
+    now = datetime.datetime(2024, 1, 2, 12, 0, 0)
+    frames = [frame_at("1234", b"1130 01 003", 1, now - datetime.timedelta(seconds=120)),
+              frame_at("1234", b"1130 01 004", 2, now - datetime.timedelta(seconds=30))]
+    assert [f.zone for f in SIADispatcher().fold(frames, now.timestamp() - 60)] == [4]
+
+
+def test_fold_discards_events_before_snapshot_using_panel_clock():
+    now = datetime.datetime(2024, 1, 2, 12, 0, 0)
+    clock = SIAPanelClock()
+    clock.observe("1234", now - datetime.timedelta(hours=1), now.timestamp())     # El panel atrasa una hora
+    frames = [
+        frame_at("1234", b"1130 01 003", 1, now - datetime.timedelta(hours=1, seconds=120)),
+        frame_at("1234", b"1130 01 004", 2, now - datetime.timedelta(hours=1, seconds=30)),
+    ]
+    since = now.timestamp() - 60
+    assert [f.zone for f in SIADispatcher().fold(frames, since, clock)] == [4]
+    assert [f.zone for f in SIADispatcher().fold(frames, since)] == []          # Sin desfase se toma el reloj del panel
+
+
+def test_panel_clock_ignores_late_frames():
+    clock = SIAPanelClock()
+    now = 1_700_000_000.0
+    panel = datetime.datetime.fromtimestamp(now)
+    clock.observe("1234", panel, now + 0.2)
+    clock.observe("1234", panel - datetime.timedelta(minutes=10), now + 1)
+    assert clock.skew("1234") == pytest.approx(0.2)
+
+
+def frame_now(sequence: int, event: bytes, seconds: float = 0) -> bytes:
+    """Trama con timestamp actual mas seconds"""
+    when = datetime.datetime.now() + datetime.timedelta(seconds=seconds)
+    return cid_frame(sequence, event, timestamp=when.strftime("%H:%M:%S,%m-%d-%Y").encode())
+
+
+def test_backlog_window_delivers_live_frames_and_alarms():
+    async def run():
+        server = SIAUDPServer(port=0, address="127.0.0.1")
+        await server.async_start()
+        events = []
+        server.add(lambda action, zone=0, **kw: events.append((action, zone)), "1234")
+        sender = ("127.0.0.1", 5000)
+        try:
+            assert server.backlog_open
+            for (sequence, event, seconds) in ((1, b"1570 01 004", -600), (2, b"3570 01 004", -590),   # Anulacion atrasada
+                                               (3, b"1130 01 005", -580),                             # Alarma atrasada
+                                               (4, b"1130 01 003", 0), (5, b"3130 01 003", 0)):       # Alarma actual y su restauracion
+                server.process(frame_now(sequence, event, seconds), sender, lambda ack, addr: None)
+            await asyncio.sleep(0.01)
+            assert events == [(siacode.triggerzone, 5), (siacode.triggerzone, 3), (siacode.restorezone, 3)]
+            server._SIAUDPServer__close_backlog()
+            await asyncio.sleep(0.01)
+            assert events[3:] == [(siacode.unbypass, 4)]
+        finally:
+            server.close()
+    asyncio.run(run())
+
+
+def test_duplicate_filter():
+    duplicates = SIADuplicateFilter(ttl=60)
+    first = SIAFrameProcessor(cid_frame(7, b"1130 01 003"))
+    assert not duplicates.is_duplicate(first)
+    assert duplicates.is_duplicate(SIAFrameProcessor(cid_frame(7, b"1130 01 003")))
+    assert not duplicates.is_duplicate(SIAFrameProcessor(cid_frame(8, b"1130 01 003")))
+    assert duplicates.suppressed == 1 and duplicates.suppressed_by_account == {"1234": 1}
+    null = SIAFrameProcessor(sia_frame(b'"NULL"0001R0L0#1234[]'))
+    assert not duplicates.is_duplicate(null) and not duplicates.is_duplicate(null)
+
+
+def test_duplicate_filter_expires_and_is_bounded():
+    duplicates = SIADuplicateFilter(ttl=0)
+    data = SIAFrameProcessor(cid_frame(7, b"1130 01 003"))
+    assert not duplicates.is_duplicate(data)
+    assert not duplicates.is_duplicate(data)
+    bounded = SIADuplicateFilter(ttl=60, size=2)
+    for sequence in range(3):
+        bounded.is_duplicate(SIAFrameProcessor(cid_frame(sequence, b"1130 01 003")))
+    assert len(bounded.seen) == 2
+    assert not bounded.is_duplicate(SIAFrameProcessor(cid_frame(0, b"1130 01 003")))
+
+
+def test_frame_processor_can_skip_crc():
+    corrupted = b"\n\x00\x00" + cid_frame(1, b"1130 01 001")[3:]
+    assert not SIAFrameProcessor(corrupted).valid
+    data = SIAFrameProcessor(corrupted, verify_crc=False)       # Trama ya validada por un worker
+    assert data.valid and data.zone == 1
+
+
+def queue_event(queue: SIAEventQueue, zone: int, alarm: bool = False) -> SIAFrameProcessor:
+    data = SIAFrameProcessor(cid_frame(zone, b"1130 01 %03d" % zone))
+    queue.put(data, ("zone", zone if zone < 100 else 1), alarm)
+    return data
+
+
+def test_event_queue_drop_oldest_never_drops_alarms():
+    async def run():
+        queue = SIAEventQueue("1234", size=2, policy="drop_oldest")
+        alarm = queue_event(queue, 1, alarm=True)
+        queue_event(queue, 2)
+        newest = queue_event(queue, 3)
+        assert [e[2] for e in queue.events] == [alarm, newest] and queue.dropped == 1
+        other = queue_event(queue, 4, alarm=True)
+        assert [e[2] for e in queue.events] == [alarm, other]
+        queue_event(queue, 5, alarm=True)
+        assert len(queue) == 3 and queue.high_water == 3            # Solo alarmas: se excede el limite
+        queue_event(queue, 6)
+        assert len(queue) == 3 and queue.dropped == 3               # Un evento comun no entra
+    asyncio.run(run())
+
+
+def test_event_queue_latest_replaces_same_entity():
+    async def run():
+        queue = SIAEventQueue("1234", size=2, policy="latest")
+        queue_event(queue, 101)
+        queue_event(queue, 2)
+        replacement = queue_event(queue, 102)
+        assert [e[0] for e in queue.events] == [("zone", 2), ("zone", 1)]
+        assert queue.events[1][2] is replacement and queue.replaced == 1
+    asyncio.run(run())
+
+
+def test_slow_subscriber_does_not_block_the_receiver():
+    async def run():
+        server = SIAUDPServer(port=0, address="127.0.0.1")
+        await server.async_start()
+        server._SIAUDPServer__close_backlog()
+        events = []
+        server.add(lambda action, zone=0, **kw: events.append(zone), "1234")
+        acks = []
+        try:
+            for zone in range(1, 4):
+                server.process(cid_frame(zone, b"1130 01 %03d" % zone), ("127.0.0.1", 5000), lambda ack, addr: acks.append(ack))
+            assert len(acks) == 3 and events == []                  # Confirmado y encolado, el suscriptor corre despues
+            await asyncio.sleep(0.01)
+            assert events == [1, 2, 3]
+        finally:
+            server.close()
+    asyncio.run(run())
+
+
+def test_receiver_forgets_removed_and_least_recent_accounts(monkeypatch):
+    monkeypatch.setattr(siaserver, "SIA_SEEN_ACCOUNTS", 3)
+    async def run():
+        server = SIAUDPServer(port=0, address="127.0.0.1")
+        server.add(lambda **kwargs: None, "1234")
+        server.add(lambda **kwargs: None, "5678")
+        for account in (b"1234", b"5678", b"1111", b"2222"):
+            server.process(sia_frame(b'"NULL"0001R0L0#%s[]_12:00:00,01-02-2024' % account), ("127.0.0.1", 5000), lambda reply, addr: None)
+        assert list(server.last_seen) == ["5678", "1111", "2222"]
+        assert "1234" not in server.clock.offsets and "2222" in server.clock.offsets
+        server.remove("5678")
+        assert "5678" not in server.last_seen and "5678" not in server.clock.offsets
+        server.close()
+    asyncio.run(run())
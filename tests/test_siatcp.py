@@ -0,0 +1,56 @@
+"""Tests del armado de tramas del listener TCP"""
+
+import asyncio
+
+from conftest import cid_frame, sia_frame
+from custom_components.garnet_home_assistant.siaserver import SIAUDPServer
+from custom_components.garnet_home_assistant.siatcp import split_frames
+
+
+def test_split_frames_keeps_incomplete_tail():
+    first = cid_frame(1, b"1130 01 001")
+    second = cid_frame(2, b"3130 01 001")
+    buffer = bytearray(first + second[:10])
+    assert split_frames(buffer) == [first]
+    assert buffer == second[:10]
+    buffer += second[10:]
+    assert split_frames(buffer) == [second]
+    assert buffer == b""
+
+
+def test_split_frames_uses_length_not_carriage_return():
+    body = b'"NULL"0001R0L0#1234[]'
+    frame = sia_frame(body)
+    crafted = b"\n\r\r" + frame[3:]                  # Un CRC con \r no corta la trama
+    buffer = bytearray(crafted + frame)
+    assert split_frames(buffer) == [crafted, frame]
+
+
+def test_split_frames_skips_garbage():
+    frame = cid_frame(1, b"1130 01 001")
+    buffer = bytearray(b"xx" + frame + b"noise")
+    assert split_frames(buffer) == [frame]
+    assert buffer == b""
+    buffer = bytearray(b"\n\x00\x000ZZZ" + frame)   # Encabezado invalido, se busca el proximo inicio
+    assert split_frames(buffer) == [frame]
+
+
+def test_tcp_connection_acks_each_frame():
+    async def run():
+        server = SIAUDPServer(port=0, address="127.0.0.1", tcp=True)
+        await server.async_start()
+        port = server.tcp.server.sockets[0].getsockname()[1]
+        (reader, writer) = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            first = cid_frame(1, b"1130 01 001")
+            second = sia_frame(b'"NULL"0002R0L0#1234[]')
+            writer.write(first + second[:5])                # Una trama y media en el mismo segmento
+            await writer.drain()
+            assert (await asyncio.wait_for(reader.readuntil(b"\r"), 2)).endswith(b'"ACK"0001R0L01234[]\r')
+            writer.write(second[5:])
+            await writer.drain()
+            assert (await asyncio.wait_for(reader.readuntil(b"\r"), 2)).endswith(b'"ACK"0002R0L01234[]\r')
+        finally:
+            writer.close()
+            server.close()
+    asyncio.run(run())